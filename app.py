@@ -1,36 +1,47 @@
 import streamlit as st
 import os
-import io
 import base64
 import uuid
 import json
 import hashlib
 import asyncio
-import aiohttp
-import fitz  # PyMuPDF
 import re
 from urllib.parse import urlparse, quote_plus
 from datetime import datetime, timedelta
-from openai import OpenAI
-from pypdf import PdfReader
 import gspread 
-from tavily import TavilyClient
 import plotly.express as px
 import pandas as pd
 
 # Imports locaux
 import config
 from utils_pdf import generate_pdf_report
+from utils_logs import UsageLogBuffer
+from utils_http import HttpPool, TavilyAsync, TokenBucket, DailyQuota, GoogleCseScheduler
+from utils_cache import DiskCache, UrlCache, DocumentTextCache, LlmCache, llm_cache_key, canonical_url
+from utils_llm import LlmClientRegistry
+from utils_prompt import PromptAssembler, count_tokens, truncate_tokens, format_prompt_report
+from utils_runtime import get_runtime, SingleFlight, ProcessWorkerPool, bounded_fanout, flight_key
+from utils_text import process_pdf_source, read_pdf_document
+from utils_retrieval import BM25Index, chunk_text, parse_requirements, select_passages, format_passages, split_sections, merge_eva_findings, rank_sources
+from utils_storage import GSheetStorage, SQLiteStorage, StorageSyncJob, import_from_sheet
+from utils_watch import MIA_TIMEFRAMES, run_watch
 
 # =============================================================================
 # 0. CONFIGURATION
 # =============================================================================
-st.set_page_config(
-    page_title=config.APP_NAME,
-    page_icon=config.APP_ICON,
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Les workers du pool PDF réimportent ce script sous le nom "__mp_main__" :
+# ni page, ni état de session, ni accès au stockage dans ce cas
+IS_POOL_WORKER = __name__ == "__mp_main__"
+# Import depuis mia_worker.py (runs planifiés) : pipeline seul, sans page ni session
+IS_HEADLESS = IS_POOL_WORKER or __name__ != "__main__"
+
+if not IS_HEADLESS:
+    st.set_page_config(
+        page_title=config.APP_NAME,
+        page_icon=config.APP_ICON,
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
 
 if "mia" not in config.AGENTS:
     config.AGENTS["mia"] = {
@@ -53,7 +64,10 @@ DEFAULT_APP_CONFIG = {
     "cache_ttl_hours": "1",
     "max_search_results": "20",
     "provider_google": "TRUE",
-    "provider_tavily": "TRUE"
+    "provider_tavily": "TRUE",
+    "google_daily_quota": "10000",
+    "mia_streaming": "TRUE",
+    "mia_scheduler": "TRUE"
 }
 
 def get_google_search_keys():
@@ -84,163 +98,146 @@ def get_gsheet_workbook():
     except Exception as e: 
         return None
 
+@st.cache_resource
+def get_storage():
+    defaults = {"markets": config.DEFAULT_MARKETS, "domains": DEFAULT_DOMAINS, "config": DEFAULT_APP_CONFIG}
+    backend = (os.getenv("STORAGE_BACKEND") or config.STORAGE_BACKEND).lower()
+    try:
+        if backend == "sqlite":
+            store = SQLiteStorage(os.path.join(config.DATA_DIR, config.SQLITE_FILE), defaults)
+            wb = get_gsheet_workbook()
+            if wb and not store.sheet_imported():
+                # Base neuve : reprise du classeur existant (sinon le job de synchro est réessayé plus tard)
+                try: import_from_sheet(store, wb)
+                except: pass
+            return store
+        wb = get_gsheet_workbook()
+        return GSheetStorage(wb, defaults, ttl=config.SHEETS_SNAPSHOT_TTL) if wb else None
+    except: return None
+
+@st.cache_resource
+def get_storage_sync_job():
+    # Miroir SQLite -> Google Sheets pour ceux qui préfèrent la vue tableur
+    store, wb = get_storage(), get_gsheet_workbook()
+    if not isinstance(store, SQLiteStorage) or not wb: return None
+    return StorageSyncJob(store, wb, interval=config.STORAGE_SYNC_INTERVAL)
+
 def get_app_config():
-    wb = get_gsheet_workbook()
-    config_dict = DEFAULT_APP_CONFIG.copy()
-    if wb:
-        try:
-            try: sheet = wb.worksheet("MIA_App_Config")
-            except:
-                sheet = wb.add_worksheet("MIA_App_Config", 20, 2)
-                sheet.append_row(["Setting_Key", "Value"])
-                for k, v in DEFAULT_APP_CONFIG.items(): sheet.append_row([k, v])
-                return config_dict
-            
-            rows = sheet.get_all_values()
-            existing_keys = set()
-            if len(rows) > 1:
-                for row in rows[1:]:
-                    if len(row) >= 2:
-                        k, v = str(row[0]).strip(), str(row[1]).strip()
-                        config_dict[k] = v
-                        existing_keys.add(k)
-            
-            missing = [k for k in DEFAULT_APP_CONFIG if k not in existing_keys]
-            for k in missing: sheet.append_row([k, DEFAULT_APP_CONFIG[k]])
+    store = get_storage()
+    if store:
+        try: return store.get_app_config()
         except: pass
-    return config_dict
+    return DEFAULT_APP_CONFIG.copy()
 
 def update_app_config(key, value):
-    wb = get_gsheet_workbook()
-    if wb:
-        try:
-            sheet = wb.worksheet("MIA_App_Config")
-            cell = sheet.find(key)
-            if cell: sheet.update_cell(cell.row, 2, str(value))
-            else: sheet.append_row([key, str(value)])
-            st.cache_data.clear()
-            return True
+    store = get_storage()
+    if store:
+        try: store.update_app_config(key, value); return True
         except: pass
     return False
 
+@st.cache_resource
+def get_usage_logger():
+    store = get_storage()
+    if not store: return None
+    get_storage_sync_job()
+    return UsageLogBuffer(
+        store.append_logs,
+        spill_path=os.path.join(config.DATA_DIR, config.LOG_SPILL_FILE),
+        max_queue=config.LOG_QUEUE_MAX, batch_size=config.LOG_BATCH_SIZE, flush_interval=config.LOG_FLUSH_INTERVAL
+    )
+
 def log_usage(report_type, report_id, details="", extra_metrics=""):
-    wb = get_gsheet_workbook()
-    if not wb: return
-    try:
-        try: log_sheet = wb.worksheet("Logs")
-        except: log_sheet = wb.add_worksheet(title="Logs", rows=1000, cols=6)
-        if not log_sheet.cell(1, 1).value:
-            log_sheet.update("A1:F1", [["Date", "Time", "Report ID", "Type", "Details", "Metrics"]])
-        now = datetime.now()
-        log_sheet.append_row([now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), report_id, report_type, details, extra_metrics])
-    except: pass
+    logger = get_usage_logger()
+    if not logger: return
+    now = datetime.now()
+    logger.log([now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"), report_id, report_type, details, extra_metrics])
 
 # --- HELPERS BDD ---
 def get_markets():
-    wb = get_gsheet_workbook()
-    if wb:
-        try: 
-            vals = wb.sheet1.col_values(1)
-            if not vals:
-                 for m in config.DEFAULT_MARKETS: wb.sheet1.append_row([m])
-                 return config.DEFAULT_MARKETS, True
-            return vals, True
+    store = get_storage()
+    if store:
+        try: return store.get_markets(), True
         except: pass
     return [], False
 
 def add_market(name):
-    wb = get_gsheet_workbook()
-    if wb:
-        try:
-            if name not in wb.sheet1.col_values(1): wb.sheet1.append_row([name]); st.cache_data.clear(); return True
+    store = get_storage()
+    if store:
+        try: return store.add_market(name)
         except: pass
     return False
 
 def remove_market(idx):
-    wb = get_gsheet_workbook()
-    if wb:
-        try: wb.sheet1.delete_rows(idx + 1); st.cache_data.clear()
+    store = get_storage()
+    if store:
+        try: store.remove_market(idx)
         except: pass
 
 def update_market(idx, name):
-    wb = get_gsheet_workbook()
-    if wb:
-        try: wb.sheet1.update_cell(idx + 1, 1, name); st.cache_data.clear()
+    store = get_storage()
+    if store:
+        try: store.update_market(idx, name)
         except: pass
 
 def get_domains():
-    wb = get_gsheet_workbook()
-    if wb:
-        try:
-            try: sheet = wb.worksheet("Watch_domains")
-            except: 
-                sheet = wb.add_worksheet("Watch_domains", 100, 1)
-                for d in DEFAULT_DOMAINS: sheet.append_row([d])
-                return DEFAULT_DOMAINS, True
-            vals = sheet.col_values(1)
-            if not vals:
-                 for d in DEFAULT_DOMAINS: sheet.append_row([d])
-                 return DEFAULT_DOMAINS, True
-            return vals, True
+    store = get_storage()
+    if store:
+        try: return store.get_domains(), True
         except: pass
     return [], False
 
 def add_domain(name):
-    wb = get_gsheet_workbook()
-    if wb:
-        try:
-            sh = wb.worksheet("Watch_domains")
-            if name not in sh.col_values(1): sh.append_row([name]); st.cache_data.clear(); return True
+    store = get_storage()
+    if store:
+        try: return store.add_domain(name)
         except: pass
     return False
 
 def remove_domain(idx):
-    wb = get_gsheet_workbook()
-    if wb:
-        try: wb.worksheet("Watch_domains").delete_rows(idx + 1); st.cache_data.clear()
+    store = get_storage()
+    if store:
+        try: store.remove_domain(idx)
         except: pass
 
 def update_domain(idx, name):
-    wb = get_gsheet_workbook()
-    if wb:
-        try: wb.worksheet("Watch_domains").update_cell(idx + 1, 1, name); st.cache_data.clear()
+    store = get_storage()
+    if store:
+        try: store.update_domain(idx, name)
         except: pass
 
 def get_watchlists():
-    wb = get_gsheet_workbook()
-    watchlists = []
-    if wb:
-        try:
-            try: sheet = wb.worksheet("Watchlists")
-            except: 
-                sheet = wb.add_worksheet("Watchlists", 100, 5)
-                sheet.append_row(["ID", "Name", "Topic", "Markets", "Timeframe"])
-                return []
-            rows = sheet.get_all_values()
-            if len(rows) > 1:
-                for row in rows[1:]:
-                    if len(row) >= 5:
-                        watchlists.append({"id":row[0], "name":row[1], "topic":row[2], "markets":row[3], "timeframe":row[4]})
+    store = get_storage()
+    if store:
+        try: return store.get_watchlists()
         except: pass
-    return watchlists
+    return []
 
 def save_watchlist(name, topic, markets_list, timeframe):
-    wb = get_gsheet_workbook()
-    if wb:
-        try:
-            sheet = wb.worksheet("Watchlists")
-            sheet.append_row([str(uuid.uuid4())[:8], name, topic, ", ".join(markets_list), timeframe])
-            return True
+    store = get_storage()
+    if store:
+        try: store.save_watchlist(name, topic, ", ".join(markets_list), timeframe); return True
         except: pass
     return False
 
 def delete_watchlist(watchlist_id):
-    wb = get_gsheet_workbook()
-    if wb:
-        try:
-            sheet = wb.worksheet("Watchlists")
-            cell = sheet.find(watchlist_id)
-            if cell: sheet.delete_rows(cell.row); return True
+    store = get_storage()
+    if store:
+        try: return store.delete_watchlist(watchlist_id)
+        except: pass
+    return False
+
+def get_watchlist_state(watchlist_id):
+    store = get_storage()
+    if store:
+        try: return store.get_watchlist_state(watchlist_id)
+        except: pass
+    return None
+
+def save_watchlist_state(watchlist_id, state):
+    store = get_storage()
+    if store:
+        try: store.save_watchlist_state(watchlist_id, state); return True
         except: pass
     return False
 
@@ -274,55 +271,131 @@ def init_session_state():
         if key not in st.session_state:
             st.session_state[key] = value
 
-init_session_state()
+if not IS_HEADLESS: init_session_state()
 
 # =============================================================================
 # 4. API & SEARCH & CACHING
 # =============================================================================
 def get_api_key(): return st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
+@st.cache_resource
 def get_openai_client():
+    # Registre unique (clients sync/async poolés, retries, plafonds par modèle) pour tous les agents
     k = get_api_key()
-    return OpenAI(api_key=k) if k else None
+    if not k: return None
+    return LlmClientRegistry(
+        k, timeout=config.LLM_TIMEOUT, max_connections=config.LLM_MAX_CONNECTIONS, max_keepalive=config.LLM_MAX_KEEPALIVE,
+        max_retries=config.LLM_MAX_RETRIES, model_limits=config.LLM_MODEL_CONCURRENCY, default_limit=config.LLM_DEFAULT_CONCURRENCY
+    )
+
+@st.cache_resource
+def get_http_pool():
+    # Session créée à la première requête, sur la boucle du runtime : partagée par tous les reruns
+    return HttpPool(
+        limit=config.HTTP_POOL_LIMIT, limit_per_host=config.HTTP_LIMIT_PER_HOST, dns_ttl=config.HTTP_DNS_TTL,
+        keepalive=config.HTTP_KEEPALIVE, max_concurrency=config.HTTP_MAX_CONCURRENCY, timeout=config.HTTP_TIMEOUT
+    )
+
+@st.cache_resource
+def get_google_rate_limiter():
+    return TokenBucket(rate=config.GOOGLE_CSE_QPM / 60, capacity=config.GOOGLE_CSE_BURST)
+
+@st.cache_resource
+def get_llm_rate_limiter():
+    # Partagé par toutes les sessions : les lots (impact, fan-out) ne dépassent pas le débit autorisé
+    return TokenBucket(rate=config.LLM_BATCH_RPM / 60, capacity=config.LLM_BATCH_BURST)
 
-def extract_pdf_content_by_density(pdf_bytes, keywords, window_size=500):
+@st.cache_resource
+def get_google_quota():
+    store = get_storage()
+    # Relu à la source à chaque persistance : l'application et mia_worker.py partagent ce compteur
+    load = (lambda: store.get_config_value("google_cse_usage")) if store else None
+    save = (lambda v: store.update_app_config("google_cse_usage", v)) if store else None
+    return DailyQuota(int(DEFAULT_APP_CONFIG["google_daily_quota"]), load, save)
+
+def persist_google_quota():
+    try: get_google_quota().persist()
+    except: pass
+
+@st.cache_resource
+def get_tavily_client():
+    api_key = st.secrets.get("TAVILY_API_KEY")
+    if not api_key: return None
+    return TavilyAsync(get_http_pool(), api_key, max_concurrency=config.TAVILY_MAX_CONCURRENCY, timeout=config.TAVILY_TIMEOUT)
+
+@st.cache_resource
+def get_url_cache():
     try:
-        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-        full_text = ""
-        for page in doc: full_text += page.get_text() + "\n"
-        doc.close()
-        if not full_text.strip(): return "Error: Scanned PDF."
-        
-        words = re.findall(r'\b\w+\b', full_text.lower())
-        norm_keywords = [w.lower() for w in keywords if len(w) > 2]
-        if not norm_keywords: return full_text[:3000] 
-
-        best_score = -1
-        best_window_text = ""
-        for i in range(0, len(words), 100):
-            end = min(i + window_size, len(words))
-            window = words[i:end]
-            score = sum(window.count(k) for k in norm_keywords)
-            if score > best_score:
-                best_score = score
-                snippet_start = full_text.lower().find(' '.join(words[i:i+5]).lower())
-                if snippet_start != -1:
-                    best_window_text = full_text[snippet_start : snippet_start + 4000]
-        return best_window_text.strip() if best_window_text else full_text[:3000]
+        store = DiskCache(os.path.join(config.DATA_DIR, config.URL_CACHE_DIR), config.URL_CACHE_MAX_MB * 1024 * 1024)
+        return UrlCache(store, fresh_seconds=config.URL_CACHE_FRESH_SECONDS, tavily_ttl=config.TAVILY_CACHE_TTL)
+    except: return None
+
+def build_mia_context(app_config=None):
+    """Tout ce qui dépend de Streamlit (session, secrets, ressources) est résolu dans le thread
+    du script : les coroutines du pipeline tournent sur le runtime, sans accès à la session.
+    Hors session (worker), la configuration est passée explicitement."""
+    if app_config is None: app_config = st.session_state.get("app_config", {})
+    doms, _ = get_domains()
+    quota = get_google_quota()
+    try: quota.limit = int(app_config.get("google_daily_quota", quota.limit))
+    except ValueError: pass
+    return {
+        "domains": doms,
+        "google_enabled": app_config.get("provider_google", "TRUE") != "FALSE",
+        "tavily_enabled": app_config.get("provider_tavily", "TRUE") == "TRUE",
+        "google_keys": get_google_search_keys(),
+        "pool": get_http_pool(),
+        "tavily": get_tavily_client(),
+        "url_cache": get_url_cache(),
+        "rate_limiter": get_google_rate_limiter(),
+        "quota": quota,
+        "pdf_pool": get_pdf_pool(),
+    }
+
+@st.cache_resource
+def get_pdf_pool():
+    pool = ProcessWorkerPool(config.PDF_WORKERS, mem_limit_mb=config.PDF_WORKER_MEMORY_MB, timeout=config.PDF_PARSE_TIMEOUT)
+    pool.warm_up()
+    return pool
+
+async def async_extract_pdf_content(pdf_bytes, keywords, ctx):
+    """Parsing PyMuPDF et sélection des extraits dans le pool de processus : la boucle ne fait que des E/S."""
+    try:
+        # Texte intégral mis en cache par empreinte du document (partagé entre URLs miroirs)
+        text_cache = ctx["url_cache"]
+        digest, full_text = None, None
+        if text_cache:
+            # Empreinte hors de la boucle (hashlib libère le GIL sur les gros tampons)
+            digest = await asyncio.to_thread(lambda: hashlib.sha256(pdf_bytes).hexdigest())
+            full_text = await asyncio.to_thread(text_cache.get_text, digest)
+        new_text, content = await ctx["pdf_pool"].run(
+            process_pdf_source, None if full_text is not None else pdf_bytes, keywords,
+            top_k=config.PDF_DENSITY_TOP_K, full_text=full_text, max_pages=config.PDF_MAX_PAGES
+        )
+        if new_text is not None and text_cache: await asyncio.to_thread(text_cache.put_text, digest, new_text)
+        return content
     except: return "PDF Error"
 
-async def async_google_search(query, domains, max_results, date_restrict=None):
-    config = st.session_state.get("app_config", {})
-    if config.get("provider_google", "TRUE") == "FALSE":
+def google_batches(domain_count, max_results):
+    """(nb de lots de domaines, résultats par lot) : un lot = une requête par page de 10 résultats."""
+    batches = -(-domain_count // 8)
+    return batches, min(max(int(int(max_results) / max(1, batches)), 10), 20)
+
+def estimate_google_calls(domain_count, max_results):
+    batches, per_batch = google_batches(domain_count, max_results)
+    return batches * -(-per_batch // 10)
+
+async def async_google_search(query, ctx, max_results, date_restrict=None):
+    if not ctx["google_enabled"]:
         return {"items": []}, "Google Search Disabled by Admin"
 
-    api_key, cx = get_google_search_keys()
+    domains = ctx["domains"]
+    api_key, cx = ctx["google_keys"]
     if not api_key or not cx: return {"items": []}, "Google Search Keys Missing"
 
     BATCH_SIZE = 8
     domain_batches = [domains[i:i + BATCH_SIZE] for i in range(0, len(domains), BATCH_SIZE)]
-    results_per_batch = min(max(int(int(max_results) / len(domain_batches)), 10), 20)
+    _, results_per_batch = google_batches(len(domains), max_results)
 
-    base_url = "https://www.googleapis.com/customsearch/v1"
     tasks = []
 
     for batch in domain_batches:
@@ -333,128 +406,496 @@ async def async_google_search(query, domains, max_results, date_restrict=None):
             if date_restrict: params['dateRestrict'] = date_restrict
             tasks.append(params)
 
-    async with aiohttp.ClientSession() as session:
-        all_items = []
-        fatal_error = None
-        
-        async def fetch_task(p):
-            nonlocal fatal_error
-            try:
-                async with session.get(base_url, params=p) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        return data.get('items', [])
-                    elif response.status == 429:
-                        fatal_error = "Google Quota Exceeded (429)"
-                        return []
-                    elif response.status == 403:
-                        fatal_error = "Google Permission Denied (403)"
-                        return []
-                    return []
-            except Exception as e:
-                return []
-
-        results_lists = await asyncio.gather(*[fetch_task(p) for p in tasks])
-        if fatal_error: return {"items": []}, fatal_error
-
-        for r_list in results_lists: all_items.extend(r_list)
-
-        seen_links = set()
-        unique_items = []
-        for item in all_items:
-            link = item.get('link')
-            if link and link not in seen_links:
-                seen_links.add(link)
-                unique_items.append(item)
-
-        return {"items": unique_items}, None
-
-async def async_fetch_and_process_source(item, query_keywords, tavily_key):
+    scheduler = GoogleCseScheduler(ctx["pool"], ctx["rate_limiter"], ctx["quota"], max_retries=config.GOOGLE_CSE_MAX_RETRIES)
+    all_items, errors = await scheduler.run(tasks)
+    if errors and not all_items: return {"items": []}, errors[0]
+
+    seen_links = set()
+    unique_items = []
+    for item in all_items:
+        link = item.get('link')
+        if link and link not in seen_links:
+            seen_links.add(link)
+            unique_items.append(item)
+
+    result = {"items": unique_items}
+    # Mode dégradé : on garde les pages obtenues et on signale les échecs
+    if errors: result["warning"] = f"Partial results: {len(errors)}/{len(tasks)} Google requests failed ({errors[0]})"
+    return result, None
+
+async def async_fetch_pdf(url, pool, url_cache):
+    """PDF depuis le cache disque (revalidé par GET conditionnel) ou depuis le réseau.
+    Accès disque dans des threads (la boucle est partagée) ; le document n'est lu que s'il sert."""
+    meta = await asyncio.to_thread(url_cache.get_document_meta, url) if url_cache else None
+    if meta and url_cache.is_fresh(meta):
+        cached = await asyncio.to_thread(url_cache.get_document, url)
+        if cached: return cached[0]
+        meta = None
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    if meta: headers.update(url_cache.conditional_headers(meta))
+    async with pool.get(url, headers=headers) as resp:
+        if resp.status == 304 and meta:
+            cached = await asyncio.to_thread(url_cache.get_document, url)
+            if cached:
+                await asyncio.to_thread(url_cache.mark_revalidated, url, meta)
+                return cached[0]
+        if resp.status == 200 and 'application/pdf' in resp.headers.get('Content-Type', ''):
+            if int(resp.headers.get('Content-Length') or 0) > config.PDF_MAX_BYTES: return None
+            pdf_bytes = await resp.read()
+            if len(pdf_bytes) > config.PDF_MAX_BYTES: return None
+            if url_cache: await asyncio.to_thread(url_cache.put_document, url, pdf_bytes, dict(resp.headers))
+            return pdf_bytes
+    return None
+
+async def async_fetch_and_process_source(item, query_keywords, ctx):
     url = item.get('link')
     title = item.get('title')
     if not url: return None
-    headers = {'User-Agent': 'Mozilla/5.0'}
+    url_cache, tavily = ctx["url_cache"], ctx["tavily"]
     
     if url.lower().endswith('.pdf'):
         try:
-            timeout = aiohttp.ClientTimeout(total=15)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(url, headers=headers) as resp:
-                    if resp.status == 200 and 'application/pdf' in resp.headers.get('Content-Type', ''):
-                        pdf_bytes = await resp.read()
-                        content = extract_pdf_content_by_density(pdf_bytes, query_keywords)
-                        return {"source": url, "type": "pdf", "title": title, "content": content}
+            pdf_bytes = await async_fetch_pdf(url, ctx["pool"], url_cache)
+            if pdf_bytes:
+                content = await async_extract_pdf_content(pdf_bytes, query_keywords, ctx)
+                return {"source": url, "type": "pdf", "title": title, "content": content}
         except: pass 
 
-    config = st.session_state.get("app_config", {})
-    if config.get("provider_tavily", "TRUE") == "TRUE":
+    if ctx["tavily_enabled"]:
         try:
-            if not tavily_key: return None
-            tavily = TavilyClient(api_key=tavily_key)
-            response = tavily.search(query=url, search_depth="basic", max_results=1)
+            response = await asyncio.to_thread(url_cache.get_tavily, url) if url_cache else None
+            if response is None:
+                if not tavily: return None
+                response = await tavily.search(url, search_depth="basic", max_results=1)
+                if response and url_cache: await asyncio.to_thread(url_cache.put_tavily, url, response)
             if response and response.get('results'):
                 content = response['results'][0]['content']
-                return {"source": url, "type": "web", "title": title, "content": content[:8000]}
+                return {"source": url, "type": "web", "title": title, "content": truncate_tokens(content, config.SOURCE_MAX_TOKENS)}
         except: pass
     return None
 
-@st.cache_data(show_spinner=False, ttl=3600)
-def cached_async_mia_deep_search(query, date_restrict_code, max_results):
+def is_quality_source(r):
+    content = r.get("content") or ""
+    return len(content) >= config.MIA_STREAM_MIN_CHARS and not content.startswith(("Error", "PDF Error"))
+
+def content_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+async def async_mia_source_stream(query, date_restrict_code, max_results, ctx, min_quality=None, deadline=None, known=None):
+    """Sources traitées au fil de l'eau (asyncio.as_completed).
+    Evénements : found (nb de résultats Google), source, error, disabled.
+    S'arrête dès min_quality sources exploitables ou à l'échéance (secondes) ; le reste est annulé.
+    known = {URL canonique: empreinte} d'un run précédent : chaque source est relue (PDF revalidés
+    par GET conditionnel, pages web servies par le cache Tavily tant qu'il est valide) et celles
+    dont l'empreinte n'a pas changé sont marquées unchanged."""
+    if not ctx["domains"]:
+        yield {"event": "error", "error": "Configuration Error"}
+        return
+    keywords = re.findall(r'\b\w+\b', query.lower())
+    started = asyncio.get_running_loop().time()
+
+    google_json, error = await async_google_search(query, ctx, max_results, date_restrict=date_restrict_code)
+    if error and "Disabled" in error:
+        yield {"event": "disabled"}
+        return
+    if error:
+        yield {"event": "error", "error": error}
+        return
+
+    items = google_json.get('items', [])
+    yield {"event": "found", "count": len(items), "warning": google_json.get("warning")}
+
+    async def fetch_ranked(rank, item):
+        r = await async_fetch_and_process_source(item, keywords, ctx)
+        if r:
+            r["rank"] = rank
+            r["content_hash"] = content_hash(r.get("content"))
+            if known is not None and known.get(canonical_url(r["source"])) == r["content_hash"]: r["unchanged"] = True
+        return r
+
+    tasks = [asyncio.ensure_future(fetch_ranked(n, i)) for n, i in enumerate(items)]
+    quality = 0
     try:
-        doms, _ = get_domains()
-        tavily_key = st.secrets.get("TAVILY_API_KEY")
-        if not doms: return None, "Configuration Error", 0
-        keywords = re.findall(r'\b\w+\b', query.lower())
+        timeout = max(0.0, deadline - (asyncio.get_running_loop().time() - started)) if deadline else None
+        for fut in asyncio.as_completed(tasks, timeout=timeout):
+            r = await fut
+            if r is None: continue
+            yield {"event": "source", "source": r}
+            if not r.get("unchanged") and is_quality_source(r): quality += 1
+            if min_quality and quality >= min_quality: break
+    except asyncio.TimeoutError: pass
+    finally:
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def format_mia_digest(sources, raw_count, query=""):
+    # Classement BM25 vis-à-vis de la requête (puis rang Google) et quasi-doublons fusionnés (URL, titre, SimHash) :
+    # ordre déterministe, prompt stable quel que soit l'ordre d'arrivée. Seules les MIA_TOP_SOURCES premières
+    # sont gardées ; sous le budget MIA_DIGEST_TOKENS, les moins pertinentes sont raccourcies puis retirées
+    ranked, duplicates = rank_sources(sources, query, url_key=canonical_url, top_k=config.MIA_TOP_SOURCES,
+                                      max_distance=config.MIA_SIMHASH_DISTANCE)
+    merged = f", {duplicates} near-duplicates merged" if duplicates else ""
+    assembler = PromptAssembler("gpt-4o", config.MIA_DIGEST_TOKENS, separator="")
+    assembler.add("header", f"### INTELLIGENT SEARCH ({raw_count} sources found{merged}):\n", required=True)
+    for n, r in enumerate(ranked):
+        content = truncate_tokens(r['content'], config.MIA_SOURCE_TOKENS)
+        assembler.add(f"source {n + 1}", f"- Title: {r['title']}\n  URL: {r['source']}\n  Type: {r['type'].upper()}\n  Content: {content}...\n\n",
+                      priority=-n, min_tokens=60)
+    return assembler.build()[0]
+
+def mia_deep_search(query, date_restrict_code, max_results, on_event=None, min_quality=None, deadline=None, known=None, app_config=None):
+    """(digest, erreur ou avertissement, nb de résultats Google). on_event(ev) est appelé à chaque événement.
+    Avec known (run incrémental), le digest ne contient que les sources nouvelles ou modifiées.
+    Les appels identiques simultanés (requête, réglages, arrêt anticipé, sources connues) partagent un seul
+    pipeline : les autres appelants reçoivent les événements du meneur d'un bloc, une fois celui-ci terminé."""
+    if app_config is None: app_config = st.session_state.get("app_config", {})
+    key = flight_key("mia-run", mia_search_key(query, date_restrict_code, max_results, app_config), min_quality, deadline, known)
+    led = []
+
+    def lead():
+        led.append(True)
+        events = []
+        def record(ev):
+            events.append(ev)
+            if on_event: on_event(ev)
+        return run_mia_pipeline(query, date_restrict_code, max_results, record, min_quality, deadline, known, app_config), events
+
+    result, events = get_single_flight().do(key, lead)
+    if not led and on_event:
+        for ev in events: on_event(ev)
+    return result
+
+def run_mia_pipeline(query, date_restrict_code, max_results, on_event=None, min_quality=None, deadline=None, known=None, app_config=None):
+    """Pipeline MIA exécuté par mia_deep_search (sans mise en commun)."""
+    try:
+        sources, raw_count, warning = [], 0, None
+        try:
+            ctx = build_mia_context(app_config)
+            stream = async_mia_source_stream(query, date_restrict_code, max_results, ctx, min_quality, deadline, known)
+            for ev in get_runtime().iterate(stream):
+                if on_event: on_event(ev)
+                if ev["event"] == "disabled": return "DISABLED", "Google Search Disabled", 0
+                if ev["event"] == "error": return None, ev["error"], 0
+                if ev["event"] == "found": raw_count, warning = ev["count"], ev.get("warning")
+                elif ev["event"] == "source" and not ev["source"].get("unchanged"): sources.append(ev["source"])
+        finally: persist_google_quota()
+        return format_mia_digest(sources, raw_count, query), warning, raw_count
+    except Exception as e: return None, str(e), 0
 
-        async def run_pipeline():
-            google_json, error = await async_google_search(query, doms, max_results, date_restrict=date_restrict_code)
-            
-            if error and "Disabled" in error: return [], 0, "DISABLED"
-            if error: return [], 0, error
-            
-            items = google_json.get('items', [])
-            real_count = len(items)
-            
-            tasks = [async_fetch_and_process_source(i, keywords, tavily_key) for i in items]
-            processed_results = await asyncio.gather(*tasks)
-            return processed_results, real_count, None
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
 
-        try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
-        results, raw_count, error_msg = loop.run_until_complete(run_pipeline())
-        
-        if error_msg == "DISABLED": return "DISABLED", "Google Search Disabled", 0
-        if error_msg: return None, error_msg, 0
-        
-        clean_results = [r for r in results if r is not None]
-        txt = f"### INTELLIGENT SEARCH ({raw_count} sources found):\n"
-        for r in clean_results:
-            txt += f"- Title: {r['title']}\n  URL: {r['source']}\n  Type: {r['type'].upper()}\n  Content: {r['content'][:800]}...\n\n"
-        return txt, None, raw_count
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
 
+def mia_search_key(query, date_restrict_code, max_results, app_config):
+    return flight_key("mia", normalize_query(query), date_restrict_code, int(max_results),
+                      app_config.get("provider_google", "TRUE"), app_config.get("provider_tavily", "TRUE"))
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def cached_async_mia_deep_search(query, date_restrict_code, max_results):
+    # Les sessions qui lancent la même recherche en même temps partagent un seul pipeline (mia_deep_search)
+    return mia_deep_search(query, date_restrict_code, max_results)
+
+async def async_mia_deep_search(query, date_restrict_code, max_results, ctx):
+    """Equivalent de mia_deep_search depuis la boucle du runtime (sans événements)."""
+    try:
+        sources, raw_count, warning = [], 0, None
+        async for ev in async_mia_source_stream(query, date_restrict_code, max_results, ctx):
+            if ev["event"] == "disabled": return "DISABLED", "Google Search Disabled", 0
+            if ev["event"] == "error": return None, ev["error"], 0
+            if ev["event"] == "found": raw_count, warning = ev["count"], ev.get("warning")
+            elif ev["event"] == "source": sources.append(ev["source"])
+        return format_mia_digest(sources, raw_count, query), warning, raw_count
     except Exception as e: return None, str(e), 0
 
-@st.cache_data(show_spinner=False)
+def mia_synthesizer(topic, markets, timeframe_label):
+    """synthesize(digest) pour run_watch : rapport JSON (cache LLM partagé) et tokens du prompt."""
+    def synthesize(raw_data):
+        prompt = create_mia_prompt(topic, markets, raw_data, timeframe_label)
+        return cached_ai_generation(prompt, "gpt-4o", 0.1, json_mode=True), count_tokens(prompt)
+    return synthesize
+
+def run_mia_watch(topic, markets, timeframe_label, run_state, search, watchlist_id=None, **kwargs):
+    """run_watch avec la synthèse GPT-4o et, pour une watchlist, l'état du run persisté dans le stockage."""
+    save = (lambda state: state if save_watchlist_state(watchlist_id, state) else None) if watchlist_id else None
+    return run_watch(topic, markets, timeframe_label, run_state, search, mia_synthesizer(topic, markets, timeframe_label),
+                     save=save, max_items=config.MIA_DELTA_MAX_ITEMS, max_seen=config.MIA_DELTA_MAX_SEEN, **kwargs)
+
+def run_watchlist(watchlist, run_state, max_results, app_config):
+    """Run complet d'une watchlist sans interface (worker) : recherche incrémentale depuis run_state,
+    synthèse, rapport persisté dans l'état de la watchlist. Retourne (statut, erreur)."""
+    markets = [m.strip() for m in watchlist["markets"].split(",") if m.strip()]
+
+    def search(query, date_restrict_code, known, on_source):
+        on_event = lambda ev: on_source(ev["source"]) if ev["event"] == "source" else None
+        return mia_deep_search(query, date_restrict_code, max_results, on_event=on_event, known=known, app_config=app_config)
+
+    res = run_mia_watch(watchlist["topic"], markets, watchlist["timeframe"], run_state, search, watchlist_id=watchlist["id"],
+                        offline=False, allow_empty=True)
+    if res["status"] == "failed": return "failed", res["error"]
+    if res["state"] is None: return "failed", "Storage unavailable"
+    log_usage("MIA", str(uuid.uuid4()), watchlist["topic"], f"Scheduled | {watchlist['name']} | {res['status']} | Sources:{res['changed']}")
+    return res["status"], res["error"]
+
+def streamed_mia_deep_search(query, date_restrict_code, max_results, known=None, on_source=None):
+    """Affiche un compteur et la liste des sources au fil de l'eau ; la synthèse démarre dès
+    MIA_STREAM_MIN_SOURCES sources exploitables ou après MIA_STREAM_DEADLINE secondes."""
+    counter = st.empty()
+    listing = st.container(height=220)
+    state = {"found": 0, "read": 0}
+
+    def on_event(ev):
+        if ev["event"] == "found":
+            state["found"] = ev["count"]
+        elif ev["event"] == "source":
+            r = ev["source"]
+            state["read"] += 1
+            if on_source: on_source(r)
+            icon = "↺" if r.get("unchanged") else "📄" if r['type'] == 'pdf' else "🌐"
+            listing.markdown(f"- {icon} [{r['title']}]({r['source']})")
+        counter.caption(f"📥 {state['read']} sources read / {state['found']} found")
+
+    return mia_deep_search(query, date_restrict_code, max_results, on_event=on_event,
+                           min_quality=config.MIA_STREAM_MIN_SOURCES, deadline=config.MIA_STREAM_DEADLINE, known=known)
+
+@st.cache_resource
+def get_llm_cache():
+    try:
+        store = DiskCache(os.path.join(config.DATA_DIR, config.LLM_CACHE_DIR), config.LLM_CACHE_MAX_MB * 1024 * 1024)
+        return LlmCache(store, ttl=config.LLM_CACHE_TTL)
+    except: return None
+
+def prompt_budget(agent, model="gpt-4o"):
+    """Budget du prompt : fenêtre du modèle moins la réserve de sortie, plafonné par agent."""
+    window = config.LLM_CONTEXT_WINDOWS.get(model, 128000) - config.PROMPT_OUTPUT_RESERVE
+    return min(window, config.PROMPT_BUDGETS.get(agent, window))
+
+def assemble_olivia_prompt(instructions, ext_ctx, documents, image_count, model="gpt-4o"):
+    """Instructions toujours gardées ; puis contexte réglementaire externe, puis documents joints."""
+    assembler = PromptAssembler(model, prompt_budget("olivia", model))
+    assembler.add("instructions", instructions, required=True)
+    if ext_ctx: assembler.add("search context", ext_ctx, priority=2, header="REGULATORY CONTEXT (EXTERNAL):\n")
+    for n, (name, text) in enumerate(documents):
+        assembler.add(name, text, priority=1 - n * 0.01, header=f"PRODUCT DOCUMENT - {name}:\n")
+    assembler.add_images(image_count, config.PROMPT_IMAGE_TOKENS)
+    return assembler.build()
+
+def build_llm_context():
+    """Client, cache et single-flight résolus dans le thread du script (comme build_mia_context)."""
+    return {"client": get_openai_client(), "cache": get_llm_cache(), "flight": get_single_flight()}
+
+async def async_cached_completion(llm, model, temp, json_mode, messages, limiter=None):
+    """Réponse en cache (disque, TTL) ou appel unique partagé par les demandes identiques simultanées.
+    Le limiteur de débit éventuel n'est sollicité que pour un vrai appel."""
+    client, cache = llm["client"], llm["cache"]
+    key = llm_cache_key(model, temp, json_mode, messages)
+    hit = await asyncio.to_thread(cache.get, key) if cache else None
+    if hit is not None: return hit
+
+    async def generate():
+        if limiter: await limiter.acquire()
+        kwargs = {"model": model, "messages": messages, "temperature": temp}
+        if json_mode: kwargs["response_format"] = {"type": "json_object"}
+        res = await client.complete(**kwargs)
+        content = res.choices[0].message.content
+        if cache and content:
+            try: await asyncio.to_thread(cache.put, key, content, model)
+            except: pass
+        return content
+    return await llm["flight"].do_async(key, generate)
+
+async def async_stream_completion(llm, model, temp, messages):
+    """Fragments de texte au fil de l'eau ; la réponse complète n'est mise en cache qu'une fois terminée.
+    Un hit du cache, comme une demande identique déjà en cours (SingleFlight), est rejoué d'un seul bloc."""
+    cache = llm["cache"]
+    key = llm_cache_key(model, temp, False, messages)
+    hit = await asyncio.to_thread(cache.get, key) if cache else None
+    if hit is not None:
+        yield hit
+        return
+
+    async def generate():
+        parts = []
+        async for chunk in llm["client"].stream(model=model, messages=messages, temperature=temp):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        if cache and parts:
+            try: await asyncio.to_thread(cache.put, key, "".join(parts), model)
+            except: pass
+
+    async for part in llm["flight"].stream_async(key, generate): yield part
+
+def stream_ai_generation(prompt, model, temp, messages=None):
+    llm = build_llm_context()
+    if not llm["client"]: return
+    yield from get_runtime().iterate(async_stream_completion(llm, model, temp, messages or [{"role": "user", "content": prompt}]))
+
+def write_ai_stream(prompt, model, temp, messages=None):
+    """Rendu progressif (st.write_stream) dans un bloc temporaire, vidé à la fin : la page affiche
+    ensuite le résultat stocké comme avant. Retourne le texte complet (None si rien)."""
+    live = st.empty()
+    with live.container(): text = st.write_stream(stream_ai_generation(prompt, model, temp, messages))
+    live.empty()
+    return text if isinstance(text, str) and text else None
+
 def cached_ai_generation(prompt, model, temp, json_mode=False, messages=None):
-    client = get_openai_client()
-    if not client: return None
+    llm = build_llm_context()
+    if not llm["client"]: return None
     if messages: final_messages = messages
     else: final_messages = [{"role": "user", "content": prompt}]
-    kwargs = {"model": model, "messages": final_messages, "temperature": temp}
-    if json_mode: kwargs["response_format"] = {"type": "json_object"}
-    res = client.chat.completions.create(**kwargs)
-    return res.choices[0].message.content
+    return get_runtime().run(async_cached_completion(llm, model, temp, json_mode, final_messages))
 
-def extract_text_from_pdf(b):
+@st.cache_resource
+def get_upload_cache():
+    try: store = DiskCache(os.path.join(config.DATA_DIR, config.UPLOAD_CACHE_DIR), config.UPLOAD_CACHE_MAX_MB * 1024 * 1024)
+    except: store = None
+    return DocumentTextCache(store, max_items=config.UPLOAD_CACHE_MEM_ITEMS)
+
+def extract_text_from_pdf(b, char_budget=None):
+    """Pages extraites en parallèle dans le pool PDF ; arrêt dès que le budget de caractères est atteint.
+    Texte mis en cache par SHA-256 du fichier : un même document n'est extrait qu'une fois."""
+    cache = get_upload_cache()
+    digest = hashlib.sha256(b).hexdigest()
+    hit = cache.get(digest, char_budget)
+    if hit: return hit[0]
     try:
-        r = PdfReader(io.BytesIO(b)); txt=[]
-        for p in r.pages: txt.append(p.extract_text() or "")
-        return "\n".join(txt)
+        pool = get_pdf_pool()
+        text, meta = read_pdf_document(
+            b, char_budget, submit=pool.submit, batch_pages=config.UPLOAD_PDF_BATCH_PAGES,
+            parallel=config.PDF_WORKERS, max_pages=config.PDF_MAX_PAGES
+        )
     except: return "Error reading PDF"
+    try: cache.put(digest, text, meta)
+    except: pass
+    return text
+
+@st.cache_resource(max_entries=8)
+def get_document_index(digest, _text):
+    """Index BM25 du document, construit une fois par empreinte."""
+    return BM25Index(chunk_text(_text, config.EVA_CHUNK_WORDS, config.EVA_CHUNK_OVERLAP))
+
+def build_eva_evidence(ctx, doc):
+    """Passages du document les plus pertinents pour chaque exigence du contexte, dans un budget de tokens fixe."""
+    index = get_document_index(hashlib.sha256(doc.encode("utf-8")).hexdigest(), doc)
+    passages = select_passages(index, parse_requirements(ctx or ""), config.EVA_EVIDENCE_TOKENS, config.EVA_PASSAGES_PER_REQUIREMENT)
+    return format_passages(passages, len(doc))
+
+async def async_ai_generation(llm, prompt, model, temp, json_mode=False, limiter=None):
+    """Appel LLM depuis la boucle du runtime (fan-out) ; même cache que cached_ai_generation."""
+    return await async_cached_completion(llm, model, temp, json_mode, [{"role": "user", "content": prompt}], limiter)
+
+def async_eva_map(ctx, sections, llm):
+    """Générateur asynchrone : audit des sections en parallèle (concurrence bornée) ; chaque résultat
+    est émis dès qu'il arrive, avec le rapport de budget de son prompt."""
+    async def audit(section):
+        name, no, total, text = section
+        prompt, report = create_eva_section_prompt(ctx, name, no, total, text, config.EVA_MAP_MODEL)
+        try:
+            raw = await async_ai_generation(llm, prompt, config.EVA_MAP_MODEL, 0.1, json_mode=True)
+            findings = json.loads(raw).get("findings", [])
+            return section, [f for f in findings if isinstance(f, dict) and f.get("requirement")], None, report
+        except Exception as e: return section, [], str(e), report
+
+    return bounded_fanout(sections, audit, config.EVA_MAX_CONCURRENCY)
+
+def eva_map_sections(ctx, documents, on_progress=None):
+    """Phase map de l'audit complet multi-fichiers : sections auditées en parallèle.
+    Retourne (prompt du verdict consolidé et son rapport, sections auditées, sections totales, erreurs,
+    tokens des prompts de section, sections dont le prompt a été raccourci)."""
+    llm = build_llm_context()
+    if not llm["client"]: return None, None, 0, 0, ["OpenAI API Key Missing"], 0, 0
+    sections = []
+    for name, text in documents:
+        parts = split_sections(text, config.EVA_SECTION_CHARS)
+        sections += [(name, i, len(parts), part) for i, part in enumerate(parts, 1)]
+    total = len(sections)
+    sections = sections[:config.EVA_MAX_SECTIONS]
+    partials, errors, map_tokens, shortened = [], [], 0, 0
+    for section, findings, error, report in get_runtime().iterate(async_eva_map(ctx, sections, llm)):
+        partials.append((section, findings))
+        map_tokens += report["total"]
+        if report["truncated"] or report["dropped"]: shortened += 1
+        if error: errors.append(f"{section[0]} §{section[1]}: {error}")
+        if on_progress: on_progress(len(partials), len(sections))
+    merged = merge_eva_findings(partials)
+    reduce_prompt, reduce_report = create_eva_reduce_prompt(ctx, merged or "No findings.", [n for n, _ in documents], config.EVA_REDUCE_MODEL)
+    return reduce_prompt, reduce_report, len(sections), total, errors, map_tokens, shortened
+
+def build_olivia_messages(text_prompt, images_payload):
+    user_content = [{"type": "text", "text": text_prompt}]
+    for img_b64 in images_payload:
+        user_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}})
+    return [{"role": "user", "content": user_content}]
+
+def olivia_needs_deep_search(markets):
+    return any(x in str(markets) for x in ["EU", "USA", "China"])
+
+def async_olivia_fanout(desc, markets, documents, images_payload, llm, mia_ctx, search_keys):
+    """Générateur asynchrone : une analyse ciblée par marché, en parallèle (concurrence bornée), chacune
+    avec sa propre recherche MIA. Emet (marché, rapport, erreur, tokens du prompt) dès qu'un marché est terminé."""
+    async def analyse(market):
+        try:
+            ext_ctx = ""
+            if market in search_keys:
+                query = f"Regulations for {desc} in {market}"
+                digest, _, _ = await llm["flight"].do_async(search_keys[market], lambda: async_mia_deep_search(query, "m12", 20, mia_ctx))
+                if digest and digest != "DISABLED": ext_ctx = digest
+            prompt, report = assemble_olivia_prompt(create_olivia_market_prompt(desc, market), ext_ctx, documents, len(images_payload))
+            answer = await async_cached_completion(llm, "gpt-4o", 0.1, False, build_olivia_messages(prompt, images_payload))
+            return market, answer, None, report["total"]
+        except Exception as e: return market, None, str(e), 0
+
+    return bounded_fanout(markets, analyse, config.OLIVIA_MAX_CONCURRENCY)
+
+def olivia_fanout(desc, markets, documents, images_payload, on_market=None):
+    """Phase fan-out : retourne ([(marché, rapport)] dans l'ordre des marchés, erreurs, tokens envoyés)."""
+    llm = build_llm_context()
+    if not llm["client"]: return [], ["OpenAI API Key Missing"], 0
+    app_config = st.session_state.get("app_config", {})
+    search_markets = [m for m in markets if olivia_needs_deep_search([m])]
+    mia_ctx = build_mia_context() if search_markets else None
+    search_keys = {m: mia_search_key(f"Regulations for {desc} in {m}", "m12", 20, app_config) for m in search_markets}
+    reports, errors, tokens = {}, [], 0
+    try:
+        for market, report, error, used in get_runtime().iterate(async_olivia_fanout(desc, markets, documents, images_payload, llm, mia_ctx, search_keys)):
+            tokens += used
+            if report: reports[market] = report
+            else: errors.append(f"{market}: {error or 'empty response'}")
+            if on_market: on_market(market, report is not None)
+    finally:
+        if mia_ctx: persist_google_quota()
+    return [(m, reports[m]) for m in markets if m in reports], errors, tokens
+
+def async_batch_impact(jobs, llm, limiter):
+    """Générateur asynchrone : analyses d'impact en parallèle (concurrence et débit bornés) ;
+    émet (id, analyse, erreur) au fil de l'eau."""
+    async def assess(job):
+        safe_id, prompt = job
+        try: return safe_id, await async_ai_generation(llm, prompt, "gpt-4o", 0.1, limiter=limiter), None
+        except Exception as e: return safe_id, None, str(e)
+
+    return bounded_fanout(jobs, assess, config.IMPACT_MAX_CONCURRENCY)
+
+def run_batch_impact(jobs):
+    """Remplit mia_impact_results au fur et à mesure. Le bouton Stop interrompt le script :
+    le générateur est fermé, les appels en vol sont annulés et les résultats déjà reçus restent."""
+    llm = build_llm_context()
+    if not llm["client"]: return st.error("OpenAI API Key Missing")
+    bar = st.progress(0.0, text=f"Assessing {len(jobs)} items...")
+    st.button("⏹ Stop", key="mia_batch_stop")
+    done, failures = 0, []
+    for safe_id, res, error in get_runtime().iterate(async_batch_impact(jobs, llm, get_llm_rate_limiter())):
+        done += 1
+        if res: st.session_state["mia_impact_results"][safe_id] = res
+        else: failures.append(error)
+        bar.progress(done / len(jobs), text=f"Assessed {done}/{len(jobs)} items")
+    bar.empty()
+    log_usage("MIA", str(uuid.uuid4()), "Batch impact analysis", f"Items: {len(jobs)} | Failed: {len(failures)}")
+    if failures: st.warning(f"{len(failures)} analysis(es) failed: {failures[0]}")
 
 # =============================================================================
 # 5. VISUALISATION
@@ -544,10 +985,47 @@ def create_olivia_prompt(desc, countries):
     Mission: Comprehensive regulatory analysis. Output: Strict English Markdown.
     Structure: 1. Executive Summary, 2. Classification, 3. Regulations Table, 4. Standards Table, 5. Docs/Labeling, 6. Action Plan."""
 
-def create_eva_prompt(ctx, doc):
-    return f"""ROLE: Lead Auditor (VALHALLAI). Rules: {ctx}. Doc: '''{doc[:10000]}'''.
-    Mission: Compliance Audit. Output: Strict English Markdown.
-    Structure: 1. Verdict, 2. Gap Table (Requirement|Status|Evidence|Missing), 3. Risks, 4. Recommendations."""
+def create_olivia_market_prompt(desc, market):
+    return f"""ROLE: Senior Regulatory Consultant (VALHALLAI). Product: "{desc}" | Market: {market} ONLY.
+    Mission: Focused regulatory analysis for this single market. Output: Strict English Markdown.
+    Structure: 1. Key Findings (3-5 bullets), 2. Classification, 3. Regulations Table (Regulation|Scope|Key Requirements|Deadline), 4. Standards Table (Standard|Topic|Status), 5. Docs/Labeling, 6. Action Plan."""
+
+def create_olivia_merge_prompt(desc, market_reports, model="gpt-4o"):
+    # Rapports par marché sous budget : en cas de dépassement, les derniers marchés sélectionnés sont raccourcis
+    assembler = PromptAssembler(model, prompt_budget("olivia_merge", model))
+    for n, (m, r) in enumerate(market_reports): assembler.add(m, r, priority=-n, header=f"=== MARKET: {m} ===\n")
+    reports = assembler.build()[0]
+    return f"""ROLE: Senior Regulatory Consultant (VALHALLAI). Product: "{desc}" | Markets: {', '.join(m for m, _ in market_reports)}.
+    Per-market analyses:
+    {reports}
+    Mission: Merge these analyses into one comprehensive report. Keep every regulation and standard; add a Market column to the tables; highlight requirements shared across markets. Output: Strict English Markdown.
+    Structure: 1. Executive Summary, 2. Classification, 3. Regulations Table, 4. Standards Table, 5. Docs/Labeling, 6. Action Plan."""
+
+# Prompts EVA : (prompt, rapport) assemblés sous le budget "eva". Rôle et mission toujours gardés ;
+# le document (ou les constats) passe avant les règles, qui sont raccourcies en premier
+def assemble_eva_prompt(role, rules, material_name, material, material_header, mission, model="gpt-4o"):
+    assembler = PromptAssembler(model, prompt_budget("eva", model), separator="\n")
+    assembler.add("role", role, required=True)
+    assembler.add("rules", rules, priority=1, header="Rules: ")
+    assembler.add(material_name, material, priority=2, header=material_header)
+    assembler.add("mission", mission, required=True)
+    return assembler.build()
+
+def create_eva_prompt(ctx, evidence, model="gpt-4o"):
+    return assemble_eva_prompt("ROLE: Lead Auditor (VALHALLAI).", ctx, "evidence", f"'''{evidence}'''",
+        "Doc (most relevant passages per requirement): ", """Mission: Compliance Audit. Output: Strict English Markdown.
+    Structure: 1. Verdict, 2. Gap Table (Requirement|Status|Evidence|Missing), 3. Risks, 4. Recommendations.""", model)
+
+def create_eva_section_prompt(ctx, file_name, section_no, section_total, section, model="gpt-4o"):
+    return assemble_eva_prompt("ROLE: Compliance Auditor (VALHALLAI).", ctx, "section", f"'''{section}'''",
+        f'Document: "{file_name}" - section {section_no}/{section_total}: ', """Mission: For each requirement of the rules, report only what THIS section shows.
+    Output STRICT JSON: {"findings": [{"requirement": "...", "status": "Met|Partial|Missing", "evidence": "short quote or reference", "missing": "what is lacking"}]}.
+    Use "Missing" only if the section should cover the requirement but does not. Skip requirements the section does not touch.""", model)
+
+def create_eva_reduce_prompt(ctx, merged_findings, file_names, model="gpt-4o"):
+    return assemble_eva_prompt(f"ROLE: Lead Auditor (VALHALLAI). Files audited: {', '.join(file_names)}.", ctx, "findings", merged_findings,
+        "Consolidated section findings (Requirement | Status | Evidence | Missing):\n", """Mission: Final compliance audit of the whole technical file. A requirement met anywhere is met. Output: Strict English Markdown.
+    Structure: 1. Verdict, 2. Gap Table (Requirement|Status|Evidence|Missing), 3. Risks, 4. Recommendations.""", model)
 
 def create_mia_prompt(topic, markets, raw_search_data, timeframe_label):
     source_context = raw_search_data
@@ -624,10 +1102,19 @@ def page_admin():
     if not st.session_state["admin_authenticated"]:
         st.text_input("Admin Password", type="password", key="admin_pass_input", on_change=check_admin_password); return
     
-    wb = get_gsheet_workbook()
+    store = get_storage()
     c1, c2 = st.columns([3, 1])
-    c1.success(f"✅ DB: {wb.title}" if wb else "❌ DB Error")
-    if c2.button("🔄 Refresh"): st.cache_data.clear(); st.rerun()
+    c1.success(f"✅ DB: {store.describe()}" if store else "❌ DB Error")
+    if c2.button("🔄 Refresh"):
+        if store: store.invalidate()
+        st.rerun()
+    sync_job = get_storage_sync_job()
+    if sync_job:
+        c1, c2 = st.columns([3, 1])
+        c1.caption(f"🔁 Sheet mirror: {sync_job.last_sync.strftime('%Y-%m-%d %H:%M') if sync_job.last_sync else 'never'}" + (f" | ⚠️ {sync_job.last_error}" if sync_job.last_error else ""))
+        if c2.button("🔁 Sync to Sheet"):
+            try: st.toast(f"Synced ({sync_job.run_now()} new logs)", icon="✅")
+            except Exception as e: st.error(f"Sync failed: {e}")
 
     tm, td, tc = st.tabs(["🌍 Markets", "🕵️‍♂️ MIA Sources", "🎛️ MIA Settings"])
     with tm:
@@ -683,6 +1170,19 @@ def page_admin():
                 update_app_config("provider_tavily", "TRUE" if new_tavily else "FALSE")
                 st.session_state["app_config"]["provider_tavily"] = "TRUE" if new_tavily else "FALSE"
                 st.rerun()
+        with c_p4:
+            curr_stream = app_config.get("mia_streaming", "TRUE") == "TRUE"
+            new_stream = st.toggle("Stream MIA Sources (Early Synthesis)", value=curr_stream)
+            if new_stream != curr_stream:
+                update_app_config("mia_streaming", "TRUE" if new_stream else "FALSE")
+                st.session_state["app_config"]["mia_streaming"] = "TRUE" if new_stream else "FALSE"
+                st.rerun()
+        curr_sched = app_config.get("mia_scheduler", "TRUE") == "TRUE"
+        new_sched = st.toggle("Scheduled Watchlist Runs (mia_worker.py)", value=curr_sched)
+        if new_sched != curr_sched:
+            update_app_config("mia_scheduler", "TRUE" if new_sched else "FALSE")
+            st.session_state["app_config"]["mia_scheduler"] = "TRUE" if new_sched else "FALSE"
+            st.rerun()
         st.markdown("---")
         st.markdown("#### Performance")
         c_perf1, c_perf2 = st.columns(2)
@@ -701,6 +1201,30 @@ def page_admin():
                     update_app_config("max_search_results", new_max)
                     st.session_state["app_config"]["max_search_results"] = new_max
                     st.success("Updated!")
+        c_perf3, c_perf4 = st.columns(2)
+        with c_perf3:
+            curr_quota = app_config.get("google_daily_quota", "10000")
+            new_quota = st.text_input("📊 Google Daily Query Quota", value=curr_quota)
+            if st.button("Update Quota"):
+                if new_quota.isdigit():
+                    update_app_config("google_daily_quota", new_quota)
+                    st.session_state["app_config"]["google_daily_quota"] = new_quota
+                    st.success("Updated!")
+        with c_perf4:
+            quota = get_google_quota()
+            st.metric("Google queries today", f"{quota.used} / {quota.limit}")
+        url_cache = get_url_cache()
+        if url_cache:
+            cs = url_cache.stats()
+            st.caption(f"🗄️ Source cache: {cs['entries']} entries · {cs['bytes'] / 1048576:.1f} MB · hit ratio {cs['hit_ratio']:.0%} ({cs['hits']} hits / {cs['misses']} misses · {cs['revalidated']} revalidated)")
+        llm_cache = get_llm_cache()
+        if llm_cache:
+            ls = llm_cache.stats()
+            st.caption(f"🧠 LLM cache: {ls['entries']} responses · {ls['bytes'] / 1048576:.1f} MB · hit ratio {ls['hit_ratio']:.0%} ({ls['hits']} hits / {ls['misses']} misses · {ls['expired']} expired)")
+        llm_client = get_openai_client()
+        if llm_client: st.caption(f"🔁 OpenAI retries since start: {llm_client.retries}")
+        us = get_upload_cache().stats()
+        st.caption(f"📎 Upload text cache: {us['entries']} in memory · hit ratio {us['hit_ratio']:.0%} ({us['hits']} hits / {us['misses']} misses)")
 
 def page_mia():
     st.title("📡 MIA Watch Tower"); st.markdown("---")
@@ -718,17 +1242,17 @@ def page_mia():
             if wl_data:
                 st.session_state["mia_topic_val"] = wl_data["topic"]
                 st.session_state["mia_markets_val"] = [m.strip() for m in wl_data["markets"].split(",")]
-                timeframe_map = {"⚡ Last 30 Days": 30, "📅 Last 12 Months": 365, "🏛️ Last 3 Years": 1095}
-                try: st.session_state["mia_timeframe_index"] = list(timeframe_map.keys()).index(wl_data["timeframe"])
+                try: st.session_state["mia_timeframe_index"] = list(MIA_TIMEFRAMES.keys()).index(wl_data["timeframe"])
                 except: st.session_state["mia_timeframe_index"] = 1
                 st.session_state["current_watchlist"] = selected_wl
+                st.session_state["mia_show_precomputed"] = True
                 st.toast(f"✅ Loaded: {selected_wl}")
         if selected_wl != "-- New Watch --":
              with c_action:
                  with st.popover("🗑️ Delete"):
                      if st.button("Confirm Delete"):
                          wl = next((w for w in watchlists if w["name"] == selected_wl), None)
-                         if wl and delete_watchlist(wl["id"]): st.success("Deleted."); st.cache_data.clear(); st.rerun()
+                         if wl and delete_watchlist(wl["id"]): st.success("Deleted."); st.rerun()
 
     markets, _ = get_markets()
     col1, col2, col3 = st.columns([2, 2, 1], gap="large")
@@ -739,13 +1263,26 @@ def page_mia():
         if not default_mkts and markets: default_mkts = [markets[0]]
         selected_markets = st.multiselect("🌍 Markets", markets, default=default_mkts)
     with col3:
-        timeframe_options = { "⚡ Last 30 Days": "d30", "📅 Last 12 Months": "m12", "🏛️ Last 3 Years": "y3" }
-        selected_label = st.selectbox("⏱️ Timeframe", list(timeframe_options.keys()), index=st.session_state.get("mia_timeframe_index", 1))
-        date_restrict_code = timeframe_options[selected_label]
+        selected_label = st.selectbox("⏱️ Timeframe", list(MIA_TIMEFRAMES.keys()), index=st.session_state.get("mia_timeframe_index", 1))
+
+    # Etat du dernier run de la watchlist : relu à chaque chargement (le worker a pu en produire un plus récent),
+    # gardé en session entre deux reruns, et relu avant tout lancement
+    wl_current = next((w for w in watchlists if w["name"] == selected_wl), None) if selected_wl != "-- New Watch --" else None
+    run_states = st.session_state.setdefault("mia_run_states", {})
+    show_precomputed = st.session_state.pop("mia_show_precomputed", False)
+    if wl_current and (show_precomputed or wl_current["id"] not in run_states):
+        run_states[wl_current["id"]] = get_watchlist_state(wl_current["id"])
+    run_state = run_states.get(wl_current["id"]) if wl_current else None
+    if show_precomputed and run_state and run_state.get("report"):
+        # Rapport précalculé (dernier run, interactif ou planifié) : affiché sans relancer la veille
+        st.session_state["last_mia_results"] = {**run_state["report"], "delta_note": f"🕒 Precomputed report · last run {run_state['updated']}"}
 
     launch_label = f"🚀 Launch {selected_wl}" if selected_wl != "-- New Watch --" else "🚀 Launch Monitoring"
-    c_launch, c_save = st.columns([1, 4])
+    c_launch, c_delta, c_save = st.columns([1, 1, 3])
     with c_launch: launch = st.button(launch_label, type="primary")
+    with c_delta:
+        delta_mode = bool(run_state) and st.toggle("🔁 New sources only", value=True, key="mia_delta",
+                                                   help=f"Only fetch and analyse sources not seen in the last run ({run_state['updated']})." if run_state else None)
     with c_save:
         if topic:
             with st.popover("💾 Save as Watchlist"):
@@ -754,49 +1291,50 @@ def page_mia():
                     if new_wl_name and topic:
                         save_watchlist(new_wl_name, topic, selected_markets, selected_label)
                         st.toast("Saved!", icon="💾")
-                        st.cache_data.clear()
                         st.rerun()
                         
     if launch and topic:
         with st.spinner(f"📡 MIA is scanning... ({selected_label})"):
-            clean_timeframe = selected_label.replace("⚡ ", "").replace("📅 ", "").replace("🏛️ ", "")
-            query = f"regulations guidelines {topic} {', '.join(selected_markets)}"
-            
-            raw_data, error, raw_count = cached_async_mia_deep_search(query, date_restrict_code, max_res)
-            is_offline_mode = (raw_data == "DISABLED")
-            
-            if not is_offline_mode and not raw_data and error:
+            def search(query, date_restrict_code, known, on_source):
+                if app_config.get("mia_streaming", "TRUE") == "TRUE":
+                    return streamed_mia_deep_search(query, date_restrict_code, max_res, known=known, on_source=on_source)
+                if wl_current:
+                    on_event = lambda ev: on_source(ev["source"]) if ev["event"] == "source" else None
+                    return mia_deep_search(query, date_restrict_code, max_res, on_event=on_event, known=known)
+                return cached_async_mia_deep_search(query, date_restrict_code, max_res)
+
+            # Run incrémental (delta) : même requête et même période que le run précédent de la watchlist.
+            # Etat relu juste avant : un run planifié a pu le remplacer depuis l'affichage de la page
+            if wl_current: run_state = run_states[wl_current["id"]] = get_watchlist_state(wl_current["id"])
+            res = run_mia_watch(topic, selected_markets, selected_label, run_state, search,
+                                watchlist_id=wl_current["id"] if wl_current else None, delta=delta_mode)
+            status, error = res["status"], res["error"]
+            if status == "failed" and res["stage"] == "search":
                 st.error(f"🛑 Critical Search Error: {error}")
                 st.stop()
-            elif not is_offline_mode and raw_count == 0:
+            if error and status not in ("failed", "offline"): st.warning(f"⚠️ {error}")
+            if status == "empty":
                 st.warning(f"⚠️ No updates found on Google. (Try enabling 'Pure GPT-4o Mode' by disabling Google in Admin).")
                 st.stop()
-            
-            st.session_state["mia_raw_count"] = raw_count if not is_offline_mode else 0
-            if is_offline_mode: st.info("🧠 Offline Mode Active: Generating insights from internal knowledge base.")
 
-            prompt = create_mia_prompt(topic, selected_markets, raw_data, selected_label)
-            json_str = cached_ai_generation(prompt, "gpt-4o", 0.1, json_mode=True)
-            try:
-                parsed_data = json.loads(json_str)
-                if "items" not in parsed_data: parsed_data["items"] = []
-                parsed_data["source_count"] = raw_count if not is_offline_mode else 0
-                for item in parsed_data["items"]:
-                    if "impact" not in item: item["impact"] = "Low"
-                    if "category" not in item: item["category"] = "News"
-                    item["impact"] = item["impact"].capitalize()
-                    item["category"] = item["category"].capitalize()
-                st.session_state["last_mia_results"] = parsed_data
-                log_usage("MIA", str(uuid.uuid4()), topic, f"Mkts: {len(selected_markets)} | {selected_label} | Offline:{is_offline_mode}")
-            except Exception as e: st.error(f"Data processing failed: {str(e)}")
+            st.session_state["mia_raw_count"] = res["raw_count"] if status != "offline" else 0
+            if status == "offline": st.info("🧠 Offline Mode Active: Generating insights from internal knowledge base.")
+            if status == "failed": st.error(error)
+            else:
+                st.session_state["last_mia_results"] = res["report"]
+                if res["state"]: run_states[wl_current["id"]] = res["state"]
+                if status == "unchanged": details = f"Mkts: {len(selected_markets)} | {selected_label} | Delta:0"
+                else: details = f"Mkts: {len(selected_markets)} | {selected_label} | Offline:{status == 'offline'} | Tokens:{res['report']['prompt_tokens']}"
+                log_usage("MIA", str(uuid.uuid4()), topic, details)
 
     results = st.session_state.get("last_mia_results")
     if results:
         st.markdown("### 📋 Monitoring Report")
         raw_c = results.get("source_count", st.session_state.get("mia_raw_count", 0))
         kept_c = len(results.get("items", []))
+        if results.get("delta_note"): st.caption(results["delta_note"])
         if raw_c == 0: st.caption(f"🧠 MIA Intelligence: Generated from Internal Knowledge (Offline Mode)")
-        else: st.caption(f"🔍 MIA Intelligence: Analyzed {raw_c} sources → Kept {kept_c} relevant updates.")
+        else: st.caption(f"🔍 MIA Intelligence: Analyzed {raw_c} sources → Kept {kept_c} relevant updates." + (f" · 🧮 {results['prompt_tokens']:,} prompt tokens" if results.get("prompt_tokens") else ""))
 
         if results.get("items"):
             with st.expander("📅 View Strategic Timeline", expanded=False):
@@ -820,6 +1358,20 @@ def page_mia():
         items = results.get("items", [])
         filtered = [i for i in items if i.get('impact','Low').capitalize() in sel_impacts and i.get('category','News').capitalize() in sel_types]
         if not filtered: st.warning("No updates found matching filters.")
+        elif st.session_state.get("app_config", {}).get("enable_impact_analysis", "TRUE") == "TRUE":
+            c_batch1, c_batch2 = st.columns([3, 1])
+            with c_batch1: scope = st.selectbox("⚡ Batch Impact Analysis", ["High impact items", "All filtered items"], key="mia_batch_scope", label_visibility="collapsed")
+            with c_batch2: run_batch = st.button("⚡ Assess Impact (Batch)", key="mia_batch_btn", use_container_width=True)
+            if run_batch:
+                jobs = []
+                for item in filtered:
+                    if scope.startswith("High") and item.get('impact', 'Low').lower() != 'high': continue
+                    safe_id = hashlib.md5(item['title'].encode()).hexdigest()
+                    if safe_id in st.session_state["mia_impact_results"]: continue
+                    prod_ctx = st.session_state.get(f"ctx_{safe_id}", topic)
+                    jobs.append((safe_id, create_impact_analysis_prompt(prod_ctx, f"{item['title']}: {item['summary']}")))
+                if jobs: run_batch_impact(jobs)
+                else: st.info("All selected items are already assessed.")
         for item in filtered:
             impact = item.get('impact', 'Low').lower()
             cat = item.get('category', 'News')
@@ -829,18 +1381,17 @@ def page_mia():
             is_active = (st.session_state.get("active_analysis_id") == safe_id)
             
             with st.container():
-                st.markdown(f"""<div class="info-card" style="min-height:auto; padding:1.5rem; margin-bottom:1rem;"><div style="display:flex;"><div style="font-size:1.5rem; margin-right:15px;">{icon}</div><div><div class="mia-link"><a href="{item['url']}" target="_blank">{cat_map.get(cat,'📄')} {item['title']}</a></div><div style="font-size:0.85em; opacity:0.7; margin-bottom:5px; color:#4A5568;">📅 {item['date']} | 🏛️ {item['source_name']}</div><div style="color:#2D3748;">{item['summary']}</div></div></div></div>""", unsafe_allow_html=True)
+                st.markdown(f"""<div class="info-card" style="min-height:auto; padding:1.5rem; margin-bottom:1rem;"><div style="display:flex;"><div style="font-size:1.5rem; margin-right:15px;">{icon}</div><div><div class="mia-link"><a href="{item['url']}" target="_blank">{cat_map.get(cat,'📄')} {'🆕 ' if item.get('is_new') else ''}{item['title']}</a></div><div style="font-size:0.85em; opacity:0.7; margin-bottom:5px; color:#4A5568;">📅 {item['date']} | 🏛️ {item['source_name']}</div><div style="color:#2D3748;">{item['summary']}</div></div></div></div>""", unsafe_allow_html=True)
                 
                 if st.session_state.get("app_config", {}).get("enable_impact_analysis", "TRUE") == "TRUE":
                     with st.expander(f"⚡ Analyze Impact (Beta)", expanded=is_active):
                         prod_ctx = st.text_input("Product Context:", value=topic, key=f"ctx_{safe_id}")
                         if st.button("Generate Analysis", key=f"btn_{safe_id}"):
                             st.session_state["active_analysis_id"] = safe_id
-                            with st.spinner("Evaluating..."):
-                                ia_prompt = create_impact_analysis_prompt(prod_ctx, f"{item['title']}: {item['summary']}")
-                                ia_res = cached_ai_generation(ia_prompt, "gpt-4o", 0.1)
-                                st.session_state["mia_impact_results"][safe_id] = ia_res
-                                st.rerun()
+                            ia_prompt = create_impact_analysis_prompt(prod_ctx, f"{item['title']}: {item['summary']}")
+                            ia_res = write_ai_stream(ia_prompt, "gpt-4o", 0.1)
+                            st.session_state["mia_impact_results"][safe_id] = ia_res
+                            st.rerun()
                         if safe_id in st.session_state["mia_impact_results"]:
                             st.markdown("---"); st.markdown(st.session_state["mia_impact_results"][safe_id])
 
@@ -854,44 +1405,54 @@ def page_olivia():
     with c2: 
         safe_default = [markets[0]] if markets else []
         ctrys = st.multiselect("Target Markets", markets, default=safe_default, key="oli_mkts")
+        fanout = st.toggle("Per-market analysis (parallel)", value=True, key="oli_fanout", help="One focused analysis per market, merged into a single report.")
         st.write(""); gen = st.button("Generate Report", type="primary", key="oli_btn")
     
     if gen and desc:
         with st.spinner("Analyzing (Multimodal)..."):
             try:
-                pdf_context = ""
+                documents = []
                 images_payload = []
+                failed = False
                 if uploads:
                     for up_file in uploads:
                         if up_file.type == "application/pdf":
-                            txt = extract_text_from_pdf(up_file.read())
-                            pdf_context += f"\n--- CONTENT OF {up_file.name} ---\n{txt[:8000]}\n"
+                            documents.append((up_file.name, extract_text_from_pdf(up_file.getvalue(), config.OLIVIA_PDF_CHAR_BUDGET)))
                         elif up_file.type in ["image/png", "image/jpeg", "image/jpg"]:
                             b64_img = base64.b64encode(up_file.getvalue()).decode('utf-8')
                             images_payload.append(b64_img)
 
-                use_ds = any(x in str(ctrys) for x in ["EU","USA","China"])
-                ext_ctx = ""
-                if use_ds: 
-                    d, error, _ = cached_async_mia_deep_search(f"Regulations for {desc} in {ctrys}", "m12", 20)
-                    if d: ext_ctx = d
-                
-                sys_prompt = create_olivia_prompt(desc, ctrys)
-                final_text_prompt = sys_prompt
-                if ext_ctx: final_text_prompt += f"\n\nREGULATORY CONTEXT (EXTERNAL):\n{ext_ctx}"
-                if pdf_context: final_text_prompt += f"\n\nPRODUCT DOCUMENTS CONTEXT:\n{pdf_context}"
-                
-                messages = []
-                user_content = [{"type": "text", "text": final_text_prompt}]
-                for img_b64 in images_payload:
-                    user_content.append({"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}})
-                messages.append({"role": "user", "content": user_content})
-                
-                resp = cached_ai_generation(None, "gpt-4o", 0.1, messages=messages)
-                st.session_state["last_olivia_report"] = resp
-                st.session_state["last_olivia_id"] = str(uuid.uuid4())
-                log_usage("OlivIA", st.session_state["last_olivia_id"], desc, f"Mkts:{len(ctrys)}")
-                st.toast("Analysis Ready!", icon="✅")
+                if fanout and len(ctrys) > 1:
+                    progress = st.empty()
+                    done = []
+                    def on_market(market, ok):
+                        done.append(f"{'✅' if ok else '⚠️'} {market}")
+                        progress.caption(f"Markets analysed ({len(done)}/{len(ctrys)}): " + " · ".join(done))
+                    market_reports, errors, tokens = olivia_fanout(desc, ctrys, documents, images_payload, on_market=on_market)
+                    progress.empty()
+                    if not market_reports:
+                        st.error(f"🛑 Analysis failed for every market: {errors[0] if errors else 'no report'}")
+                        resp, failed = None, True
+                    else:
+                        if errors: st.warning(f"{len(errors)} market(s) failed: {errors[0]}")
+                        merge_prompt = create_olivia_merge_prompt(desc, market_reports)
+                        tokens += count_tokens(merge_prompt)
+                        resp = write_ai_stream(merge_prompt, "gpt-4o", 0.1)
+                        st.caption(f"🧮 Prompts: {tokens:,} tokens over {len(market_reports) + 1} calls")
+                else:
+                    ext_ctx = ""
+                    if olivia_needs_deep_search(ctrys):
+                        d, error, _ = cached_async_mia_deep_search(f"Regulations for {desc} in {ctrys}", "m12", 20)
+                        if d and d != "DISABLED": ext_ctx = d
+
+                    final_text_prompt, prompt_report = assemble_olivia_prompt(create_olivia_prompt(desc, ctrys), ext_ctx, documents, len(images_payload))
+                    resp = write_ai_stream(None, "gpt-4o", 0.1, messages=build_olivia_messages(final_text_prompt, images_payload))
+                    st.caption(format_prompt_report(prompt_report))
+                if not failed:
+                    st.session_state["last_olivia_report"] = resp
+                    st.session_state["last_olivia_id"] = str(uuid.uuid4())
+                    log_usage("OlivIA", st.session_state["last_olivia_id"], desc, f"Mkts:{len(ctrys)}")
+                    st.toast("Analysis Ready!", icon="✅")
             except Exception as e: st.error(f"Error: {str(e)}")
 
     if st.session_state["last_olivia_report"]:
@@ -910,15 +1471,33 @@ def page_olivia():
 def page_eva():
     st.title("🔍 EVA Workspace")
     ctx = st.text_area("Context", value=st.session_state.get("last_olivia_report", ""), key="eva_ctx")
-    up = st.file_uploader("PDF", type="pdf", key="eva_up")
+    up = st.file_uploader("PDF", type="pdf", key="eva_up", accept_multiple_files=True)
+    mode = st.radio("Audit Mode", ["Focused (most relevant passages)", "Full (every section, multi-file)"], horizontal=True, key="eva_mode")
     if st.button("Run Audit", type="primary", key="eva_btn") and up:
         with st.spinner("Auditing..."):
             try:
-                txt = extract_text_from_pdf(up.read())
-                resp = cached_ai_generation(create_eva_prompt(ctx, txt), "gpt-4o", 0.1)
+                documents = [(f.name, extract_text_from_pdf(f.getvalue(), config.EVA_PDF_CHAR_BUDGET)) for f in up]
+                unreadable = [n for n, t in documents if t == "Error reading PDF"]
+                if unreadable: st.warning(f"Unreadable: {', '.join(unreadable)}")
+                documents = [(n, t) for n, t in documents if n not in unreadable]
+                if mode.startswith("Full"):
+                    bar = st.progress(0.0, text="Auditing sections...")
+                    reduce_prompt, reduce_report, done, total, errors, map_tokens, shortened = eva_map_sections(ctx, documents, on_progress=lambda n, t: bar.progress(n / t, text=f"Audited {n}/{t} sections"))
+                    bar.empty()
+                    if done < total: st.warning(f"Only the first {done} of {total} sections were audited.")
+                    if errors: st.warning(f"{len(errors)} section(s) failed: {errors[0]}")
+                    resp = write_ai_stream(reduce_prompt, config.EVA_REDUCE_MODEL, 0.1) if done else None
+                    if done:
+                        st.caption(f"🧮 Sections: {map_tokens:,} prompt tokens over {done} calls ({config.EVA_MAP_MODEL})" + (f" · {shortened} shortened" if shortened else ""))
+                        st.caption(format_prompt_report(reduce_report))
+                else:
+                    txt = "\n\n".join(f"=== {n} ===\n{t}" for n, t in documents)
+                    eva_prompt, prompt_report = create_eva_prompt(ctx, build_eva_evidence(ctx, txt))
+                    resp = write_ai_stream(eva_prompt, "gpt-4o", 0.1)
+                    st.caption(format_prompt_report(prompt_report) + f" · evidence budget {config.EVA_EVIDENCE_TOKENS:,}")
                 st.session_state["last_eva_report"] = resp
                 st.session_state["last_eva_id"] = str(uuid.uuid4())
-                log_usage("EVA", st.session_state["last_eva_id"], f"File: {up.name}")
+                log_usage("EVA", st.session_state["last_eva_id"], f"Files: {', '.join(f.name for f in up)}")
                 st.toast("Audit Complete!", icon="🔍")
             except Exception as e: st.error(str(e))
     
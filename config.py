@@ -100,3 +100,143 @@ AGENTS = {
         "description": "Audit technical documentation against regulatory requirements.",
     },
 }
+
+# =============================================================================
+# DONNÉES LOCALES & JOURNAL D'USAGE
+# =============================================================================
+DATA_DIR = ".valhallai"  # Dossier local (spill des logs, caches...)
+LOG_QUEUE_MAX = 1000  # Lignes max en attente dans la file mémoire
+LOG_BATCH_SIZE = 50  # Lignes envoyées par appel append_rows
+LOG_FLUSH_INTERVAL = 5  # Secondes max avant l'envoi d'un lot incomplet
+LOG_SPILL_FILE = "logs_spill.jsonl"  # Lignes non envoyées (feuille indisponible)
+
+# =============================================================================
+# STOCKAGE (GOOGLE SHEETS / SQLITE)
+# =============================================================================
+STORAGE_BACKEND = "gsheets"  # "gsheets" ou "sqlite" (surchargeable via la variable d'env STORAGE_BACKEND)
+SQLITE_FILE = "valhallai.db"  # Base locale (dans DATA_DIR) quand STORAGE_BACKEND = "sqlite"
+STORAGE_SYNC_INTERVAL = 900  # Secondes entre deux recopies SQLite -> Google Sheets
+SHEETS_SNAPSHOT_TTL = 300  # Secondes de cache des onglets de configuration (Markets, Domains...)
+
+# =============================================================================
+# RÉSEAU (PIPELINE MIA)
+# =============================================================================
+HTTP_POOL_LIMIT = 100  # Connexions ouvertes max (toutes destinations)
+HTTP_LIMIT_PER_HOST = 8  # Connexions max par hôte (évite de marteler un même site)
+HTTP_DNS_TTL = 300  # Secondes de cache DNS
+HTTP_KEEPALIVE = 30  # Secondes de conservation des connexions inactives
+HTTP_MAX_CONCURRENCY = 20  # Requêtes simultanées max (Google + fetchs)
+HTTP_TIMEOUT = 15  # Timeout total d'une requête (secondes)
+GOOGLE_CSE_QPM = 100  # Requêtes Google CSE par minute (quota par défaut de l'API)
+GOOGLE_CSE_BURST = 10  # Rafale max autorisée par le token bucket
+GOOGLE_CSE_MAX_RETRIES = 4  # Nouvelles tentatives sur 429 / 5xx (backoff exponentiel + jitter)
+TAVILY_MAX_CONCURRENCY = 8  # Appels Tavily simultanés max
+TAVILY_TIMEOUT = 20  # Timeout d'un appel Tavily (secondes)
+
+# =============================================================================
+# CACHE DES SOURCES (PDF, TEXTE EXTRAIT, TAVILY)
+# =============================================================================
+URL_CACHE_DIR = "url_cache"  # Cache disque des sources (dans DATA_DIR)
+URL_CACHE_MAX_MB = 500  # Taille max avant éviction LRU
+URL_CACHE_FRESH_SECONDS = 3600  # Durée pendant laquelle un PDF est servi sans revalidation
+TAVILY_CACHE_TTL = 86400  # Durée de validité d'un résultat Tavily en cache (secondes)
+PDF_DENSITY_TOP_K = 1  # Nombre d'extraits (fenêtres les plus denses en mots-clés) gardés par PDF
+
+# =============================================================================
+# PARSING PDF (POOL DE PROCESSUS)
+# =============================================================================
+PDF_WORKERS = 4  # Processus de parsing PyMuPDF en parallèle
+PDF_WORKER_MEMORY_MB = 1024  # Plafond mémoire par processus
+PDF_PARSE_TIMEOUT = 45  # Secondes max d'exécution par tâche du pool (attente en file non comptée)
+PDF_MAX_BYTES = 50 * 1024 * 1024  # PDF plus gros ignorés (repli sur Tavily)
+PDF_MAX_PAGES = 1000  # Pages extraites au maximum par document
+
+# =============================================================================
+# MIA - STREAMING DES SOURCES
+# =============================================================================
+MIA_STREAM_MIN_SOURCES = 8  # Sources exploitables suffisantes pour lancer la synthèse
+MIA_STREAM_DEADLINE = 30  # Secondes max de collecte avant synthèse
+MIA_STREAM_MIN_CHARS = 300  # Contenu minimal pour qu'une source compte comme exploitable
+
+# =============================================================================
+# DOCUMENTS TÉLÉVERSÉS (OLIVIA / EVA)
+# =============================================================================
+UPLOAD_PDF_BATCH_PAGES = 8  # Pages par tâche d'extraction envoyée au pool PDF
+OLIVIA_PDF_CHAR_BUDGET = 8000  # Caractères extraits par document joint à OlivIA
+EVA_PDF_CHAR_BUDGET = 2000000  # Plafond d'extraction du document audité par EVA (le prompt reste borné par EVA_EVIDENCE_TOKENS)
+UPLOAD_CACHE_DIR = "upload_cache"  # Cache disque du texte extrait des documents téléversés (dans DATA_DIR)
+UPLOAD_CACHE_MAX_MB = 200  # Taille max avant éviction LRU
+UPLOAD_CACHE_MEM_ITEMS = 32  # Documents gardés en mémoire devant le cache disque
+
+# =============================================================================
+# EVA - RECHERCHE DE PASSAGES (BM25)
+# =============================================================================
+EVA_CHUNK_WORDS = 180  # Taille d'un chunk indexé (mots)
+EVA_CHUNK_OVERLAP = 40  # Chevauchement entre chunks consécutifs (mots)
+EVA_PASSAGES_PER_REQUIREMENT = 3  # Passages candidats par exigence du contexte
+EVA_EVIDENCE_TOKENS = 4000  # Budget (tokens estimés) des passages envoyés au modèle
+
+# =============================================================================
+# EVA - AUDIT COMPLET (MAP-REDUCE)
+# =============================================================================
+EVA_SECTION_CHARS = 16000  # Taille d'une section auditée par un appel (caractères)
+EVA_MAX_SECTIONS = 80  # Sections auditées au maximum par audit
+EVA_MAX_CONCURRENCY = 8  # Appels LLM simultanés pendant la phase map
+EVA_MAP_MODEL = "gpt-4o"  # Modèle d'audit des sections
+EVA_REDUCE_MODEL = "gpt-4o"  # Modèle du verdict consolidé
+
+# =============================================================================
+# CACHE DES RÉPONSES LLM
+# =============================================================================
+LLM_CACHE_DIR = "llm_cache"  # Cache disque des réponses (dans DATA_DIR)
+LLM_CACHE_MAX_MB = 100  # Taille max avant éviction LRU
+LLM_CACHE_TTL = 7 * 86400  # Durée de validité d'une réponse en cache (secondes)
+
+# =============================================================================
+# OLIVIA - ANALYSE PAR MARCHÉ (FAN-OUT)
+# =============================================================================
+OLIVIA_MAX_CONCURRENCY = 5  # Analyses de marché (appels LLM) simultanées
+
+# =============================================================================
+# MIA - ANALYSE D'IMPACT PAR LOT
+# =============================================================================
+IMPACT_MAX_CONCURRENCY = 6  # Analyses d'impact simultanées
+LLM_BATCH_RPM = 120  # Appels LLM par minute max pour les traitements par lot (tous utilisateurs)
+LLM_BATCH_BURST = 10  # Rafale max autorisée par le limiteur
+
+# =============================================================================
+# CLIENT OPENAI (POOL, RETRIES, PLAFONDS PAR MODÈLE)
+# =============================================================================
+LLM_TIMEOUT = 120  # Timeout d'un appel (secondes ; pour un stream, entre deux fragments)
+LLM_MAX_CONNECTIONS = 50  # Connexions HTTP max vers l'API
+LLM_MAX_KEEPALIVE = 20  # Connexions gardées ouvertes entre deux appels
+LLM_MAX_RETRIES = 4  # Nouvelles tentatives sur 429 / 5xx / erreur réseau (backoff + Retry-After)
+LLM_MODEL_CONCURRENCY = {"gpt-4o": 16, "gpt-4o-mini": 32}  # Appels simultanés max par modèle
+LLM_DEFAULT_CONCURRENCY = 8  # Pour les modèles absents de la table
+
+# =============================================================================
+# BUDGETS DE PROMPT (TOKENS)
+# =============================================================================
+LLM_CONTEXT_WINDOWS = {"gpt-4o": 128000, "gpt-4o-mini": 128000}  # Fenêtre de contexte par modèle
+PROMPT_OUTPUT_RESERVE = 4096  # Tokens laissés à la réponse
+PROMPT_BUDGETS = {"olivia": 24000, "olivia_merge": 40000, "eva": 24000}  # Plafond par agent (sous la fenêtre du modèle)
+PROMPT_IMAGE_TOKENS = 765  # Coût estimé d'une image jointe (détail élevé, 1024 px)
+SOURCE_MAX_TOKENS = 2000  # Contenu web gardé par source lors de la collecte
+MIA_SOURCE_TOKENS = 200  # Contenu par source dans le digest MIA
+MIA_DIGEST_TOKENS = 12000  # Budget total du digest (les sources les moins bien classées sortent en premier)
+MIA_TOP_SOURCES = 15  # Sources gardées pour la synthèse après classement BM25 et dédoublonnage
+MIA_SIMHASH_DISTANCE = 3  # Distance de Hamming max (sur 64 bits) entre deux contenus quasi identiques
+
+# =============================================================================
+# MIA - RUNS INCRÉMENTAUX DES WATCHLISTS
+# =============================================================================
+MIA_DELTA_MAX_SEEN = 1000  # URLs (et empreintes de contenu) mémorisées par watchlist
+MIA_DELTA_MAX_ITEMS = 60  # Items gardés dans le rapport fusionné (nouveaux en tête)
+
+# =============================================================================
+# MIA - RUNS PLANIFIÉS (mia_worker.py)
+# =============================================================================
+MIA_WORKER_POLL = 900  # Secondes entre deux passages du worker
+MIA_WORKER_MAX_AGE = 6 * 3600  # Une watchlist est relancée quand son dernier rapport est plus ancien
+MIA_WORKER_CONCURRENCY = 3  # Watchlists traitées en parallèle
+MIA_WORKER_QUOTA_RESERVE = 500  # Requêtes Google du jour laissées aux analystes (le passage s'arrête avant)
@@ -0,0 +1,84 @@
+"""
+VALHALLAI - Runs planifiés des watchlists MIA (sans interface)
+Chaque passage relance, par un pool borné, les watchlists dont le dernier rapport est plus ancien
+que MIA_WORKER_MAX_AGE (les plus anciennes d'abord, en run incrémental). Un passage s'arrête
+avant d'entamer la réserve de quota Google laissée aux analystes ; le reste attend le suivant.
+Les rapports sont persistés dans l'état de chaque watchlist : la page MIA les affiche au chargement.
+
+    python mia_worker.py            # boucle : un passage toutes les MIA_WORKER_POLL secondes
+    python mia_worker.py --once     # un seul passage (cron)
+"""
+import sys
+import time
+import argparse
+import concurrent.futures
+from datetime import datetime
+
+import config
+import app  # Importé hors "streamlit run" : pipeline seul (IS_HEADLESS)
+from utils_watch import due_watchlists
+
+
+def log(message):
+    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {message}", flush=True)
+
+
+def run_pass():
+    app_config = app.get_app_config()
+    stats = {"updated": 0, "unchanged": 0, "failed": 0, "deferred": 0}
+    if app_config.get("mia_scheduler", "TRUE") != "TRUE":
+        log("Scheduled runs disabled by admin")
+        return stats
+    try: max_res = int(app_config.get("max_search_results", 20))
+    except ValueError: max_res = 20
+
+    # Quota relu depuis le stockage : la consommation de l'application est prise en compte
+    app.persist_google_quota()
+    app.get_google_quota.clear()
+    quota = app.get_google_quota()
+    try: quota.limit = int(app_config.get("google_daily_quota", quota.limit))
+    except ValueError: pass
+    domains, _ = app.get_domains()
+    cost = app.estimate_google_calls(len(domains), max_res) if app_config.get("provider_google", "TRUE") != "FALSE" else 0
+
+    # Watchlists les plus anciennes d'abord
+    queue = due_watchlists([(wl, app.get_watchlist_state(wl["id"])) for wl in app.get_watchlists()], config.MIA_WORKER_MAX_AGE)
+    log(f"{len(queue)} watchlist(s) due · Google quota left {quota.remaining()} · ~{cost} call(s) per run")
+    pending = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=config.MIA_WORKER_CONCURRENCY, thread_name_prefix="mia-worker") as pool:
+        while queue or pending:
+            while queue and len(pending) < config.MIA_WORKER_CONCURRENCY:
+                # Les runs en vol n'ont peut-être pas encore consommé leur part : elle est déjà décomptée
+                if quota.remaining() - cost * (len(pending) + 1) < config.MIA_WORKER_QUOTA_RESERVE:
+                    log(f"Quota reserve reached: {len(queue)} watchlist(s) deferred to the next pass")
+                    stats["deferred"] += len(queue)
+                    queue = []
+                    break
+                wl, state = queue.pop(0)
+                pending[pool.submit(app.run_watchlist, wl, state, max_res, app_config)] = wl
+            if not pending: break
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for fut in done:
+                wl = pending.pop(fut)
+                try: status, error = fut.result()
+                except Exception as e: status, error = "failed", str(e)
+                stats[status] += 1
+                log(f"[{wl['name']}] {status}" + (f" ({error})" if error else ""))
+    app.persist_google_quota()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scheduled MIA watchlist runs")
+    parser.add_argument("--once", action="store_true", help="run a single pass, then exit")
+    args = parser.parse_args(argv)
+    while True:
+        started = time.monotonic()
+        try: log(f"Pass done: {run_pass()}")
+        except Exception as e: log(f"Pass failed: {e}")
+        if args.once: return 0
+        time.sleep(max(0, config.MIA_WORKER_POLL - (time.monotonic() - started)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
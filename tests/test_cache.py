@@ -0,0 +1,60 @@
+import time
+
+from utils_cache import DiskCache, UrlCache, DocumentTextCache, LlmCache, canonical_url, llm_cache_key
+
+
+def test_disk_cache_round_trip_and_shared_blobs(tmp_path):
+    cache = DiskCache(str(tmp_path), 10_000)
+    assert cache.get("a") is None
+    cache.put("a", b"payload", {"k": 1})
+    cache.put("b", b"payload")
+    assert cache.get("a") == (b"payload", {"k": 1})
+    assert cache.get_meta("a") == {"k": 1} and cache.get_meta("zzz") is None
+    assert cache.stats()["bytes"] == len(b"payload")  # Même contenu : un seul blob
+    cache.delete("a")
+    assert cache.get("b") == (b"payload", {})
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), 1000)
+    for i in range(5): cache.put(f"k{i}", bytes([i]) * 300)
+    assert cache.total_bytes() <= 1000
+    assert cache._bytes == cache.total_bytes()
+    assert cache.get("k0") is None and cache.get("k4") is not None
+
+
+def test_url_cache_canonical_keys_and_metadata_without_body(tmp_path):
+    assert canonical_url("HTTPS://Example.com:443/a?b=2&utm_source=x&a=1#frag") == "https://example.com/a?a=1&b=2"
+    urls = UrlCache(DiskCache(str(tmp_path), 10_000), fresh_seconds=60)
+    urls.put_document("https://example.com/a.pdf", b"%PDF", {"ETag": '"v1"'})
+    meta = urls.get_document_meta("https://EXAMPLE.com/a.pdf#top")
+    assert meta["etag"] == '"v1"' and urls.is_fresh(meta)
+    assert urls.conditional_headers(meta) == {"If-None-Match": '"v1"'}
+
+
+def test_document_text_cache_serves_smaller_budgets_only(tmp_path):
+    cache = DocumentTextCache(DiskCache(str(tmp_path), 10_000), max_items=2)
+    cache.put("d", "x" * 100, {"char_budget": 100, "complete": False})
+    assert cache.get("d", 50)[0] == "x" * 50
+    assert cache.get("d", 200) is None
+    cache.put("d", "x" * 60, {"char_budget": 60, "complete": False})  # Plus court : ignoré
+    assert len(cache.get("d", 100)[0]) == 100
+    fresh = DocumentTextCache(cache.store)  # Niveau disque seul
+    assert fresh.get("d", 80)[0] == "x" * 80
+
+
+def test_llm_cache_key_ignores_image_bytes_and_entries_expire(tmp_path):
+    image = [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "data:image/jpeg;base64," + "A" * 5000}}]}]
+    assert llm_cache_key("gpt-4o", 0.1, False, image) == llm_cache_key("gpt-4o", 0.1, False, image)
+    assert llm_cache_key("gpt-4o", 0.1, False, image) != llm_cache_key("gpt-4o", 0.1, True, image)
+    cache = LlmCache(DiskCache(str(tmp_path), 10_000), ttl=60)
+    cache.put("k", "réponse", "gpt-4o")
+    assert cache.get("k") == "réponse"
+    cache.store.update_meta("llm:k", {"created": time.time() - 120})
+    assert cache.get("k") is None and cache.expired == 1
+
+
+def test_document_text_cache_serves_text_cut_by_max_pages(tmp_path):
+    cache = DocumentTextCache(DiskCache(str(tmp_path), 10_000))
+    cache.put("d", "x" * 100, {"char_budget": None, "complete": False})  # Arrêt sur max_pages
+    assert cache.get("d")[0] == "x" * 100 and cache.get("d", 40)[0] == "x" * 40
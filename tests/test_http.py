@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+import utils_http
+from utils_http import TokenBucket, DailyQuota
+
+
+def test_token_bucket_allows_a_burst_then_paces():
+    bucket = TokenBucket(rate=20, capacity=3)
+
+    async def take(n):
+        for _ in range(n): await bucket.acquire()
+
+    started = time.monotonic()
+    asyncio.run(take(3))
+    assert time.monotonic() - started < 0.05
+    asyncio.run(take(2))
+    assert time.monotonic() - started >= 0.08
+
+
+def test_daily_quota_persists_on_top_of_other_processes(monkeypatch):
+    monkeypatch.setattr(utils_http, "_quota_day", lambda: "2026-10-16")
+    stored = {"value": "2026-10-16:10"}
+    quota = DailyQuota(15, lambda: stored["value"], lambda v: stored.update(value=v))
+    assert quota.remaining() == 5
+    assert quota.try_consume(3) and not quota.try_consume(3)
+    stored["value"] = "2026-10-16:12"  # Un autre processus a consommé 2 requêtes
+    quota.persist()
+    assert stored["value"] == "2026-10-16:15" and quota.remaining() == 0
+
+
+def test_daily_quota_resets_on_a_new_day(monkeypatch):
+    monkeypatch.setattr(utils_http, "_quota_day", lambda: "2026-10-17")
+    assert DailyQuota(100, lambda: "2026-10-16:99").remaining() == 100
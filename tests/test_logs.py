@@ -0,0 +1,42 @@
+import os
+import json
+import time
+
+from utils_logs import UsageLogBuffer
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline: time.sleep(0.01)
+    return predicate()
+
+
+def test_failed_batches_spill_then_replay_after_the_next_send(tmp_path):
+    sent, up = [], {"ok": False}
+
+    def sink(rows):
+        if not up["ok"]: raise ConnectionError("sheet unavailable")
+        sent.extend(rows)
+
+    spill = str(tmp_path / "usage_spill.jsonl")
+    buffer = UsageLogBuffer(sink, spill, batch_size=2, flush_interval=0.05)
+    buffer.log(["2026-01-01", "10:00:00", "id1"])
+    buffer.log(["2026-01-01", "10:01:00", "id2"])
+    assert wait_for(lambda: os.path.exists(spill))
+    up["ok"] = True
+    buffer.log(["2026-01-01", "10:02:00", "id3"])
+    assert wait_for(lambda: len(sent) == 3)
+    buffer.close()
+    assert [r[2] for r in sent] == ["id3", "id1", "id2"]
+    assert not os.path.exists(spill) and not os.path.exists(spill + ".replay")
+
+
+def test_rows_left_by_a_crash_are_replayed_on_start(tmp_path):
+    spill = str(tmp_path / "usage_spill.jsonl")
+    with open(spill + ".replay", "w", encoding="utf-8") as f: f.write(json.dumps(["a"]) + "\n")
+    with open(spill, "w", encoding="utf-8") as f: f.write(json.dumps(["b", "é"]) + "\n")
+    sent = []
+    buffer = UsageLogBuffer(sent.extend, spill, flush_interval=0.05)
+    assert wait_for(lambda: len(sent) == 2)
+    buffer.close()
+    assert sent == [["a"], ["b", "é"]]
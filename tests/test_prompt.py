@@ -0,0 +1,21 @@
+from utils_prompt import PromptAssembler, count_tokens
+
+
+def test_required_segments_stay_whole_and_low_priority_ones_go_first():
+    rules = "Always answer in JSON. " * 20
+    asm = (PromptAssembler("gpt-4o", budget=count_tokens(rules) + 400)
+           .add("rules", rules, required=True)
+           .add("context", "regulation text " * 300, priority=2, min_tokens=100, header="### CONTEXT\n")
+           .add("history", "older findings " * 300, priority=1, min_tokens=100))
+    prompt, report = asm.build()
+    assert prompt.startswith(rules) and "### CONTEXT\n" in prompt and "older findings" not in prompt
+    assert report["truncated"] == ["context"] and report["dropped"] == ["history"]
+    assert report["total"] <= report["budget"] + 5
+
+
+def test_segments_that_fit_are_kept_in_insertion_order():
+    asm = PromptAssembler("gpt-4o", budget=10_000).add("b", "second", priority=1).add("a", "first", priority=5)
+    asm.add_images(2)
+    prompt, report = asm.build()
+    assert prompt == "second\n\nfirst"
+    assert report["truncated"] == [] and report["dropped"] == [] and report["total"] >= 2 * 765
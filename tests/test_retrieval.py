@@ -0,0 +1,52 @@
+from utils_retrieval import BM25Index, chunk_text, rank_sources, split_sections, merge_eva_findings, parse_requirements
+
+BATTERIES = "Regulation on batteries and waste batteries, collection targets, due diligence for lithium and cobalt. " * 4
+RADIO = "Implementing decision on harmonised standards for radio equipment cybersecurity and network protection. " * 4
+NOTICE = " ".join(f"article {i} batteries obligation clause{i} economic operators labelling requirement{i}" for i in range(60))
+
+
+def test_split_sections_respects_the_size_limit_and_keeps_text():
+    text = "\n\n".join(f"Paragraph {i} " + "word " * 50 for i in range(40))
+    sections = split_sections(text, max_chars=1000)
+    assert len(sections) > 1 and all(len(s) <= 1000 for s in sections)
+    assert "".join(sections).replace("\n", "").replace(" ", "") == text.replace("\n", "").replace(" ", "")
+
+
+def test_eva_findings_keep_the_best_status_with_located_evidence():
+    partials = [
+        (("b.pdf", 1, 1, ""), [{"requirement": "CE  marking", "status": "Met", "evidence": "label p.2"}]),
+        (("a.pdf", 2, 2, ""), [{"requirement": "ce marking", "status": "Missing", "missing": "no label"},
+                               {"requirement": "Battery passport", "status": "unclear", "evidence": "draft"}]),
+        (("a.pdf", 1, 2, ""), [{"requirement": "CE marking", "status": "Partial", "evidence": "manual"}]),
+    ]
+    assert merge_eva_findings(partials).split("\n") == [
+        "CE marking | Met | a.pdf §1: manual; b.pdf §1: label p.2 | -",
+        "Battery passport | Missing | a.pdf §2: draft | -",
+    ]
+
+
+def test_bm25_ranks_the_matching_chunk_first():
+    index = BM25Index(chunk_text(RADIO + BATTERIES, chunk_words=20, overlap=0))
+    best, _ = index.search("lithium batteries collection", top_k=1)[0]
+    assert "batteries" in index.chunks[best][2]
+
+
+def test_generic_titles_do_not_merge_different_regulations():
+    title = "Official Journal of the European Union - L series"
+    sources = [{"source": "https://eur-lex.europa.eu/a", "title": title, "content": BATTERIES},
+               {"source": "https://eur-lex.europa.eu/b", "title": title, "content": RADIO}]
+    kept, duplicates = rank_sources(sources, "batteries")
+    assert duplicates == 0 and [s["source"] for s in kept] == ["https://eur-lex.europa.eu/a", "https://eur-lex.europa.eu/b"]
+
+
+def test_near_duplicates_and_mirrors_are_merged():
+    sources = [{"source": "https://a.eu/x?utm_source=n", "title": "A", "content": RADIO},
+               {"source": "https://a.eu/x", "title": "B", "content": NOTICE},
+               {"source": "https://mirror.eu/y", "title": "C", "content": NOTICE + " Updated."}]
+    kept, duplicates = rank_sources(sources, "batteries", url_key=lambda u: u.split("?")[0])
+    assert duplicates == 2 and len(kept) == 1
+
+
+def test_requirements_come_from_bullets_and_tables():
+    ctx = "# Title\n- CE marking on the product label\n| Battery | Annex II labelling |\n|---|---|\n1. Declaration of conformity kept"
+    assert parse_requirements(ctx) == ["CE marking on the product label", "Battery Annex II labelling", "Declaration of conformity kept"]
@@ -0,0 +1,166 @@
+import time
+import asyncio
+import threading
+
+from utils_runtime import SingleFlight, ProcessWorkerPool, TaskTimeout, bounded_fanout
+
+
+def test_coalesced_callers_survive_a_cancelled_leader():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 42
+
+        leader = asyncio.ensure_future(flight.do_async("k", work))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.do_async("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, calls, flight.coalesced
+
+    assert asyncio.run(scenario()) == (42, [1], 1)
+
+
+def test_shared_work_is_cancelled_once_nobody_waits():
+    async def scenario():
+        flight, cancelled = SingleFlight(), []
+
+        async def work():
+            try: await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        caller = asyncio.ensure_future(flight.do_async("k", work))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.01)
+        return cancelled, await flight.do_async("k", lambda: asyncio.sleep(0, result="again"))
+
+    assert asyncio.run(scenario()) == ([1], "again")
+
+
+def test_interrupted_sync_leader_hands_over_to_a_waiter():
+    flight, started, results = SingleFlight(), threading.Event(), []
+
+    def leader():
+        def interrupted():
+            started.set()
+            time.sleep(0.1)
+            raise KeyboardInterrupt  # Comme un rerun Streamlit : BaseException hors Exception
+        try: flight.do("k", interrupted)
+        except KeyboardInterrupt: pass
+
+    thread = threading.Thread(target=leader)
+    thread.start()
+    started.wait()
+    results.append(flight.do("k", lambda: "recomputed"))
+    thread.join()
+    assert results == ["recomputed"]
+
+
+def test_errors_are_shared_with_waiters():
+    flight = SingleFlight()
+
+    async def scenario():
+        async def boom():
+            await asyncio.sleep(0.05)
+            raise ValueError("boom")
+        return await asyncio.gather(flight.do_async("k", boom), flight.do_async("k", boom), return_exceptions=True)
+
+    assert [str(e) for e in asyncio.run(scenario())] == ["boom", "boom"]
+
+
+def spin():
+    while True: time.sleep(0.01)
+
+
+def quick():
+    return "ok"
+
+
+def test_pool_timeout_runs_in_the_worker_and_frees_it():
+    pool = ProcessWorkerPool(1, timeout=0.5)
+    pool.warm_up()[0].result(timeout=60)
+
+    async def scenario():
+        started = time.monotonic()
+        slow = asyncio.ensure_future(pool.run(spin))
+        fast = asyncio.ensure_future(pool.run(quick))  # En file derrière la tâche lente : pas de timeout pour l'attente
+        try:
+            await slow
+            timed_out = False
+        except TaskTimeout: timed_out = True
+        return timed_out, await fast, time.monotonic() - started
+
+    timed_out, result, elapsed = asyncio.run(scenario())
+    assert timed_out and result == "ok" and elapsed < 3
+    assert pool.submit(quick).result(timeout=10) == "ok"
+
+
+def test_bounded_fanout_limits_concurrency_and_awaits_cancelled_tasks():
+    async def scenario():
+        running, peak, cleaned = [0], [0], []
+
+        async def work(i):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            try:
+                await asyncio.sleep(0.01 if i < 3 else 10)
+                return i
+            finally:
+                running[0] -= 1
+                cleaned.append(i)
+
+        results = bounded_fanout(range(6), work, limit=2)
+        first = [await results.__anext__() for _ in range(3)]
+        await results.aclose()
+        return sorted(first), peak[0], running[0], sorted(cleaned)
+
+    first, peak, running, cleaned = asyncio.run(scenario())
+    assert first == [0, 1, 2] and peak == 2 and running == 0 and cleaned == [0, 1, 2, 3, 4]
+
+
+async def collect(agen):
+    return [part async for part in agen]
+
+
+def test_streams_are_shared_and_replayed_to_followers():
+    async def scenario():
+        flight, calls = SingleFlight(), []
+
+        async def tokens():
+            calls.append(1)
+            for t in ("Bon", "jour"):
+                await asyncio.sleep(0.02)
+                yield t
+
+        leader = asyncio.ensure_future(collect(flight.stream_async("k", tokens)))
+        await asyncio.sleep(0.01)
+        stream_follower = asyncio.ensure_future(collect(flight.stream_async("k", tokens)))
+        plain_follower = asyncio.ensure_future(flight.do_async("k", lambda: asyncio.sleep(0, result="other")))
+        return await leader, await stream_follower, await plain_follower, calls
+
+    assert asyncio.run(scenario()) == (["Bon", "jour"], ["Bonjour"], "Bonjour", [1])
+
+
+def test_a_closed_leader_stream_hands_over_to_a_follower():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def tokens():
+            for t in ("a", "b", "c"):
+                await asyncio.sleep(0.02)
+                yield t
+
+        leader = flight.stream_async("k", tokens)
+        first = await leader.__anext__()
+        follower = asyncio.ensure_future(asyncio.wait_for(collect(flight.stream_async("k", tokens)), 5))
+        await asyncio.sleep(0.01)
+        await leader.aclose()  # Stop côté meneur
+        return first, await follower
+
+    assert asyncio.run(scenario()) == ("a", ["a", "b", "c"])
@@ -0,0 +1,40 @@
+from utils_sheets import WorkbookSnapshot, first_column
+
+
+class FakeSheet:
+    def __init__(self, title): self.title = title
+
+
+class FakeWorkbook:
+    """Comme l'API : un onglet inexistant dans le batch fait échouer tout l'appel."""
+    def __init__(self, tabs):
+        self.tabs = tabs
+        self.batches = []
+
+    def values_batch_get(self, ranges):
+        titles = [r[1:-1].replace("''", "'") for r in ranges]
+        self.batches.append(titles)
+        if any(t not in self.tabs for t in titles): raise ValueError("Unable to parse range")
+        return {"valueRanges": [{"values": self.tabs[t]} for t in titles]}
+
+    def worksheets(self):
+        return [FakeSheet(t) for t in self.tabs]
+
+
+def test_tabs_are_read_in_one_batch_and_served_until_invalidated():
+    wb = FakeWorkbook({"Markets": [["EU"], ["USA"]], "Domains": [["europa.eu"]]})
+    snap = WorkbookSnapshot(wb, ["Markets", "Domains"], ttl=300)
+    assert snap.get("Markets") == [["EU"], ["USA"]] and snap.get("Domains") == [["europa.eu"]]
+    assert wb.batches == [["Markets", "Domains"]]
+    wb.tabs["Markets"] = [["China"]]
+    snap.invalidate("Markets")
+    assert first_column(snap.get("Markets")) == ["China"]
+    assert wb.batches[-1] == ["Markets"]
+
+
+def test_a_missing_tab_does_not_fail_the_others():
+    wb = FakeWorkbook({"Markets": [["EU"]], "Owner's tab": [["x"]]})
+    snap = WorkbookSnapshot(wb, ["Markets", "Watchlists", "Owner's tab"], ttl=300)
+    assert snap.get("Watchlists") is None
+    assert snap.get("Markets") == [["EU"]] and snap.get("Owner's tab") == [["x"]]
+    assert wb.batches == [["Markets", "Watchlists", "Owner's tab"], ["Markets", "Owner's tab"]]
@@ -0,0 +1,130 @@
+import pytest
+
+pytest.importorskip("gspread")
+
+import gspread
+
+from utils_storage import StorageBackend, SQLiteStorage, GSheetStorage, StorageSyncJob, mirror_to_sheet, LOG_HEADER
+
+DEFAULTS = {"markets": ["EU", "USA"], "domains": ["europa.eu"], "config": {"max_search_results": "20", "google_cse_usage": ""}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteStorage(str(tmp_path / "valhallai.db"), DEFAULTS)
+
+
+def test_backends_must_implement_the_whole_interface():
+    class Partial(StorageBackend):
+        def get_markets(self): return []
+
+    with pytest.raises(TypeError): Partial(DEFAULTS)
+
+
+def test_lists_are_seeded_then_edited_by_position(store):
+    assert store.get_markets() == ["EU", "USA"]
+    assert store.add_market("China")
+    assert not store.add_market("China")
+    store.update_market(1, "United States")
+    store.remove_market(0)
+    assert store.get_markets() == ["United States", "China"]
+    assert store.get_domains() == ["europa.eu"]
+
+
+def test_watchlist_round_trip_and_delete_drops_run_state(store):
+    wl_id = store.save_watchlist("Batteries", "lithium batteries", "EU, USA", "📅 Last 12 Months")
+    assert store.get_watchlists() == [{"id": wl_id, "name": "Batteries", "topic": "lithium batteries",
+                                       "markets": "EU, USA", "timeframe": "📅 Last 12 Months"}]
+    state = {"query": "q", "seen": {"https://europa.eu/a": "abc"}, "report": {"executive_summary": "Résumé ✓"}}
+    store.save_watchlist_state(wl_id, state)
+    store.save_watchlist_state(wl_id, {**state, "query": "q2"})
+    assert store.get_watchlist_state(wl_id) == {**state, "query": "q2"}
+    assert store.delete_watchlist(wl_id)
+    assert store.get_watchlists() == []
+    assert store.get_watchlist_state(wl_id) is None
+
+
+def test_app_config_defaults_updates_and_fresh_value(store):
+    assert store.get_app_config()["max_search_results"] == "20"
+    store.update_app_config("max_search_results", 40)
+    store.update_app_config("new_key", "x")
+    config = store.get_app_config()
+    assert config["max_search_results"] == "40" and config["new_key"] == "x"
+    assert store.get_config_value("max_search_results") == "40"
+    assert store.get_config_value("missing") is None
+
+
+def test_logs_are_padded_and_marked_synced(store):
+    store.append_logs([["2026-01-01", "10:00:00", "id1", "MIA", "topic"], ["2026-01-01", "10:01:00", "id2", "EVA", "", "m"]])
+    pending = store.pending_logs()
+    assert [r[3] for r in pending] == ["id1", "id2"] and pending[0][6] == ""
+    store.mark_logs_synced([pending[0][0]])
+    assert [r[3] for r in store.pending_logs()] == ["id2"]
+
+
+class Cell:
+    def __init__(self, value): self.value = value
+
+
+class FakeSheet:
+    def __init__(self, wb, title): self.wb, self.title = wb, title
+
+    @property
+    def rows(self): return self.wb.tabs[self.title]
+
+    def get_all_values(self): return self.rows
+    def cell(self, row, col): return Cell(self.rows[row - 1][col - 1] if len(self.rows) >= row and len(self.rows[row - 1]) >= col else "")
+    def clear(self): self.wb.tabs[self.title] = []
+    def update(self, range_name, values, **kwargs): self.wb.tabs[self.title] = values + self.rows[len(values):]
+    def append_row(self, row, **kwargs): self.append_rows([row])
+    def append_rows(self, rows, **kwargs): self.wb.tabs[self.title] = self.rows + [list(r) for r in rows]
+
+
+class FakeWorkbook:
+    """Classeur en mémoire : lectures par values_batch_get (snapshot), écritures par onglet."""
+    def __init__(self, tabs):
+        self.tabs = tabs
+        self.sheet1 = FakeSheet(self, "Markets")
+
+    def values_batch_get(self, ranges):
+        return {"valueRanges": [{"values": self.tabs.get(r.strip("'"), [])} for r in ranges]}
+
+    def worksheet(self, title):
+        if title not in self.tabs: raise gspread.WorksheetNotFound(title)
+        return FakeSheet(self, title)
+
+    def add_worksheet(self, title, rows, cols):
+        self.tabs[title] = []
+        return FakeSheet(self, title)
+
+
+def test_gsheet_config_value_bypasses_the_snapshot():
+    wb = FakeWorkbook({"Markets": [["EU"]], "MIA_App_Config": [["Setting_Key", "Value"], ["max_search_results", "20"], ["google_cse_usage", "day:5"]]})
+    store = GSheetStorage(wb, DEFAULTS, ttl=300)
+    assert store.get_app_config()["google_cse_usage"] == "day:5"
+    wb.tabs["MIA_App_Config"] = [["Setting_Key", "Value"], ["max_search_results", "20"], ["google_cse_usage", "day:9"]]  # Ecrit par un autre processus
+    assert store.get_app_config()["google_cse_usage"] == "day:5"  # Instantané encore valide
+    assert store.get_config_value("google_cse_usage") == "day:9"
+
+
+def test_first_sync_imports_the_existing_sheet_instead_of_wiping_it(tmp_path):
+    wb = FakeWorkbook({
+        "Markets": [["EU"], ["Japan"]],
+        "Watch_domains": [["gov.uk"]],
+        "Watchlists": [["ID", "Name", "Topic", "Markets", "Timeframe"], ["w1", "Batteries", "lithium", "EU", "📅 Last 12 Months"]],
+        "MIA_App_Config": [["Setting_Key", "Value"], ["max_search_results", "35"]],
+        "Watchlist_Runs": [["ID", "Updated", "State"], ["w1", "2026-10-01 10:00:00", '{"query": ', '"q"}']],
+        "Logs": [LOG_HEADER, ["2026-10-01", "09:00:00", "old", "MIA", "", ""]],
+    })
+    store = SQLiteStorage(str(tmp_path / "valhallai.db"), DEFAULTS)
+    assert store.get_markets() == ["EU", "USA"]  # Base neuve : amorçage par défaut avant la synchro
+    store.add_domain("europa.eu/new")
+    with pytest.raises(RuntimeError): mirror_to_sheet(store, wb)
+
+    StorageSyncJob(store, wb, interval=3600).run_now()
+    assert wb.tabs["Markets"] == [["EU"], ["Japan"]]
+    assert wb.tabs["Watch_domains"] == [["europa.eu/new"], ["gov.uk"]]  # Ajout local conservé
+    assert wb.tabs["Watchlists"][1] == ["w1", "Batteries", "lithium", "EU", "📅 Last 12 Months"]
+    assert ["max_search_results", "35"] in wb.tabs["MIA_App_Config"]
+    assert wb.tabs["Logs"][1][2] == "old"
+    assert store.get_watchlist_state("w1") == {"query": "q"}
@@ -0,0 +1,50 @@
+import concurrent.futures
+
+import pytest
+
+fitz = pytest.importorskip("fitz")
+
+import utils_text
+from utils_text import density_snippets, read_pdf_document
+
+
+def make_pdf(pages):
+    doc = fitz.open()
+    for i in range(pages): doc.new_page().insert_text((72, 72), f"page {i} lithium battery")
+    return doc.tobytes()
+
+
+def test_density_snippets_pick_the_densest_window_in_document_order():
+    text = " ".join(["filler"] * 2000 + ["lithium battery"] * 50 + ["filler"] * 2000)
+    snippets = density_snippets(text, ["lithium", "battery"], window_size=200, stride=50, top_k=1, snippet_chars=2000)
+    assert len(snippets) == 1 and "lithium battery" in snippets[0]
+    assert density_snippets(text, ["of", "a"]) == []
+
+
+def test_pool_batches_receive_a_path_not_the_pdf_bytes(monkeypatch):
+    pdf = make_pdf(10)
+    opens, args = [], []
+    count = utils_text.pdf_page_count
+    monkeypatch.setattr(utils_text, "pdf_page_count", lambda b: opens.append(1) or count(b))
+
+    def submit(fn, *a):
+        args.append(a[0])
+        fut = concurrent.futures.Future()
+        fut.set_result(fn(*a))
+        return fut
+
+    text, meta = read_pdf_document(pdf, None, submit=submit, batch_pages=3, parallel=2)
+    assert meta == {"pages_read": 10, "page_count": 10, "char_budget": None, "complete": True}
+    assert "page 9" in text and len(opens) == 1
+    assert args and all(isinstance(a, str) for a in args)
+
+
+def test_char_budget_stops_early():
+    text, meta = read_pdf_document(make_pdf(20), 60)
+    assert len(text) <= 60 and not meta["complete"] and meta["pages_read"] < 20
+
+
+def test_max_pages_marks_the_text_incomplete():
+    text, meta = read_pdf_document(make_pdf(10), None, max_pages=4)
+    assert meta["pages_read"] == 4 and not meta["complete"] and "page 4" not in text
+    assert read_pdf_document(make_pdf(4), None, max_pages=4)[1]["complete"]
@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+from utils_watch import run_watch, due_watchlists, mia_query, merge_watchlist_report, build_run_state
+
+REPORT = json.dumps({"executive_summary": "Two updates.", "items": [{"title": "New rule", "url": "https://a.eu/new", "impact": "high"}]})
+
+
+def searcher(sources, raw_count=2, digest="### DIGEST", error=None, calls=None):
+    def search(query, date_restrict_code, known, on_source):
+        if calls is not None: calls.append((query, date_restrict_code, known))
+        for r in sources: on_source(dict(r, unchanged=(known or {}).get(r["source"]) == r["content_hash"]))
+        return digest, error, raw_count
+    return search
+
+
+def synthesizer(answer=REPORT, calls=None):
+    def synthesize(raw_data):
+        if calls is not None: calls.append(raw_data)
+        return answer, 123
+    return synthesize
+
+
+SOURCES = [{"source": "https://a.eu/new", "content_hash": "h1"}, {"source": "https://a.eu/old", "content_hash": "h2"}]
+
+
+def test_first_run_synthesises_and_persists_the_seen_sources():
+    saved = []
+    res = run_watch("batteries", ["EU"], "📅 Last 12 Months", None, searcher(SOURCES), synthesizer(), save=lambda s: saved.append(s) or s)
+    assert res["status"] == "updated" and res["changed"] == 2 and res["state"] is saved[0]
+    assert res["report"]["items"][0]["impact"] == "High" and res["report"]["prompt_tokens"] == 123
+    assert saved[0]["query"] == mia_query("batteries", ["EU"]) and saved[0]["date_restrict"] == "m12"
+    assert saved[0]["seen"] == {"https://a.eu/new": "h1", "https://a.eu/old": "h2"}
+
+
+def test_delta_run_without_changes_reuses_the_report_without_llm():
+    state = run_watch("batteries", ["EU"], "📅 Last 12 Months", None, searcher(SOURCES), synthesizer(), save=lambda s: s)["state"]
+    llm_calls, search_calls = [], []
+    res = run_watch("batteries", ["EU"], "📅 Last 12 Months", state, searcher(SOURCES, calls=search_calls),
+                    synthesizer(calls=llm_calls), save=lambda s: s)
+    assert res["status"] == "unchanged" and llm_calls == [] and search_calls[0][2] == state["seen"]
+    assert res["report"]["executive_summary"] == "Two updates." and "No new or changed" in res["report"]["delta_note"]
+    assert "delta_note" not in res["state"]["report"]
+
+
+def test_delta_run_merges_new_items_ahead_of_the_previous_report():
+    state = run_watch("batteries", ["EU"], "📅 Last 12 Months", None, searcher(SOURCES[1:]), synthesizer(
+        json.dumps({"executive_summary": "Old.", "items": [{"title": "Old rule", "url": "https://a.eu/old"}]})), save=lambda s: s)["state"]
+    res = run_watch("batteries", ["EU"], "📅 Last 12 Months", state, searcher(SOURCES), synthesizer(), save=lambda s: s)
+    assert res["status"] == "updated" and res["changed"] == 1
+    assert [(i["title"], i["is_new"]) for i in res["report"]["items"]] == [("New rule", True), ("Old rule", False)]
+
+
+def test_search_failures_empty_results_and_offline_mode():
+    assert run_watch("t", ["EU"], "x", None, searcher([], digest=None, error="Google Error (400)"), synthesizer()) \
+        == {"status": "failed", "stage": "search", "report": None, "error": "Google Error (400)", "raw_count": 2, "changed": 0, "state": None}
+    assert run_watch("t", ["EU"], "x", None, searcher([], raw_count=0), synthesizer())["status"] == "empty"
+    assert run_watch("t", ["EU"], "x", None, searcher([], raw_count=0), synthesizer(), allow_empty=True)["status"] == "updated"
+    offline = run_watch("t", ["EU"], "x", None, searcher([], digest="DISABLED", raw_count=0), synthesizer(), save=lambda s: 1 / 0)
+    assert offline["status"] == "offline" and offline["report"]["source_count"] == 0 and offline["state"] is None
+    assert run_watch("t", ["EU"], "x", None, searcher([], digest="DISABLED"), synthesizer(), offline=False)["status"] == "failed"
+    assert run_watch("t", ["EU"], "x", None, searcher(SOURCES), synthesizer("not json"))["stage"] == "synthesis"
+
+
+def test_due_watchlists_are_the_stale_ones_oldest_first():
+    now = datetime(2026, 10, 16, 12, 0)
+    entries = [({"id": "fresh"}, {"updated": "2026-10-16 11:30"}), ({"id": "old"}, {"updated": "2026-10-16 02:00"}),
+               ({"id": "never"}, None), ({"id": "broken"}, {"updated": "yesterday"}), ({"id": "stale"}, {"updated": "2026-10-16 05:00"})]
+    assert [wl["id"] for wl, _ in due_watchlists(entries, 6 * 3600, now=now)] == ["never", "broken", "old", "stale"]
+
+
+def test_merged_report_puts_fresh_items_first_and_drops_replaced_ones():
+    previous = {"executive_summary": "Old.", "items": [{"title": "A", "url": "u1"}, {"title": "B", "url": "u2"}, {"title": "C"}]}
+    fresh = {"executive_summary": "New.", "source_count": 3, "items": [{"title": "A v2", "url": "u1"}, {"title": "D", "url": "u4"}]}
+    merged = merge_watchlist_report(previous, fresh, 2, "2026-10-15 08:00", max_items=3)
+    assert [(i["title"], i["is_new"]) for i in merged["items"]] == [("A v2", True), ("D", True), ("B", False)]
+    assert merged["executive_summary"] == "New since 2026-10-15 08:00: New. | Previously: Old."
+    assert merged["source_count"] == 3 and merged["delta_note"].startswith("🔁 Delta run: 2")
+
+
+def test_run_state_keeps_the_most_recent_fingerprints_by_canonical_url():
+    known = {"https://a.eu/1": "x", "https://a.eu/2": "y"}
+    collected = [{"source": "HTTPS://A.eu/1?utm_source=feed", "content_hash": "x2"}, {"source": "https://a.eu/3", "content_hash": "z"},
+                 {"source": "https://a.eu/error"}]
+    state = build_run_state(known, collected, "q", "m12", {"items": [], "delta_note": "note"}, max_seen=2)
+    assert state["seen"] == {"https://a.eu/1": "x2", "https://a.eu/3": "z"}
+    assert state["report"] == {"items": []} and state["query"] == "q" and state["date_restrict"] == "m12"
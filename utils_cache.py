@@ -0,0 +1,309 @@
+"""
+VALHALLAI - Caches disque
+DiskCache : index SQLite (clé -> empreinte, méta, dernier accès) + blobs nommés par
+leur SHA-256 (adressage par contenu, un même contenu n'est stocké qu'une fois).
+Eviction LRU dès que la taille totale dépasse la limite (jusqu'à 90 % de celle-ci).
+Accès disque bloquants : depuis la boucle asyncio, passer par asyncio.to_thread.
+UrlCache : documents, textes extraits et résultats Tavily par URL canonique,
+avec ETag / Last-Modified pour la revalidation par GET conditionnel.
+DocumentTextCache : texte des documents téléversés par SHA-256 du fichier
+(LRU en mémoire devant un DiskCache).
+LlmCache : réponses LLM par empreinte canonique de la requête, avec TTL.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class DiskCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.db"), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY, digest TEXT NOT NULL, size INTEGER NOT NULL,
+                    meta TEXT, created REAL NOT NULL, accessed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed);
+                CREATE INDEX IF NOT EXISTS idx_entries_digest ON entries(digest);
+            """)
+        self._bytes = self.total_bytes()  # Estimation tenue à jour ; recalculée avant toute éviction
+        self.hits = 0
+        self.misses = 0
+
+    def _blob_path(self, digest):
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    def get(self, key):
+        """(données, méta) ou None."""
+        with self._lock:
+            row = self._conn.execute("SELECT digest, meta FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                try:
+                    with open(self._blob_path(row[0]), "rb") as f: data = f.read()
+                except OSError:
+                    with self._conn: self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    row = None
+            if not row:
+                self.misses += 1
+                return None
+            with self._conn: self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return data, json.loads(row[1] or "{}")
+
+    def get_meta(self, key):
+        """Méta seule (sans lire le blob) ou None."""
+        with self._lock:
+            row = self._conn.execute("SELECT meta FROM entries WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0] or "{}") if row else None
+
+    def put(self, key, data, meta=None):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp, "wb") as f: f.write(data)
+                os.replace(tmp, path)
+            old = self._conn.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            if not self._conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone(): self._bytes += len(data)
+            now = time.time()
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, digest, size, meta, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, digest, len(data), json.dumps(meta or {}), now, now)
+                )
+            if old and old[0] != digest: self._drop_blob_if_orphan(old[0])
+            self._evict()
+        return digest
+
+    def update_meta(self, key, meta):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE entries SET meta = ?, accessed = ? WHERE key = ?", (json.dumps(meta), time.time(), key))
+
+    def delete(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT digest FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row: return
+            with self._conn: self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._drop_blob_if_orphan(row[0])
+
+    def total_bytes(self):
+        # Taille réelle sur disque : un blob partagé par plusieurs clés ne compte qu'une fois
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM entries GROUP BY digest)").fetchone()
+        return row[0]
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            size = self.total_bytes()
+        lookups = self.hits + self.misses
+        return {"entries": count, "bytes": size, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0}
+
+    # --- INTERNE (appelé sous verrou) ---
+    def _drop_blob_if_orphan(self, digest):
+        if self._conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)).fetchone(): return
+        try:
+            self._bytes -= os.path.getsize(self._blob_path(digest))
+            os.remove(self._blob_path(digest))
+        except OSError: pass
+
+    def _evict(self):
+        # Le parcours complet de l'index n'a lieu qu'au dépassement (estimation), puis on descend
+        # à 90 % de la limite : les écritures suivantes ne repassent pas aussitôt par ici
+        if self._bytes <= self.max_bytes: return
+        total = self.total_bytes()
+        while total > self.max_bytes * 0.9:
+            row = self._conn.execute("SELECT key, digest, size FROM entries ORDER BY accessed LIMIT 1").fetchone()
+            if not row: break
+            with self._conn: self._conn.execute("DELETE FROM entries WHERE key = ?", (row[0],))
+            if not self._conn.execute("SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (row[1],)).fetchone():
+                try: os.remove(self._blob_path(row[1]))
+                except OSError: pass
+                total -= row[2]
+        self._bytes = total
+
+
+# =============================================================================
+# CACHE D'URL (PDF, TEXTE EXTRAIT, TAVILY)
+# =============================================================================
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonical_url(url):
+    """Schéma/hôte en minuscules, port par défaut et fragment retirés, paramètres triés sans utm_*."""
+    p = urlsplit(url.strip())
+    scheme = p.scheme.lower()
+    netloc = (p.hostname or "").lower()
+    if p.port and p.port != DEFAULT_PORTS.get(scheme): netloc += f":{p.port}"
+    params = sorted((k, v) for k, v in parse_qsl(p.query, keep_blank_values=True) if not k.lower().startswith("utm_"))
+    return urlunsplit((scheme, netloc, p.path or "/", urlencode(params), ""))
+
+
+class UrlCache:
+    def __init__(self, store, fresh_seconds=3600, tavily_ttl=86400):
+        self.store = store
+        self.fresh_seconds = fresh_seconds  # En dessous, le document est servi sans revalidation
+        self.tavily_ttl = tavily_ttl
+        self.revalidated = 0
+
+    # --- DOCUMENTS BRUTS ---
+    def get_document(self, url):
+        return self.store.get("doc:" + canonical_url(url))
+
+    def get_document_meta(self, url):
+        # Fraîcheur et en-têtes de revalidation sans charger le document (jusqu'à PDF_MAX_BYTES)
+        return self.store.get_meta("doc:" + canonical_url(url))
+
+    def is_fresh(self, meta):
+        return time.time() - meta.get("fetched_at", 0) < self.fresh_seconds
+
+    def conditional_headers(self, meta):
+        headers = {}
+        if meta.get("etag"): headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"): headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def put_document(self, url, body, headers):
+        meta = {"etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+                "content_type": headers.get("Content-Type"), "fetched_at": time.time()}
+        self.store.put("doc:" + canonical_url(url), body, meta)
+
+    def mark_revalidated(self, url, meta):
+        """Réponse 304 : le contenu en cache reste valide."""
+        self.store.update_meta("doc:" + canonical_url(url), {**meta, "fetched_at": time.time()})
+        self.revalidated += 1
+
+    # --- TEXTE EXTRAIT (clé = SHA-256 du document) ---
+    def get_text(self, digest):
+        hit = self.store.get("text:" + digest)
+        return hit[0].decode("utf-8") if hit else None
+
+    def put_text(self, digest, text):
+        self.store.put("text:" + digest, text.encode("utf-8"))
+
+    # --- RÉSULTATS TAVILY ---
+    def get_tavily(self, url):
+        hit = self.store.get("tavily:" + canonical_url(url))
+        if not hit or time.time() - hit[1].get("fetched_at", 0) > self.tavily_ttl: return None
+        return json.loads(hit[0])
+
+    def put_tavily(self, url, result):
+        self.store.put("tavily:" + canonical_url(url), json.dumps(result).encode("utf-8"), {"fetched_at": time.time()})
+
+    def stats(self):
+        return {**self.store.stats(), "revalidated": self.revalidated}
+
+
+# =============================================================================
+# CACHE DES DOCUMENTS TÉLÉVERSÉS (OLIVIA / EVA)
+# =============================================================================
+class DocumentTextCache:
+    """Texte extrait + méta (pages, budget, complet) par empreinte du fichier.
+    Une entrée sert toute demande de budget inférieur ou égal au sien (ou toute demande si complète)."""
+
+    def __init__(self, store=None, max_items=32):
+        self.store = store  # Niveau disque optionnel (DiskCache)
+        self.max_items = max_items
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _covers(meta, char_budget):
+        if meta.get("complete") or not meta.get("char_budget"): return True  # Lu sans budget : seul max_pages a coupé
+        return bool(char_budget) and (meta.get("char_budget") or 0) >= char_budget
+
+    def _remember(self, digest, text, meta):
+        with self._lock:
+            self._mem[digest] = (text, meta)
+            self._mem.move_to_end(digest)
+            while len(self._mem) > self.max_items: self._mem.popitem(last=False)
+
+    def get(self, digest, char_budget=None):
+        """(texte, méta) ou None ; le texte est ramené au budget demandé."""
+        with self._lock:
+            entry = self._mem.get(digest)
+            if entry: self._mem.move_to_end(digest)
+        if entry is None and self.store is not None:
+            hit = self.store.get("upload:" + digest)
+            if hit:
+                entry = (hit[0].decode("utf-8"), hit[1])
+                self._remember(digest, *entry)
+        if entry is None or not self._covers(entry[1], char_budget):
+            self.misses += 1
+            return None
+        self.hits += 1
+        text, meta = entry
+        return (text[:char_budget] if char_budget else text), meta
+
+    def put(self, digest, text, meta):
+        # Une entrée plus complète déjà connue n'est pas remplacée par une plus courte
+        with self._lock: current = self._mem.get(digest)
+        if current and self._covers(current[1], meta.get("char_budget")) and len(current[0]) >= len(text): return
+        self._remember(digest, text, meta)
+        if self.store is not None: self.store.put("upload:" + digest, text.encode("utf-8"), meta)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self._mem), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0}
+
+
+# =============================================================================
+# CACHE DES RÉPONSES LLM
+# =============================================================================
+def _canonical_payload(value):
+    # Les images base64 (data URL) sont remplacées par leur empreinte : la clé reste petite
+    if isinstance(value, dict): return {k: _canonical_payload(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)): return [_canonical_payload(v) for v in value]
+    if isinstance(value, str) and value.startswith("data:") and ";base64," in value:
+        return "sha256:" + hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return value
+
+def llm_cache_key(model, temperature, json_mode, messages):
+    payload = [model, float(temperature), bool(json_mode), _canonical_payload(messages)]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+
+class LlmCache:
+    def __init__(self, store, ttl=7 * 86400):
+        self.store = store
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key):
+        meta = self.store.get_meta("llm:" + key)  # Expiration vérifiée avant de lire la réponse
+        if meta is not None and self.ttl and time.time() - meta.get("created", 0) > self.ttl:
+            self.store.delete("llm:" + key)
+            self.expired += 1
+            meta = None
+        hit = self.store.get("llm:" + key) if meta is not None else None
+        if not hit:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return hit[0].decode("utf-8")
+
+    def put(self, key, content, model=None):
+        self.store.put("llm:" + key, content.encode("utf-8"), {"created": time.time(), "model": model})
+
+    def stats(self):
+        store = self.store.stats()
+        lookups = self.hits + self.misses
+        return {"entries": store["entries"], "bytes": store["bytes"], "hits": self.hits, "misses": self.misses,
+                "expired": self.expired, "hit_ratio": (self.hits / lookups) if lookups else 0.0}
@@ -0,0 +1,206 @@
+"""
+VALHALLAI - Accès HTTP mutualisé pour le pipeline MIA
+Une seule session aiohttp (keep-alive, limite par hôte, cache DNS) partagée par
+les étapes Google et fetch, avec un sémaphore global de concurrence.
+Ordonnanceur Google CSE : token bucket, backoff exponentiel avec jitter,
+quota journalier persistant et résultats partiels en mode dégradé.
+"""
+import time
+import asyncio
+import threading
+from datetime import datetime
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from utils_runtime import backoff_delay
+
+
+class HttpPool:
+    def __init__(self, limit=100, limit_per_host=8, dns_ttl=300, keepalive=30, max_concurrency=20, timeout=15):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    @property
+    def session(self):
+        # Créée à la première utilisation, dans la boucle qui exécute le pipeline
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit, limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_ttl, keepalive_timeout=self.keepalive
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    @asynccontextmanager
+    async def request(self, method, url, **kwargs):
+        """La réponse doit être lue dans le bloc : le créneau de concurrence est tenu jusqu'à sa sortie."""
+        async with self._semaphore:
+            async with self.session.request(method, url, **kwargs) as resp:
+                yield resp
+
+    def get(self, url, **kwargs): return self.request("GET", url, **kwargs)
+    def post(self, url, **kwargs): return self.request("POST", url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed: await self._session.close()
+        self._session = None
+
+    async def __aenter__(self): return self
+    async def __aexit__(self, *exc): await self.close()
+
+
+class TavilyAsync:
+    """Client Tavily natif aiohttp : réutilise le pool, plafonne la concurrence, timeout par appel."""
+    SEARCH_URL = "https://api.tavily.com/search"
+
+    def __init__(self, pool, api_key, max_concurrency=8, timeout=20):
+        self.pool = pool
+        self.api_key = api_key
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def search(self, query, search_depth="basic", max_results=1):
+        payload = {"query": query, "search_depth": search_depth, "max_results": max_results}
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        async with self._semaphore:
+            async with self.pool.post(self.SEARCH_URL, json=payload, headers=headers, timeout=self.timeout) as resp:
+                if resp.status != 200: return None
+                return await resp.json()
+
+
+# =============================================================================
+# ORDONNANCEUR GOOGLE CUSTOM SEARCH
+# =============================================================================
+class TokenBucket:
+    """Limiteur de débit thread-safe, utilisable depuis n'importe quelle boucle asyncio."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Jetons par seconde
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take(self):
+        """0 si un jeton a été pris, sinon le temps d'attente estimé."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self._take()
+            if wait <= 0: return
+            await asyncio.sleep(wait)
+
+
+def _quota_day():
+    # Google remet le quota CSE à zéro à minuit, heure du Pacifique
+    try:
+        from zoneinfo import ZoneInfo
+        return datetime.now(ZoneInfo("America/Los_Angeles")).strftime("%Y-%m-%d")
+    except Exception:
+        return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+class DailyQuota:
+    """Compteur journalier de requêtes, persisté sous la forme "AAAA-MM-JJ:compte"."""
+
+    def __init__(self, limit, load=None, save=None):
+        self.limit = limit
+        self._load, self._save = load, save
+        self._lock = threading.Lock()
+        self._day, self._used = self._parse(load() if load else None)
+        self._unsaved = 0
+
+    @staticmethod
+    def _parse(value):
+        try:
+            day, count = str(value).split(":")
+            if day == _quota_day(): return day, int(count)
+        except (ValueError, TypeError): pass
+        return _quota_day(), 0
+
+    def _roll(self):
+        today = _quota_day()
+        if today != self._day: self._day, self._used, self._unsaved = today, 0, 0
+
+    def try_consume(self, n=1):
+        with self._lock:
+            self._roll()
+            if self._used + n > self.limit: return False
+            self._used += n
+            self._unsaved += n
+            return True
+
+    @property
+    def used(self):
+        with self._lock:
+            self._roll()
+            return self._used
+
+    def remaining(self): return max(0, self.limit - self.used)
+
+    def persist(self):
+        """Ajoute la consommation locale à la valeur stockée (autres processus inclus)."""
+        if not self._save: return
+        with self._lock:
+            self._roll()
+            if not self._unsaved: return
+            day, stored = self._parse(self._load() if self._load else None)
+            self._used = max(self._used, stored + self._unsaved)
+            self._unsaved = 0
+            value = f"{self._day}:{self._used}"
+        self._save(value)
+
+
+class GoogleCseScheduler:
+    BASE_URL = "https://www.googleapis.com/customsearch/v1"
+
+    def __init__(self, pool, bucket, quota, max_retries=4, backoff_base=1.0, backoff_cap=30.0):
+        self.pool = pool
+        self.bucket = bucket
+        self.quota = quota
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+    async def fetch(self, params):
+        """(items, erreur) pour une page de résultats ; erreur = None si succès."""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if not self.quota.try_consume(): return [], "Google Daily Quota Reached"
+            await self.bucket.acquire()
+            retry_after = None
+            try:
+                async with self.pool.get(self.BASE_URL, params=params) as resp:
+                    if resp.status == 200:
+                        data = await resp.json()
+                        return data.get("items", []), None
+                    if resp.status == 403: return [], "Google Permission Denied (403)"
+                    if resp.status != 429 and resp.status < 500: return [], f"Google Error ({resp.status})"
+                    error = "Google Quota Exceeded (429)" if resp.status == 429 else f"Google Server Error ({resp.status})"
+                    try: retry_after = float(resp.headers.get("Retry-After", ""))
+                    except ValueError: pass
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                error = "Google Network Error"
+            if attempt < self.max_retries: await asyncio.sleep(backoff_delay(attempt, self.backoff_base, self.backoff_cap, retry_after))
+        return [], error
+
+    async def run(self, param_list):
+        """Toutes les pages : (items, erreurs). Les pages réussies sont conservées même si d'autres échouent."""
+        results = await asyncio.gather(*[self.fetch(p) for p in param_list])
+        items = [i for page_items, _ in results for i in page_items]
+        errors = [e for _, e in results if e]
+        return items, errors
@@ -0,0 +1,96 @@
+"""
+VALHALLAI - Accès OpenAI mutualisé
+Un registre par processus : client asynchrone avec pool de connexions
+httpx (keep-alive), timeouts, nouvelles tentatives avec backoff exponentiel + jitter
+qui respectent Retry-After, et plafond d'appels simultanés par modèle.
+"""
+import asyncio
+import threading
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from utils_runtime import backoff_delay
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+def _retry_after(error):
+    """Délai demandé par l'API (retry-after-ms ou Retry-After, en secondes), sinon None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"): return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"): return float(headers["retry-after"])
+    except (TypeError, ValueError): pass
+    return None
+
+
+class LlmClientRegistry:
+    def __init__(self, api_key, timeout=120, connect_timeout=10, max_connections=50, max_keepalive=20,
+                 max_retries=4, backoff_base=1.0, backoff_cap=30.0, model_limits=None, default_limit=8):
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.model_limits = model_limits or {}
+        self.default_limit = default_limit
+        self._lock = threading.Lock()
+        self._async = None
+        self._async_slots = {}
+        self.retries = 0
+
+    # --- CLIENT (créé à la première utilisation, réutilisé ensuite) ---
+    # Les nouvelles tentatives sont gérées ici : celles du SDK sont désactivées
+    @property
+    def async_client(self):
+        # A utiliser depuis la boucle du runtime uniquement (connexions liées à la boucle)
+        with self._lock:
+            if self._async is None:
+                http = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+                self._async = AsyncOpenAI(api_key=self.api_key, http_client=http, max_retries=0, timeout=self.timeout)
+            return self._async
+
+    def _limit(self, model):
+        return self.model_limits.get(model, self.default_limit)
+
+    def _async_slot(self, model):
+        with self._lock:
+            if model not in self._async_slots: self._async_slots[model] = asyncio.Semaphore(self._limit(model))
+            return self._async_slots[model]
+
+    def _backoff(self, attempt, error):
+        return backoff_delay(attempt, self.backoff_base, self.backoff_cap, _retry_after(error))
+
+    # --- APPELS ---
+    async def complete(self, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._async_slot(kwargs.get("model")):
+                    return await self.async_client.chat.completions.create(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries: raise
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, e))
+
+    async def stream(self, **kwargs):
+        """Fragments de la réponse. Nouvelle tentative possible tant que rien n'a été émis."""
+        for attempt in range(self.max_retries + 1):
+            emitted = False
+            try:
+                async with self._async_slot(kwargs.get("model")):
+                    stream = await self.async_client.chat.completions.create(stream=True, **kwargs)
+                    try:
+                        async for chunk in stream:
+                            emitted = True
+                            yield chunk
+                    finally:
+                        try: await stream.close()
+                        except Exception: pass
+                return
+            except RETRYABLE_ERRORS as e:
+                if emitted or attempt >= self.max_retries: raise
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, e))
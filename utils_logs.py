@@ -0,0 +1,102 @@
+"""
+VALHALLAI - Journal d'usage en écriture différée (write-behind)
+Les lignes sont mises en file en mémoire puis envoyées par lots (append_rows)
+par un thread de fond. Si la feuille est indisponible, elles sont écrites dans
+un fichier local puis rejouées au prochain envoi réussi ou au redémarrage.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+
+class UsageLogBuffer:
+    def __init__(self, sink, spill_path, max_queue=1000, batch_size=50, flush_interval=5.0):
+        self.sink = sink  # sink(rows) : envoie un lot, lève une exception en cas d'échec
+        self.spill_path = spill_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="valhallai-usage-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, row):
+        """Non bloquant : ne fait jamais d'appel réseau sur le chemin de la requête."""
+        try: self._queue.put_nowait(list(row))
+        except queue.Full: self._spill([list(row)])
+
+    def close(self, timeout=10):
+        if self._stop.is_set(): return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    # --- THREAD DE FOND ---
+    def _run(self):
+        self._replay_spill()
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch and self._flush(batch): self._replay_spill()
+        # Arrêt : on vide ce qui reste (envoi ou spill)
+        rest = []
+        while True:
+            try: rest.append(self._queue.get_nowait())
+            except queue.Empty: break
+        for i in range(0, len(rest), self.batch_size): self._flush(rest[i:i + self.batch_size])
+
+    def _next_batch(self):
+        try: batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty: return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set(): break
+            try: batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty: break
+        return batch
+
+    def _flush(self, rows):
+        try:
+            self.sink(rows)
+            return True
+        except Exception:
+            self._spill(rows)
+            return False
+
+    # --- SPILL LOCAL ---
+    def _spill(self, rows):
+        with self._spill_lock:
+            try:
+                os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+                with open(self.spill_path, "a", encoding="utf-8") as f:
+                    for r in rows: f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            except OSError: pass
+
+    def _replay_spill(self):
+        replay_path = self.spill_path + ".replay"
+        with self._spill_lock:
+            # Un .replay restant signifie un arrêt brutal pendant un rejeu précédent
+            if not os.path.exists(self.spill_path) and not os.path.exists(replay_path): return
+            rows = []
+            try:
+                if os.path.exists(replay_path):
+                    with open(replay_path, encoding="utf-8") as f:
+                        rows += [json.loads(line) for line in f if line.strip()]
+                if os.path.exists(self.spill_path):
+                    with open(self.spill_path, encoding="utf-8") as f:
+                        rows += [json.loads(line) for line in f if line.strip()]
+                with open(replay_path, "w", encoding="utf-8") as f:
+                    for r in rows: f.write(json.dumps(r, ensure_ascii=False) + "\n")
+                if os.path.exists(self.spill_path): os.remove(self.spill_path)
+            except (OSError, ValueError): return
+        for i in range(0, len(rows), self.batch_size):
+            if not self._flush(rows[i:i + self.batch_size]):
+                # Feuille toujours indisponible : le reste retourne dans le spill
+                self._spill(rows[i + self.batch_size:])
+                break
+        try: os.remove(replay_path)
+        except OSError: pass
@@ -0,0 +1,90 @@
+"""
+VALHALLAI - Assemblage des prompts sous budget de tokens
+Comptage local (tiktoken si disponible, sinon ~4 caractères par token) et
+répartition d'un budget par modèle entre segments : instructions obligatoires,
+puis contexte de recherche, documents... par priorité décroissante. Les segments
+les moins utiles sont raccourcis puis retirés en premier.
+"""
+import threading
+
+try: import tiktoken
+except ImportError: tiktoken = None
+
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+
+def _encoding(model):
+    if tiktoken is None: return None
+    with _encodings_lock:
+        if model not in _encodings:
+            try: _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError: _encodings[model] = tiktoken.get_encoding("o200k_base")
+            except Exception: _encodings[model] = None  # Fichier BPE indisponible (hors ligne) : estimation
+        return _encodings[model]
+
+
+def count_tokens(text, model="gpt-4o"):
+    enc = _encoding(model)
+    if enc is None: return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, max_tokens, model="gpt-4o"):
+    """Texte ramené à max_tokens (coupé sur un token, ou sur 4 caractères par token sans tiktoken)."""
+    if max_tokens <= 0: return ""
+    enc = _encoding(model)
+    if enc is None: return text[:max_tokens * 4]
+    tokens = enc.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else enc.decode(tokens[:max_tokens])
+
+
+class PromptAssembler:
+    """Segments ajoutés dans l'ordre du prompt final ; le budget est servi par priorité décroissante.
+    required : toujours gardé en entier. Sinon le segment est raccourci s'il reste au moins
+    min_tokens de budget, et retiré dans le cas contraire."""
+
+    def __init__(self, model, budget, separator="\n\n"):
+        self.model = model
+        self.budget = budget
+        self.separator = separator
+        self.segments = []
+        self.fixed_tokens = 0
+
+    def add(self, name, text, priority=0, required=False, min_tokens=200, header=""):
+        if text: self.segments.append({"name": name, "text": text, "priority": priority, "required": required,
+                                       "min_tokens": min_tokens, "header": header})
+        return self
+
+    def add_images(self, count, tokens_per_image=765):
+        # Coût fixe des images (hors texte) : réservé avant la répartition
+        self.fixed_tokens += count * tokens_per_image
+        return self
+
+    def build(self):
+        """(prompt, rapport) ; rapport = total, budget, tokens par segment, segments raccourcis / retirés."""
+        for seg in self.segments: seg["tokens"] = count_tokens(seg["header"] + seg["text"], self.model)
+        remaining = self.budget - self.fixed_tokens - sum(s["tokens"] for s in self.segments if s["required"])
+        kept, truncated, dropped = {}, [], []
+        order = sorted((s for s in self.segments if not s["required"]), key=lambda s: -s["priority"])  # Tri stable
+        for seg in order:
+            if seg["tokens"] <= remaining:
+                kept[id(seg)] = seg["text"]
+                remaining -= seg["tokens"]
+            elif remaining >= seg["min_tokens"]:
+                kept[id(seg)] = truncate_tokens(seg["text"], remaining - count_tokens(seg["header"], self.model), self.model)
+                truncated.append(seg["name"])
+                remaining = 0
+            else: dropped.append(seg["name"])
+        parts = [s["header"] + (s["text"] if s["required"] else kept[id(s)]) for s in self.segments if s["required"] or id(s) in kept]
+        prompt = self.separator.join(parts)
+        report = {"model": self.model, "budget": self.budget, "total": count_tokens(prompt, self.model) + self.fixed_tokens,
+                  "truncated": truncated, "dropped": dropped, "exact": _encoding(self.model) is not None}
+        return prompt, report
+
+
+def format_prompt_report(report):
+    txt = f"🧮 Prompt: {report['total']:,} / {report['budget']:,} tokens ({report['model']}{'' if report['exact'] else ', estimated'})"
+    if report["truncated"]: txt += f" · shortened: {', '.join(report['truncated'])}"
+    if report["dropped"]: txt += f" · dropped: {', '.join(report['dropped'])}"
+    return txt
@@ -0,0 +1,208 @@
+"""
+VALHALLAI - Recherche de passages dans les documents audités (EVA)
+Découpage en chunks chevauchants, index inversé BM25 en mémoire, et sélection
+des passages les plus pertinents par exigence dans un budget de tokens fixe.
+Audit map-reduce : découpage en sections et fusion des constats partiels.
+Classement BM25 et dédoublonnage SimHash des sources MIA avant synthèse.
+"""
+import re
+import math
+import hashlib
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from utils_prompt import count_tokens
+
+TOKEN_RE = re.compile(r"\b\w+\b")
+
+# Mots vides (anglais / français) : présents partout, ils ne discriminent aucun passage
+STOPWORDS = set("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with shall
+must should may not no all any each which who such than then there these those into under within per
+le la les un une des du de et ou en au aux dans par pour sur est sont être avec que qui ne pas ce cette
+""".split())
+
+
+def tokenize(text):
+    return [t for t in (m.group().lower() for m in TOKEN_RE.finditer(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+def chunk_text(text, chunk_words=180, overlap=40):
+    """Chunks de `chunk_words` mots qui se chevauchent de `overlap` mots : [(début, fin, texte)] en caractères."""
+    spans = [m.span() for m in re.finditer(r"\S+", text)]
+    if not spans: return []
+    step = max(1, chunk_words - overlap)
+    chunks = []
+    for i in range(0, len(spans), step):
+        begin, end = spans[i][0], spans[min(i + chunk_words, len(spans)) - 1][1]
+        chunks.append((begin, end, text[begin:end]))
+        if i + chunk_words >= len(spans): break
+    return chunks
+
+
+class BM25Index:
+    """Index inversé (terme -> [(chunk, tf)]) ; seuls les chunks contenant un terme de la requête sont scorés."""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1, self.b = k1, b
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for idx, (_, _, text) in enumerate(chunks):
+            tokens = tokenize(text)
+            self.lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items(): self.postings[term].append((idx, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def idf(self, term):
+        n = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.chunks) - n + 0.5) / (n + 0.5))
+
+    def search(self, query, top_k=3):
+        """[(chunk, score)] par score décroissant."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings: continue
+            idf = self.idf(term)
+            for idx, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[idx] / (self.avg_length or 1))
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda x: (-x[1], x[0]))[:top_k]
+
+
+def parse_requirements(context, max_items=40):
+    """Exigences extraites du contexte (rapport OlivIA en Markdown) : puces, listes numérotées,
+    lignes de tableau, à défaut les phrases. Titres et séparateurs ignorés."""
+    items = []
+    for line in context.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or set(line) <= set("|-: "): continue
+        if line.startswith("|"): line = " ".join(c.strip() for c in line.strip("|").split("|"))
+        line = re.sub(r"^([-*•]|\d+[.)])\s+", "", line).replace("**", "").strip()
+        if len(tokenize(line)) >= 3: items.append(line)
+    if len(items) <= 1: items = [s.strip() for s in re.split(r"(?<=[.!?])\s+", context) if len(tokenize(s)) >= 3]
+    seen, unique = set(), []
+    for item in items:
+        key = item.lower()
+        if key not in seen:
+            seen.add(key)
+            unique.append(item)
+    return unique[:max_items]
+
+
+def select_passages(index, requirements, token_budget=4000, per_requirement=3):
+    """Passages retenus, dans l'ordre du document : tour à tour le meilleur passage de chaque exigence,
+    puis le suivant, jusqu'au budget. Sans exigence exploitable : le début du document."""
+    ranked = [[idx for idx, _ in index.search(r, per_requirement)] for r in requirements]
+    if not any(ranked): ranked = [list(range(len(index.chunks)))]
+    chosen, used = set(), 0
+    for rank in range(max(len(r) for r in ranked)):
+        for hits in ranked:
+            if rank >= len(hits) or hits[rank] in chosen: continue
+            cost = count_tokens(index.chunks[hits[rank]][2])
+            if used + cost > token_budget: continue
+            chosen.add(hits[rank])
+            used += cost
+    return [index.chunks[i] for i in sorted(chosen)]
+
+
+def format_passages(passages, total_chars):
+    """Passages numérotés avec leur position relative dans le document (en %)."""
+    out = []
+    for n, (begin, _, text) in enumerate(passages, 1):
+        where = f"{100 * begin // max(1, total_chars)}%"
+        out.append(f"[Passage {n} · ~{where} into document]\n{text}")
+    return "\n\n".join(out)
+
+
+def split_sections(text, max_chars=16000):
+    """Sections d'au plus `max_chars` caractères, coupées de préférence entre paragraphes puis entre lignes."""
+    sections, current = [], ""
+    for para in re.split(r"(\n\s*\n)", text):
+        while len(para) > max_chars:
+            cut = para.rfind("\n", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            if current.strip(): sections.append(current)
+            current = ""
+            sections.append(para[:cut])
+            para = para[cut:]
+        if len(current) + len(para) > max_chars and current.strip():
+            sections.append(current)
+            current = ""
+        current += para
+    if current.strip(): sections.append(current)
+    return [s.strip() for s in sections if s.strip()]
+
+
+EVA_STATUS_RANK = {"met": 0, "partial": 1, "missing": 2}
+
+
+def merge_eva_findings(partials):
+    """Fusion déterministe des tableaux partiels : meilleur statut par exigence, preuves localisées."""
+    merged = {}
+    for (name, no, _, _), findings in sorted(partials, key=lambda p: (p[0][0], p[0][1])):
+        for f in findings:
+            req = " ".join(str(f.get("requirement")).split())
+            status = str(f.get("status", "Missing")).strip().lower()
+            entry = merged.setdefault(req.lower(), {"requirement": req, "status": "missing", "evidence": [], "missing": []})
+            if EVA_STATUS_RANK.get(status, 2) < EVA_STATUS_RANK[entry["status"]]: entry["status"] = status if status in EVA_STATUS_RANK else "missing"
+            if f.get("evidence") and status != "missing" and len(entry["evidence"]) < 3: entry["evidence"].append(f"{name} §{no}: {f['evidence']}")
+            if f.get("missing") and len(entry["missing"]) < 2: entry["missing"].append(str(f["missing"]))
+    lines = []
+    for e in merged.values():
+        missing = "" if e["status"] == "met" else "; ".join(e["missing"])
+        lines.append(f"{e['requirement']} | {e['status'].title()} | {'; '.join(e['evidence']) or '-'} | {missing or '-'}")
+    return "\n".join(lines)
+
+
+# =============================================================================
+# CLASSEMENT ET DÉDOUBLONNAGE DES SOURCES (MIA)
+# =============================================================================
+def simhash(text, shingle=3):
+    """Empreinte SimHash 64 bits sur les n-grammes de mots : deux textes quasi identiques
+    ont des empreintes à faible distance de Hamming."""
+    tokens = tokenize(text)
+    grams = [" ".join(tokens[i:i + shingle]) for i in range(max(1, len(tokens) - shingle + 1))]
+    if not grams or not grams[0]: return 0
+    hashes = np.array([int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "little") for g in grams], dtype=np.uint64)
+    bits = np.unpackbits(hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(grams)
+    return int(sum(1 << i for i in range(64) if votes[i] > 0))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def _title_key(title):
+    key = " ".join(tokenize(title or ""))
+    return key if len(key) > 20 else None  # Titres trop courts ("Home", "News") : non discriminants
+
+
+def rank_sources(sources, query, url_key=None, top_k=None, max_distance=3, title_distance=12):
+    """Sources triées par pertinence BM25 (titre + contenu) vis-à-vis de la requête, quasi-doublons
+    fusionnés (même URL canonique, SimHash à max_distance bits près, ou même titre avec un SimHash
+    à title_distance bits près) : la plus pertinente est gardée. Un titre générique partagé
+    (Official Journal, Federal Register) ne suffit pas à fusionner deux textes différents.
+    Retourne (sources retenues, nb de doublons retirés)."""
+    if not sources: return [], 0
+    index = BM25Index([(0, 0, f"{s.get('title') or ''} {s.get('content') or ''}") for s in sources])
+    scores = dict(index.search(query, top_k=len(sources)))
+    order = sorted(range(len(sources)), key=lambda i: (-scores.get(i, 0.0), sources[i].get("rank", i)))
+    kept, seen_urls, seen_titles, prints, duplicates = [], set(), defaultdict(list), [], 0
+    for i in order:
+        s = sources[i]
+        url = url_key(s["source"]) if url_key else s["source"]
+        title = _title_key(s.get("title"))
+        fingerprint = simhash(s.get("content") or "")
+        same_title = title and any(hamming(fingerprint, p) <= title_distance for p in seen_titles.get(title, ()))
+        if url in seen_urls or same_title or (fingerprint and any(hamming(fingerprint, p) <= max_distance for p in prints)):
+            duplicates += 1
+            continue
+        seen_urls.add(url)
+        if title: seen_titles[title].append(fingerprint)
+        if fingerprint: prints.append(fingerprint)
+        kept.append({**s, "relevance": round(scores.get(i, 0.0), 3)})
+    return (kept[:top_k] if top_k else kept), duplicates
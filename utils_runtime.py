@@ -0,0 +1,308 @@
+"""
+VALHALLAI - Runtime asynchrone du processus
+Une boucle asyncio unique, sur un thread dédié, pour toutes les E/S asynchrones
+(recherche, fetch, LLM). Les threads Streamlit y soumettent leurs coroutines et
+récupèrent des futures : sessions et pools survivent aux reruns et aux utilisateurs.
+SingleFlight : les requêtes identiques simultanées partagent un seul calcul.
+bounded_fanout : une tâche par élément, concurrence bornée, résultats au fil de l'eau.
+ProcessWorkerPool : pool de processus borné pour le travail CPU (parsing PDF).
+backoff_delay : attente entre deux tentatives, commune aux clients Google et OpenAI.
+"""
+import os
+import json
+import queue
+import random
+import signal
+import asyncio
+import hashlib
+import threading
+import functools
+import multiprocessing
+import concurrent.futures
+from concurrent.futures.process import BrokenProcessPool
+
+
+class AsyncRuntime:
+    def __init__(self, name="valhallai-async"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Planifie la coroutine sur la boucle de fond ; retourne un concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        fut = self.submit(coro)
+        try: return fut.result(timeout)
+        except BaseException:
+            fut.cancel()
+            raise
+
+    def iterate(self, agen):
+        """Consomme un générateur asynchrone depuis un thread synchrone.
+        Il avance sur la boucle de fond, y compris pendant que l'appelant fait son rendu."""
+        items = queue.Queue()
+
+        async def pump():
+            try:
+                async for item in agen: items.put(("item", item))
+                items.put(("done", None))
+            except BaseException as e:
+                items.put(("error", e))
+                raise
+
+        fut = self.submit(pump())
+        try:
+            while True:
+                kind, value = items.get()
+                if kind == "done": return
+                if kind == "error": raise value
+                yield value
+        finally:
+            # Arrêt anticipé : l'annulation remonte dans le générateur (qui annule ses tâches)
+            fut.cancel()
+
+
+class _Abandoned(Exception):
+    """Le meneur a été interrompu (annulation, rerun) sans résultat : les appelants en attente réessaient."""
+
+
+class SingleFlight:
+    """Les appels simultanés de même clé partagent un seul calcul en vol ; tous reçoivent son résultat.
+    Utilisable depuis les threads (do) comme depuis la boucle du runtime (do_async).
+    L'interruption d'un appelant (meneur compris) n'est jamais transmise aux autres."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._tasks = {}
+        self._waiting = {}
+        self.coalesced = 0
+
+    def _join(self, key):
+        with self._lock:
+            fut = self._calls.get(key)
+            if fut is not None:
+                self.coalesced += 1
+                return fut, False
+            fut = self._calls[key] = concurrent.futures.Future()
+            return fut, True
+
+    def _finish(self, key, fut, result=None, error=None):
+        with self._lock:
+            if self._calls.get(key) is fut: del self._calls[key]
+        if error is not None: fut.set_exception(error)
+        else: fut.set_result(result)
+
+    def do(self, key, fn):
+        while True:
+            fut, leader = self._join(key)
+            if not leader:
+                try: return fut.result()
+                except _Abandoned: continue  # Le meneur a été interrompu : un des appelants reprend
+            try: result = fn()
+            except Exception as e:
+                self._finish(key, fut, error=e)
+                raise
+            except BaseException:
+                self._finish(key, fut, error=_Abandoned())
+                raise
+            self._finish(key, fut, result)
+            return result
+
+    async def _lead(self, key, fut, coro_fn):
+        try: result = await coro_fn()
+        except asyncio.CancelledError:
+            self._finish(key, fut, error=_Abandoned())
+            raise
+        except Exception as e: self._finish(key, fut, error=e)
+        else: self._finish(key, fut, result)
+        finally:
+            with self._lock: self._tasks.pop(fut, None)
+
+    async def do_async(self, key, coro_fn):
+        """Le calcul tourne dans sa propre tâche, que chaque appelant attend derrière asyncio.shield.
+        La tâche n'est annulée que lorsque plus aucun appelant ne l'attend (Stop, fin d'itération...)."""
+        while True:
+            fut, leader = self._join(key)
+            if leader:
+                task = asyncio.get_running_loop().create_task(self._lead(key, fut, coro_fn))
+                with self._lock: self._tasks[fut] = task
+            with self._lock: self._waiting[fut] = self._waiting.get(fut, 0) + 1
+            inner = asyncio.wrap_future(fut)
+            try: return await asyncio.shield(inner)
+            except _Abandoned: continue
+            finally:
+                inner.add_done_callback(lambda f: f.cancelled() or f.exception())  # Résultat consommé même sans appelant
+                with self._lock:
+                    self._waiting[fut] -= 1
+                    task = None
+                    if not self._waiting[fut]:
+                        del self._waiting[fut]
+                        task = self._tasks.get(fut)
+                if task and not fut.done(): task.cancel()
+
+    async def stream_async(self, key, agen_fn):
+        """Générateur : le meneur émet les fragments de agen_fn() au fil de l'eau ; les appelants simultanés
+        de même clé (flux ou do_async) attendent la fin et reçoivent le texte complet d'un seul bloc.
+        Flux fermé ou annulé avant la fin : un des appelants en attente reprend."""
+        while True:
+            fut, leader = self._join(key)
+            if not leader:
+                inner = asyncio.wrap_future(fut)
+                inner.add_done_callback(lambda f: f.cancelled() or f.exception())
+                try: text = await asyncio.shield(inner)
+                except _Abandoned: continue
+                if text: yield text
+                return
+            parts = []
+            try:
+                async for part in agen_fn():
+                    parts.append(part)
+                    yield part
+            except Exception as e:
+                self._finish(key, fut, error=e)
+                raise
+            except BaseException:
+                self._finish(key, fut, error=_Abandoned())
+                raise
+            self._finish(key, fut, "".join(parts))
+            return
+
+
+async def bounded_fanout(items, fn, limit):
+    """Emet fn(item) pour chaque item dans l'ordre d'arrivée, au plus `limit` en vol à la fois.
+    A la fermeture du générateur (fin, arrêt, erreur), les tâches restantes sont annulées puis attendues."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(item):
+        async with semaphore: return await fn(item)
+
+    tasks = [asyncio.ensure_future(bounded(i)) for i in items]
+    try:
+        for fut in asyncio.as_completed(tasks): yield await fut
+    finally:
+        for t in tasks: t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def flight_key(*parts):
+    """Clé stable à partir de paramètres déjà normalisés (JSON trié puis SHA-256)."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def backoff_delay(attempt, base, cap, retry_after=None):
+    """Backoff exponentiel "full jitter" ; un Retry-After serveur (plafonné à cap) est respecté."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, min(cap, retry_after or 0))
+
+
+def _init_worker(mem_limit_mb):
+    # Plafond mémoire du processus (un PDF pathologique ne peut pas faire tomber la machine)
+    if mem_limit_mb:
+        try:
+            import resource
+            limit = mem_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError): pass
+    import utils_text  # noqa: F401 - PyMuPDF et NumPy chargés une fois par worker
+
+def _worker_context():
+    # Pas de fork direct d'un processus qui porte déjà des threads (runtime, logs), et pas de
+    # travail lourd avant la tâche : forkserver préchargé avec utils_text. Les workers réimportent
+    # tout de même __main__ (sous "__mp_main__") : app.py ne fait rien dans ce cas
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload(["utils_text"])
+        return ctx
+    return multiprocessing.get_context("spawn")
+
+def _ping():
+    return os.getpid()
+
+
+class TaskTimeout(TimeoutError):
+    """Tâche arrêtée dans son worker après `timeout` secondes d'exécution."""
+
+def _on_alarm(signum, frame):
+    raise TaskTimeout()
+
+def _run_with_deadline(timeout, fn, *args, **kwargs):
+    # Exécuté dans le worker : le délai part du début de la tâche, pas de son entrée en file.
+    # SIGALRM interrompt le code Python (entre deux pages) ; un worker bloqué dans du code C
+    # est terminé par SIGPROF (temps CPU, action par défaut) et le pool est recréé
+    if not timeout or not hasattr(signal, "setitimer"): return fn(*args, **kwargs)
+    previous = signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    signal.setitimer(signal.ITIMER_PROF, timeout * 2)
+    try: return fn(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+class ProcessWorkerPool:
+    """Pool de processus borné ; la boucle asyncio n'attend que le résultat.
+    Le timeout s'applique à l'exécution de chaque tâche, dans son worker (l'attente en file n'est pas comptée)."""
+
+    def __init__(self, max_workers, mem_limit_mb=None, timeout=60):
+        self.max_workers = max_workers
+        self.mem_limit_mb = mem_limit_mb
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=_worker_context(),
+                    initializer=_init_worker, initargs=(self.mem_limit_mb,)
+                )
+            return self._executor
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor: self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def warm_up(self):
+        """Démarre les workers (imports lourds) sans attendre : la première requête n'en paie pas le coût."""
+        executor = self._get()
+        return [executor.submit(_ping) for _ in range(self.max_workers)]
+
+    def submit(self, fn, *args, timeout=None, **kwargs):
+        """Future synchrone (appelants hors boucle) ; un pool cassé est recréé à la tâche suivante."""
+        executor = self._get()
+        try: fut = executor.submit(_run_with_deadline, timeout or self.timeout, fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._reset(executor)
+            raise
+        fut.add_done_callback(lambda f: self._reset(executor) if not f.cancelled() and isinstance(f.exception(), BrokenProcessPool) else None)
+        return fut
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        executor = self._get()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(executor, functools.partial(_run_with_deadline, timeout or self.timeout, fn, *args, **kwargs))
+        except BrokenProcessPool:
+            # Un worker est mort (plafond mémoire atteint...) : pool recréé à la prochaine tâche
+            self._reset(executor)
+            raise
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+def get_runtime():
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None: _runtime = AsyncRuntime()
+        return _runtime
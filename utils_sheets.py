@@ -0,0 +1,59 @@
+"""
+VALHALLAI - Instantané du classeur Google Sheets
+Les petits onglets de configuration sont lus en un seul appel batch_get puis
+servis depuis un cache TTL. Chaque mutation invalide uniquement son onglet.
+"""
+import time
+import threading
+
+
+def _a1_sheet(title):
+    return "'" + title.replace("'", "''") + "'"
+
+
+class WorkbookSnapshot:
+    def __init__(self, wb, titles, ttl=300):
+        self.wb = wb
+        self.titles = list(titles)
+        self.ttl = ttl
+        self._entries = {}  # titre -> (horodatage, lignes ou None si l'onglet n'existe pas)
+        self._lock = threading.Lock()
+
+    def get(self, title):
+        """Lignes de l'onglet (liste de listes), ou None si l'onglet n'existe pas."""
+        with self._lock:
+            if self._is_stale(title):
+                stale = [t for t in self.titles if self._is_stale(t)]
+                if title not in stale: stale.append(title)
+                self._load(stale)
+            return self._entries[title][1]
+
+    def invalidate(self, title=None):
+        with self._lock:
+            if title is None: self._entries.clear()
+            else: self._entries.pop(title, None)
+
+    def _is_stale(self, title):
+        entry = self._entries.get(title)
+        return entry is None or time.monotonic() - entry[0] > self.ttl
+
+    def _load(self, titles):
+        try: values = self._batch_get(titles)
+        except Exception:
+            # Un onglet manquant fait échouer tout le batch : on relit la liste des onglets
+            existing = {ws.title for ws in self.wb.worksheets()}
+            present = [t for t in titles if t in existing]
+            values = self._batch_get(present) if present else {}
+        now = time.monotonic()
+        for t in titles: self._entries[t] = (now, values.get(t))
+
+    def _batch_get(self, titles):
+        res = self.wb.values_batch_get([_a1_sheet(t) for t in titles])
+        return {t: vr.get("values", []) for t, vr in zip(titles, res.get("valueRanges", []))}
+
+
+def first_column(rows):
+    """Equivalent de col_values(1) à partir des lignes d'un instantané."""
+    vals = [r[0] if r else "" for r in rows or []]
+    while vals and not vals[-1]: vals.pop()
+    return vals
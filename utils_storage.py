@@ -0,0 +1,459 @@
+"""
+VALHALLAI - Couche de stockage
+Interface commune (marchés, domaines, watchlists, configuration, logs) avec deux
+implémentations : Google Sheets (historique) et SQLite local indexé.
+Un job de synchronisation recopie le SQLite vers le classeur pour la vue tableur,
+après un import initial du classeur dans le SQLite (aucune saisie du tableur n'est perdue).
+"""
+import os
+import json
+import uuid
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import gspread
+
+from utils_sheets import WorkbookSnapshot, first_column
+
+WATCHLIST_HEADER = ["ID", "Name", "Topic", "Markets", "Timeframe"]
+CONFIG_HEADER = ["Setting_Key", "Value"]
+LOG_HEADER = ["Date", "Time", "Report ID", "Type", "Details", "Metrics"]
+RUN_STATE_HEADER = ["ID", "Updated", "State"]
+STATE_CELL_CHARS = 45000  # Une cellule Google Sheets est limitée à 50 000 caractères
+
+
+class StorageBackend(ABC):
+    """Interface commune. Les méthodes lèvent une exception si le stockage est indisponible."""
+    name = "base"
+
+    def __init__(self, defaults):
+        # defaults = {"markets": [...], "domains": [...], "config": {...}} (valeurs d'amorçage)
+        self.defaults = defaults
+
+    def describe(self): return self.name
+    def invalidate(self): pass
+
+    @abstractmethod
+    def get_markets(self): ...
+    @abstractmethod
+    def add_market(self, name): ...
+    @abstractmethod
+    def remove_market(self, idx): ...
+    @abstractmethod
+    def update_market(self, idx, name): ...
+
+    @abstractmethod
+    def get_domains(self): ...
+    @abstractmethod
+    def add_domain(self, name): ...
+    @abstractmethod
+    def remove_domain(self, idx): ...
+    @abstractmethod
+    def update_domain(self, idx, name): ...
+
+    @abstractmethod
+    def get_watchlists(self): ...
+    @abstractmethod
+    def save_watchlist(self, name, topic, markets, timeframe): ...
+    @abstractmethod
+    def delete_watchlist(self, watchlist_id): ...
+
+    # Etat du dernier run d'une watchlist (dict JSON : URLs vues, empreintes, derniers items)
+    @abstractmethod
+    def get_watchlist_state(self, watchlist_id): ...
+    @abstractmethod
+    def save_watchlist_state(self, watchlist_id, state): ...
+
+    @abstractmethod
+    def get_app_config(self): ...
+    @abstractmethod
+    def update_app_config(self, key, value): ...
+    # Valeur relue à la source (sans cache) : compteurs partagés entre processus (quota Google)
+    @abstractmethod
+    def get_config_value(self, key): ...
+
+    @abstractmethod
+    def append_logs(self, rows): ...
+
+
+# =============================================================================
+# GOOGLE SHEETS
+# =============================================================================
+class GSheetStorage(StorageBackend):
+    name = "gsheets"
+
+    def __init__(self, wb, defaults, ttl=300):
+        super().__init__(defaults)
+        self.wb = wb
+        self.markets_title = wb.sheet1.title  # Le premier onglet porte les marchés
+        self.snapshot = WorkbookSnapshot(wb, [self.markets_title, "MIA_App_Config", "Watch_domains", "Watchlists"], ttl=ttl)
+        self._logs_ready = False
+
+    def describe(self): return f"Google Sheets · {self.wb.title}"
+    def invalidate(self): self.snapshot.invalidate()
+
+    def _sheet(self, title):
+        return self.wb.sheet1 if title == self.markets_title else self.wb.worksheet(title)
+
+    # --- LISTES À UNE COLONNE (marchés, domaines) ---
+    def _get_list(self, title, defaults):
+        rows = self.snapshot.get(title)
+        if rows is None:
+            self.wb.add_worksheet(title, 100, 1).append_rows([[v] for v in defaults])
+            self.snapshot.invalidate(title)
+            return list(defaults)
+        vals = first_column(rows)
+        if not vals:
+            self._sheet(title).append_rows([[v] for v in defaults])
+            self.snapshot.invalidate(title)
+            return list(defaults)
+        return vals
+
+    def _add_to_list(self, title, name):
+        sh = self._sheet(title)
+        if name in sh.col_values(1): return False
+        sh.append_row([name]); self.snapshot.invalidate(title)
+        return True
+
+    def _remove_from_list(self, title, idx):
+        self._sheet(title).delete_rows(idx + 1); self.snapshot.invalidate(title)
+
+    def _update_in_list(self, title, idx, name):
+        self._sheet(title).update_cell(idx + 1, 1, name); self.snapshot.invalidate(title)
+
+    def get_markets(self): return self._get_list(self.markets_title, self.defaults["markets"])
+    def add_market(self, name): return self._add_to_list(self.markets_title, name)
+    def remove_market(self, idx): self._remove_from_list(self.markets_title, idx)
+    def update_market(self, idx, name): self._update_in_list(self.markets_title, idx, name)
+
+    def get_domains(self): return self._get_list("Watch_domains", self.defaults["domains"])
+    def add_domain(self, name): return self._add_to_list("Watch_domains", name)
+    def remove_domain(self, idx): self._remove_from_list("Watch_domains", idx)
+    def update_domain(self, idx, name): self._update_in_list("Watch_domains", idx, name)
+
+    # --- WATCHLISTS ---
+    def get_watchlists(self):
+        rows = self.snapshot.get("Watchlists")
+        if rows is None:
+            self.wb.add_worksheet("Watchlists", 100, 5).append_row(WATCHLIST_HEADER)
+            self.snapshot.invalidate("Watchlists")
+            return []
+        return [{"id": r[0], "name": r[1], "topic": r[2], "markets": r[3], "timeframe": r[4]} for r in rows[1:] if len(r) >= 5]
+
+    def save_watchlist(self, name, topic, markets, timeframe):
+        wl_id = str(uuid.uuid4())[:8]
+        self.wb.worksheet("Watchlists").append_row([wl_id, name, topic, markets, timeframe])
+        self.snapshot.invalidate("Watchlists")
+        return wl_id
+
+    def delete_watchlist(self, watchlist_id):
+        sheet = self.wb.worksheet("Watchlists")
+        cell = sheet.find(watchlist_id)
+        if not cell: return False
+        sheet.delete_rows(cell.row); self.snapshot.invalidate("Watchlists")
+        try:
+            runs = self.wb.worksheet("Watchlist_Runs")
+            run_cell = runs.find(watchlist_id, in_column=1)
+            if run_cell: runs.delete_rows(run_cell.row)
+        except gspread.WorksheetNotFound: pass
+        return True
+
+    # --- ÉTAT DES RUNS (hors snapshot : lu à la demande, une ligne par watchlist) ---
+    def _runs_sheet(self):
+        try: return self.wb.worksheet("Watchlist_Runs")
+        except gspread.WorksheetNotFound:
+            sheet = self.wb.add_worksheet("Watchlist_Runs", 100, 12)
+            sheet.append_row(RUN_STATE_HEADER)
+            return sheet
+
+    def get_watchlist_state(self, watchlist_id):
+        sheet = self._runs_sheet()
+        cell = sheet.find(watchlist_id, in_column=1)
+        if not cell: return None
+        row = sheet.row_values(cell.row)
+        try: return json.loads("".join(row[2:]))
+        except ValueError: return None
+
+    def save_watchlist_state(self, watchlist_id, state):
+        # JSON découpé sur plusieurs cellules (colonnes C, D...)
+        data = json.dumps(state, ensure_ascii=False)
+        chunks = [data[i:i + STATE_CELL_CHARS] for i in range(0, len(data), STATE_CELL_CHARS)] or [""]
+        row = [watchlist_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")] + chunks
+        sheet = self._runs_sheet()
+        if len(row) > sheet.col_count: sheet.resize(cols=len(row))
+        cell = sheet.find(watchlist_id, in_column=1)
+        if not cell:
+            sheet.append_row(row, value_input_option="RAW")
+            return
+        old_width = len(sheet.row_values(cell.row))
+        row += [""] * max(0, old_width - len(row))  # Efface les anciens morceaux en trop
+        sheet.update(range_name=f"A{cell.row}", values=[row], value_input_option="RAW")
+
+    # --- CONFIGURATION ---
+    def get_app_config(self):
+        defaults = self.defaults["config"]
+        config_dict = dict(defaults)
+        rows = self.snapshot.get("MIA_App_Config")
+        if rows is None:
+            self.wb.add_worksheet("MIA_App_Config", 20, 2).append_rows([CONFIG_HEADER] + [[k, v] for k, v in defaults.items()])
+            self.snapshot.invalidate("MIA_App_Config")
+            return config_dict
+        existing_keys = set()
+        for row in rows[1:]:
+            if len(row) >= 2:
+                k, v = str(row[0]).strip(), str(row[1]).strip()
+                config_dict[k] = v
+                existing_keys.add(k)
+        missing = [k for k in defaults if k not in existing_keys]
+        if missing:
+            self.wb.worksheet("MIA_App_Config").append_rows([[k, defaults[k]] for k in missing])
+            self.snapshot.invalidate("MIA_App_Config")
+        return config_dict
+
+    def update_app_config(self, key, value):
+        sheet = self.wb.worksheet("MIA_App_Config")
+        cell = sheet.find(key)
+        if cell: sheet.update_cell(cell.row, 2, str(value))
+        else: sheet.append_row([key, str(value)])
+        self.snapshot.invalidate("MIA_App_Config")
+
+    def get_config_value(self, key):
+        self.snapshot.invalidate("MIA_App_Config")
+        return self.get_app_config().get(key)
+
+    # --- LOGS ---
+    def append_logs(self, rows):
+        try: log_sheet = self.wb.worksheet("Logs")
+        except gspread.WorksheetNotFound:
+            log_sheet = self.wb.add_worksheet(title="Logs", rows=1000, cols=6)
+            self._logs_ready = False
+        if not self._logs_ready:
+            if not log_sheet.cell(1, 1).value: log_sheet.update(range_name="A1:F1", values=[LOG_HEADER])
+            self._logs_ready = True
+        log_sheet.append_rows(rows, value_input_option="RAW")
+
+
+# =============================================================================
+# SQLITE LOCAL
+# =============================================================================
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS markets (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS watchlists (
+    id TEXT PRIMARY KEY, name TEXT NOT NULL, topic TEXT, markets TEXT, timeframe TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_watchlists_name ON watchlists(name);
+CREATE TABLE IF NOT EXISTS watchlist_runs (id TEXT PRIMARY KEY, updated TEXT, state TEXT);
+CREATE TABLE IF NOT EXISTS app_config (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, time TEXT, report_id TEXT, type TEXT,
+    details TEXT, metrics TEXT, synced INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_logs_synced ON logs(synced);
+CREATE INDEX IF NOT EXISTS idx_logs_date ON logs(date);
+CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class SQLiteStorage(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path, defaults):
+        super().__init__(defaults)
+        self.path = path
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SQLITE_SCHEMA)
+
+    def describe(self): return f"SQLite · {self.path}"
+
+    def _query(self, sql, params=()):
+        with self._lock: return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=()):
+        with self._lock, self._conn: return self._conn.execute(sql, params).rowcount
+
+    # --- LISTES À UNE COLONNE (marchés, domaines) ---
+    def _get_list(self, table, defaults):
+        with self._lock, self._conn:
+            vals = [r[0] for r in self._conn.execute(f"SELECT name FROM {table} ORDER BY id")]
+            if not vals:
+                self._conn.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", [(v,) for v in defaults])
+                vals = list(defaults)
+        return vals
+
+    def _add_to_list(self, table, name):
+        return self._write(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,)) > 0
+
+    def _remove_from_list(self, table, idx):
+        self._write(f"DELETE FROM {table} WHERE id = (SELECT id FROM {table} ORDER BY id LIMIT 1 OFFSET ?)", (idx,))
+
+    def _update_in_list(self, table, idx, name):
+        self._write(f"UPDATE {table} SET name = ? WHERE id = (SELECT id FROM {table} ORDER BY id LIMIT 1 OFFSET ?)", (name, idx))
+
+    def get_markets(self): return self._get_list("markets", self.defaults["markets"])
+    def add_market(self, name): return self._add_to_list("markets", name)
+    def remove_market(self, idx): self._remove_from_list("markets", idx)
+    def update_market(self, idx, name): self._update_in_list("markets", idx, name)
+
+    def get_domains(self): return self._get_list("domains", self.defaults["domains"])
+    def add_domain(self, name): return self._add_to_list("domains", name)
+    def remove_domain(self, idx): self._remove_from_list("domains", idx)
+    def update_domain(self, idx, name): self._update_in_list("domains", idx, name)
+
+    # --- WATCHLISTS ---
+    def get_watchlists(self):
+        rows = self._query("SELECT id, name, topic, markets, timeframe FROM watchlists ORDER BY rowid")
+        return [{"id": r[0], "name": r[1], "topic": r[2], "markets": r[3], "timeframe": r[4]} for r in rows]
+
+    def save_watchlist(self, name, topic, markets, timeframe):
+        wl_id = str(uuid.uuid4())[:8]
+        self._write("INSERT INTO watchlists (id, name, topic, markets, timeframe) VALUES (?, ?, ?, ?, ?)", (wl_id, name, topic, markets, timeframe))
+        return wl_id
+
+    def delete_watchlist(self, watchlist_id):
+        self._write("DELETE FROM watchlist_runs WHERE id = ?", (watchlist_id,))
+        return self._write("DELETE FROM watchlists WHERE id = ?", (watchlist_id,)) > 0
+
+    def get_watchlist_state(self, watchlist_id):
+        rows = self._query("SELECT state FROM watchlist_runs WHERE id = ?", (watchlist_id,))
+        try: return json.loads(rows[0][0]) if rows else None
+        except ValueError: return None
+
+    def save_watchlist_state(self, watchlist_id, state):
+        self._write(
+            "INSERT INTO watchlist_runs (id, updated, state) VALUES (?, ?, ?) ON CONFLICT(id) DO UPDATE SET updated = excluded.updated, state = excluded.state",
+            (watchlist_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), json.dumps(state, ensure_ascii=False))
+        )
+
+    # --- CONFIGURATION ---
+    def get_app_config(self):
+        defaults = self.defaults["config"]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO app_config (key, value) VALUES (?, ?)", list(defaults.items()))
+            stored = dict(self._conn.execute("SELECT key, value FROM app_config"))
+        return {**defaults, **stored}
+
+    def get_config_value(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM app_config WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else self.defaults["config"].get(key)
+
+    def update_app_config(self, key, value):
+        self._write("INSERT INTO app_config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    # --- LOGS ---
+    def append_logs(self, rows):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO logs (date, time, report_id, type, details, metrics) VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple((list(r) + [""] * 6)[:6]) for r in rows]
+            )
+
+    def pending_logs(self, limit=500):
+        return self._query("SELECT id, date, time, report_id, type, details, metrics FROM logs WHERE synced = 0 ORDER BY id LIMIT ?", (limit,))
+
+    def mark_logs_synced(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE logs SET synced = 1 WHERE id = ?", [(i,) for i in ids])
+
+    # --- IMPORT DU CLASSEUR ---
+    def sheet_imported(self):
+        return bool(self._query("SELECT 1 FROM sync_state WHERE key = 'sheet_import'"))
+
+    def import_rows(self, markets, domains, watchlists, app_config, runs):
+        """Fusion sans perte : les lignes importées s'ajoutent aux existantes. Une liste encore égale
+        à son amorçage, ou un réglage encore à sa valeur par défaut, prend la valeur importée."""
+        with self._lock, self._conn:
+            for table, values, defaults in (("markets", markets, self.defaults["markets"]), ("domains", domains, self.defaults["domains"])):
+                current = [r[0] for r in self._conn.execute(f"SELECT name FROM {table} ORDER BY id")]
+                if current == list(defaults): self._conn.execute(f"DELETE FROM {table}")
+                self._conn.executemany(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", [(v,) for v in values])
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO watchlists (id, name, topic, markets, timeframe) VALUES (?, ?, ?, ?, ?)",
+                [(w["id"], w["name"], w["topic"], w["markets"], w["timeframe"]) for w in watchlists]
+            )
+            self._conn.executemany(
+                "INSERT INTO app_config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value WHERE app_config.value IS ?",
+                [(k, str(v), self.defaults["config"].get(k)) for k, v in app_config.items()]
+            )
+            self._conn.executemany("INSERT OR IGNORE INTO watchlist_runs (id, updated, state) VALUES (?, ?, ?)", runs)
+            self._conn.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('sheet_import', ?)",
+                               (datetime.now().strftime("%Y-%m-%d %H:%M:%S"),))
+
+
+# =============================================================================
+# SYNCHRONISATION SQLITE -> GOOGLE SHEETS
+# =============================================================================
+def import_from_sheet(store, wb):
+    """Amorce le SQLite avec le contenu du classeur (marchés, domaines, watchlists, réglages, états de run).
+    A faire avant le premier miroir : celui-ci réécrit les onglets à partir du SQLite."""
+    sheet = GSheetStorage(wb, store.defaults)
+    try: run_rows = wb.worksheet("Watchlist_Runs").get_all_values()[1:]
+    except gspread.WorksheetNotFound: run_rows = []
+    runs = [(r[0], r[1], "".join(r[2:])) for r in run_rows if len(r) >= 3 and r[0]]
+    store.import_rows(sheet.get_markets(), sheet.get_domains(), sheet.get_watchlists(), sheet.get_app_config(), runs)
+
+
+def mirror_to_sheet(store, wb):
+    """Recopie le SQLite dans le classeur (vue tableur). Retourne le nombre de logs envoyés."""
+    if not store.sheet_imported():
+        raise RuntimeError("Workbook not imported into SQLite yet: mirroring would overwrite it")
+    def replace(ws, values):
+        ws.clear()
+        if values: ws.update(range_name="A1", values=values)
+
+    def worksheet(title, rows, cols):
+        try: return wb.worksheet(title)
+        except gspread.WorksheetNotFound: return wb.add_worksheet(title, rows, cols)
+
+    replace(wb.sheet1, [[m] for m in store.get_markets()])
+    replace(worksheet("Watch_domains", 100, 1), [[d] for d in store.get_domains()])
+    replace(worksheet("Watchlists", 100, 5), [WATCHLIST_HEADER] + [[w["id"], w["name"], w["topic"], w["markets"], w["timeframe"]] for w in store.get_watchlists()])
+    replace(worksheet("MIA_App_Config", 20, 2), [CONFIG_HEADER] + [[k, v] for k, v in store.get_app_config().items()])
+
+    sent = 0
+    log_sheet = worksheet("Logs", 1000, 6)
+    if not log_sheet.cell(1, 1).value: log_sheet.update(range_name="A1:F1", values=[LOG_HEADER])
+    while True:
+        pending = store.pending_logs()
+        if not pending: break
+        log_sheet.append_rows([list(r[1:]) for r in pending], value_input_option="RAW")
+        store.mark_logs_synced([r[0] for r in pending])
+        sent += len(pending)
+    return sent
+
+
+class StorageSyncJob:
+    """Thread de fond qui exécute mirror_to_sheet à intervalle régulier."""
+
+    def __init__(self, store, wb, interval=900):
+        self.store, self.wb, self.interval = store, wb, interval
+        self.last_sync = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, name="valhallai-storage-sync", daemon=True).start()
+
+    def run_now(self):
+        with self._lock:
+            try:
+                if not self.store.sheet_imported(): import_from_sheet(self.store, self.wb)
+                sent = mirror_to_sheet(self.store, self.wb)
+                self.last_sync, self.last_error = datetime.now(), None
+                return sent
+            except Exception as e:
+                self.last_error = str(e)
+                raise
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try: self.run_now()
+            except Exception: pass
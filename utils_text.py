@@ -0,0 +1,147 @@
+"""
+VALHALLAI - Traitement de texte des sources
+Extraction PDF (PyMuPDF, repli pypdf) page par page et à la demande, et sélection
+des passages les plus denses en mots-clés (sommes préfixes NumPy, temps linéaire
+en nombre de mots). Aucune dépendance à Streamlit : le module est importé par les
+processus de travail.
+"""
+import io
+import os
+import re
+import tempfile
+from collections import Counter, deque
+
+import fitz  # PyMuPDF
+import numpy as np
+
+WORD_RE = re.compile(r"\b\w+\b")
+
+
+def tokenize_with_offsets(text):
+    """Mots en minuscules et position (caractère) de chacun dans le texte d'origine."""
+    words, starts = [], []
+    for m in WORD_RE.finditer(text):
+        words.append(m.group().lower())
+        starts.append(m.start())
+    return words, np.asarray(starts, dtype=np.int64)
+
+
+def density_windows(words, keywords, window_size=500, stride=100):
+    """Score de chaque fenêtre (début tous les `stride` mots) = occurrences des mots-clés.
+    Retourne (débuts, scores) ; une somme préfixe évite de recompter chaque fenêtre."""
+    weights = Counter(k.lower() for k in keywords if len(k) > 2)
+    hits = np.fromiter((weights.get(w, 0) for w in words), dtype=np.int64, count=len(words))
+    prefix = np.concatenate(([0], np.cumsum(hits)))
+    starts = np.arange(0, len(words), stride)
+    ends = np.minimum(starts + window_size, len(words))
+    return starts, prefix[ends] - prefix[starts]
+
+
+def density_snippets(text, keywords, window_size=500, stride=100, top_k=1, snippet_chars=4000):
+    """Les top_k extraits non chevauchants les plus denses, dans l'ordre du document.
+    Liste vide si aucun mot-clé exploitable (plus de 2 caractères)."""
+    if not any(len(k) > 2 for k in keywords): return []
+    words, offsets = tokenize_with_offsets(text)
+    if not words: return []
+    starts, scores = density_windows(words, keywords, window_size, stride)
+    order = np.argsort(-scores, kind="stable")  # A score égal, la première fenêtre gagne
+    chosen = []
+    for idx in order:
+        begin = int(offsets[starts[idx]])
+        end = begin + snippet_chars
+        if any(begin < e and b < end for b, e in chosen): continue
+        chosen.append((begin, end))
+        if len(chosen) >= top_k: break
+    return [text[b:e].strip() for b, e in sorted(chosen)]
+
+
+# =============================================================================
+# EXTRACTION PDF
+# =============================================================================
+def pdf_page_count(pdf_bytes):
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as doc: return doc.page_count
+
+def _open_pdf(source):
+    return fitz.open(source) if isinstance(source, str) else fitz.open(stream=source, filetype="pdf")
+
+def extract_pdf_pages(source, start, stop):
+    """Tâche du pool : texte des pages [start, stop) avec PyMuPDF (source = octets ou chemin)."""
+    with _open_pdf(source) as doc:
+        return [doc[i].get_text() for i in range(start, min(stop, doc.page_count))]
+
+def _pypdf_pages(pdf_bytes, max_pages=None):
+    # Repli pour les fichiers que PyMuPDF refuse d'ouvrir (plus lent, séquentiel)
+    from pypdf import PdfReader
+    for i, page in enumerate(PdfReader(io.BytesIO(pdf_bytes)).pages):
+        if max_pages and i >= max_pages: return
+        yield page.extract_text() or ""
+
+def iter_pdf_pages(pdf_bytes, submit=None, batch_pages=8, parallel=4, max_pages=None, page_count=None):
+    """Texte des pages, dans l'ordre, extrait au fur et à mesure de la consommation.
+    Avec `submit` (fonction -> Future, ex. pool de processus, qui borne la durée de chaque tâche),
+    jusqu'à `parallel` lots de `batch_pages` pages sont extraits d'avance en parallèle ;
+    l'arrêt du générateur annule le reste. Le document est écrit une fois dans un fichier
+    temporaire que les lots rouvrent : ses octets ne sont pas recopiés vers chaque tâche."""
+    if page_count is None:
+        try: page_count = pdf_page_count(pdf_bytes)
+        except Exception:
+            yield from _pypdf_pages(pdf_bytes, max_pages)
+            return
+    count = min(page_count, max_pages) if max_pages else page_count
+    batches = deque((s, min(s + batch_pages, count)) for s in range(0, count, batch_pages))
+    if submit is None or len(batches) <= 1:
+        for start, stop in batches: yield from extract_pdf_pages(pdf_bytes, start, stop)
+        return
+    fd, path = tempfile.mkstemp(suffix=".pdf")
+    pending = deque()
+    try:
+        with os.fdopen(fd, "wb") as f: f.write(pdf_bytes)
+        while batches or pending:
+            while batches and len(pending) < max(1, parallel):
+                pending.append(submit(extract_pdf_pages, path, *batches.popleft()))
+            yield from pending.popleft().result()
+    finally:
+        for fut in pending: fut.cancel()
+        for fut in pending:
+            # Le fichier ne disparaît qu'une fois les lots déjà lancés terminés
+            if not fut.cancelled():
+                try: fut.exception()
+                except Exception: pass
+        try: os.remove(path)
+        except OSError: pass
+
+def read_pdf_document(pdf_bytes, char_budget=None, **kwargs):
+    """(texte, méta), en s'arrêtant dès que `char_budget` caractères sont réunis.
+    méta : pages lues, pages du document (None si inconnu), budget, texte complet ou non."""
+    try: page_count = pdf_page_count(pdf_bytes)
+    except Exception: page_count = None
+    if page_count is None: pages = _pypdf_pages(pdf_bytes, kwargs.get("max_pages"))
+    else: pages = iter_pdf_pages(pdf_bytes, page_count=page_count, **kwargs)
+    parts, size, complete = [], 0, True
+    try:
+        for text in pages:
+            parts.append(text)
+            size += len(text) + 1
+            if char_budget and size >= char_budget:
+                complete = False
+                break
+    finally: pages.close()
+    if page_count is not None: complete = len(parts) >= page_count  # Coupé par max_pages : incomplet
+    elif kwargs.get("max_pages") and len(parts) >= kwargs["max_pages"]: complete = False
+    text = "\n".join(parts)
+    if char_budget and len(text) > char_budget: text, complete = text[:char_budget], False
+    meta = {"pages_read": len(parts), "page_count": page_count, "char_budget": char_budget, "complete": complete}
+    return text, meta
+
+def extract_pdf_text(pdf_bytes, max_pages=None):
+    return "".join(page + "\n" for page in iter_pdf_pages(pdf_bytes, max_pages=max_pages))
+
+
+def process_pdf_source(pdf_bytes, keywords, window_size=500, top_k=1, full_text=None, max_pages=None):
+    """Tâche du pool de processus : extraction (si full_text absent) puis sélection des extraits.
+    Retourne (texte nouvellement extrait ou None, contenu retenu)."""
+    new_text = None
+    if full_text is None: full_text = new_text = extract_pdf_text(pdf_bytes, max_pages)
+    if not full_text.strip(): return new_text, "Error: Scanned PDF."
+    snippets = density_snippets(full_text, keywords, window_size=window_size, top_k=top_k)
+    return new_text, "\n[...]\n".join(snippets) if snippets else full_text[:3000]
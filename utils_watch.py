@@ -0,0 +1,113 @@
+"""
+VALHALLAI - Runs des watchlists MIA (sans interface)
+Déroulé commun à la page MIA et au worker planifié : recherche incrémentale depuis
+l'état du run précédent, synthèse, fusion avec le rapport précédent, état à persister.
+La recherche, la synthèse et la persistance sont fournies par l'appelant (callbacks).
+"""
+import json
+from datetime import datetime
+
+from utils_cache import canonical_url
+
+MIA_TIMEFRAMES = {"⚡ Last 30 Days": "d30", "📅 Last 12 Months": "m12", "🏛️ Last 3 Years": "y3"}
+RUN_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def mia_query(topic, markets):
+    return f"regulations guidelines {topic} {', '.join(markets)}"
+
+
+def delta_known(run_state, query, date_restrict_code):
+    """Sources vues au run précédent, si celui-ci portait sur la même requête et la même période."""
+    if run_state and run_state.get("query") == query and run_state.get("date_restrict") == date_restrict_code:
+        return run_state.get("seen", {})
+    return None
+
+
+def parse_mia_report(json_str, source_count):
+    parsed_data = json.loads(json_str)
+    if "items" not in parsed_data: parsed_data["items"] = []
+    parsed_data["source_count"] = source_count
+    for item in parsed_data["items"]:
+        if "impact" not in item: item["impact"] = "Low"
+        if "category" not in item: item["category"] = "News"
+        item["impact"] = item["impact"].capitalize()
+        item["category"] = item["category"].capitalize()
+    return parsed_data
+
+
+def merge_watchlist_report(previous, fresh, changed_count, last_run, max_items=60):
+    """Rapport incrémental : items issus des sources nouvelles en tête (marqués), puis ceux du run précédent."""
+    fresh_items = [{**i, "is_new": True} for i in fresh.get("items", [])]
+    keys = {i.get("url") or i.get("title") for i in fresh_items}
+    old_items = [{**i, "is_new": False} for i in previous.get("items", []) if (i.get("url") or i.get("title")) not in keys]
+    summary = f"New since {last_run}: {fresh.get('executive_summary', '')}"
+    if previous.get("executive_summary"): summary += f" | Previously: {previous['executive_summary']}"
+    return {**fresh, "items": (fresh_items + old_items)[:max_items], "executive_summary": summary,
+            "source_count": fresh.get("source_count", 0),
+            "delta_note": f"🔁 Delta run: {changed_count} new or changed source(s) since {last_run}."}
+
+
+def build_run_state(known, collected, query, date_restrict_code, report, max_seen=1000):
+    """Etat à persister pour le prochain run incrémental : URLs vues et empreintes, rapport."""
+    seen = dict(known or {})
+    for r in collected:
+        if not r.get("content_hash"): continue
+        url = canonical_url(r["source"])
+        seen.pop(url, None)  # Revue à ce run : passe en fin d'ordre, gardée le plus longtemps
+        seen[url] = r["content_hash"]
+    seen = dict(list(seen.items())[-max_seen:])
+    return {"query": query, "date_restrict": date_restrict_code, "updated": datetime.now().strftime(RUN_TIME_FORMAT),
+            "seen": seen, "report": {k: v for k, v in report.items() if k != "delta_note"}}
+
+
+def run_watch(topic, markets, timeframe_label, run_state, search, synthesize, save=None, delta=True, offline=True,
+              allow_empty=False, max_items=60, max_seen=1000):
+    """Un run MIA complet. Incrémental si delta et si le run précédent porte sur la même requête et période.
+    search(query, code période, known, on_source) -> (digest, erreur ou avertissement, nb de résultats)
+    synthesize(digest) -> (JSON du rapport ou None, tokens du prompt) ; save(état) -> état persisté ou None.
+    offline : recherche désactivée par l'admin -> synthèse sur les connaissances du modèle (sinon échec).
+    allow_empty : synthèse même sans aucun résultat de recherche (sinon statut empty).
+    Retourne un dict : status (updated, unchanged, offline, empty, failed), stage de l'échec (search, synthesis),
+    report, error, raw_count, changed (sources nouvelles ou modifiées) et state (état persisté, None sinon)."""
+    query = mia_query(topic, markets)
+    date_restrict_code = MIA_TIMEFRAMES.get(timeframe_label, "m12")
+    known = delta_known(run_state, query, date_restrict_code) if delta else None
+    collected = []
+    raw_data, error, raw_count = search(query, date_restrict_code, known, collected.append)
+    result = {"status": "failed", "stage": "search", "report": None, "error": error, "raw_count": raw_count, "changed": 0, "state": None}
+
+    is_offline = raw_data == "DISABLED"
+    if is_offline and not offline: return {**result, "error": error or "Google Search Disabled"}
+    if not is_offline and not raw_data: return {**result, "error": error or "No search data"}
+    if not is_offline and raw_count == 0 and not allow_empty: return {**result, "status": "empty"}
+
+    changed = [r for r in collected if not r.get("unchanged")]
+    if known is not None and not changed and not is_offline:
+        # Rien de nouveau : le rapport précédent est repris sans appel LLM
+        report = {**run_state.get("report", {}), "delta_note": f"🔁 No new or changed sources since {run_state['updated']}."}
+        status = "unchanged"
+    else:
+        result["stage"] = "synthesis"
+        json_str, prompt_tokens = synthesize(raw_data)
+        if not json_str: return {**result, "error": "LLM unavailable"}
+        try: report = parse_mia_report(json_str, 0 if is_offline else raw_count)
+        except Exception as e: return {**result, "error": f"Data processing failed: {e}"}
+        report["prompt_tokens"] = prompt_tokens
+        if known is not None: report = merge_watchlist_report(run_state.get("report", {}), report, len(changed), run_state["updated"], max_items)
+        status = "offline" if is_offline else "updated"
+
+    state = save(build_run_state(known, collected, query, date_restrict_code, report, max_seen)) if save and not is_offline else None
+    return {**result, "status": status, "stage": None, "report": report, "changed": len(changed), "state": state}
+
+
+def last_run(state):
+    try: return datetime.strptime(state["updated"], RUN_TIME_FORMAT)
+    except (TypeError, KeyError, ValueError): return datetime.min
+
+
+def due_watchlists(entries, max_age, now=None):
+    """[(watchlist, état du dernier run)] dont le rapport date d'au moins max_age secondes, du plus ancien au plus récent."""
+    now = now or datetime.now()
+    due = [(wl, state) for wl, state in entries if (now - last_run(state)).total_seconds() >= max_age]
+    return sorted(due, key=lambda d: last_run(d[1]))